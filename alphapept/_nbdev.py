@@ -30,14 +30,21 @@ index = {"print_settings": "00_settings.ipynb",
          "gaussian_estimator": "02_io.ipynb",
          "centroid_data": "02_io.ipynb",
          "get_most_abundant": "02_io.ipynb",
+         "deisotope_spectrum": "02_io.ipynb",
+         "deisotope_ms2": "02_io.ipynb",
+         "DELTA_M": "04_feature_finding.ipynb",
          "list_to_numpy_f32": "02_io.ipynb",
          "HDF_File": "02_io.ipynb",
          "HDF_File.read": "02_io.ipynb",
          "HDF_File.write": "02_io.ipynb",
+         "HDF_File.append": "02_io.ipynb",
          "MS_Data_File": "02_io.ipynb",
          "MS_Data_File.import_raw_DDA_data": "02_io.ipynb",
          "index_ragged_list": "02_io.ipynb",
+         "MS_Data_File.save_deisotoped_ms2": "02_io.ipynb",
          "MS_Data_File.read_DDA_query_data": "02_io.ipynb",
+         "MS_Data_File.read_DDA_query_fragments": "02_io.ipynb",
+         "QUERY_FRAGMENT_BLOCK": "02_io.ipynb",
          "raw_conversion": "02_io.ipynb",
          "get_missed_cleavages": "03_fasta.ipynb",
          "cleave_sequence": "03_fasta.ipynb",
@@ -60,17 +67,38 @@ index = {"print_settings": "00_settings.ipynb",
          "get_unique_peptides": "03_fasta.ipynb",
          "generate_peptides": "03_fasta.ipynb",
          "check_peptide": "03_fasta.ipynb",
+         "encode_mods": "03_fasta.ipynb",
+         "insert_code": "03_fasta.ipynb",
+         "encoded_fixed_mods": "03_fasta.ipynb",
+         "encoded_terminal_mod": "03_fasta.ipynb",
+         "encoded_unique": "03_fasta.ipynb",
+         "encoded_variable_mods_terminal": "03_fasta.ipynb",
+         "encoded_parse": "03_fasta.ipynb",
+         "encoded_decoy": "03_fasta.ipynb",
+         "encoded_isoform": "03_fasta.ipynb",
+         "encoded_isoforms": "03_fasta.ipynb",
+         "encoded_modify": "03_fasta.ipynb",
+         "get_cleavage_windows": "03_fasta.ipynb",
+         "digest_encoded": "03_fasta.ipynb",
+         "generate_peptides_block": "03_fasta.ipynb",
+         "DECOY_TAG": "03_fasta.ipynb",
          "get_precmass": "03_fasta.ipynb",
          "get_fragmass": "03_fasta.ipynb",
          "get_frag_dict": "03_fasta.ipynb",
          "get_spectrum": "03_fasta.ipynb",
          "get_spectra": "03_fasta.ipynb",
+         "FastaBlock": "03_fasta.ipynb",
+         "parse_fasta_buffer": "03_fasta.ipynb",
+         "parse_fasta_chunk": "03_fasta.ipynb",
+         "read_fasta_blocks": "03_fasta.ipynb",
          "read_fasta_file": "03_fasta.ipynb",
          "read_fasta_file_entries": "03_fasta.ipynb",
          "check_sequence": "03_fasta.ipynb",
+         "FASTA_CHUNK_SIZE": "03_fasta.ipynb",
          "add_to_pept_dict": "03_fasta.ipynb",
          "merge_pept_dicts": "03_fasta.ipynb",
          "generate_fasta_list": "03_fasta.ipynb",
+         "FastaMap": "03_fasta.ipynb",
          "generate_database": "03_fasta.ipynb",
          "generate_spectra": "03_fasta.ipynb",
          "block_idx": "03_fasta.ipynb",
@@ -80,7 +108,40 @@ index = {"print_settings": "00_settings.ipynb",
          "mass_dict": "10_constants.ipynb",
          "pept_dict_from_search": "03_fasta.ipynb",
          "save_database": "03_fasta.ipynb",
+         "save_database_proteins": "03_fasta.ipynb",
+         "save_database_fasta": "03_fasta.ipynb",
+         "get_range_positions": "03_fasta.ipynb",
+         "PeptideProteinMap": "03_fasta.ipynb",
          "read_database": "03_fasta.ipynb",
+         "read_database_slice": "03_fasta.ipynb",
+         "PRECURSOR_ARRAYS": "03_fasta.ipynb",
+         "FRAGMENT_ARRAYS": "03_fasta.ipynb",
+         "get_digestion_settings": "03_fasta.ipynb",
+         "save_database_shard": "03_fasta.ipynb",
+         "get_database_arrays": "03_fasta.ipynb",
+         "take_database_arrays": "03_fasta.ipynb",
+         "concatenate_database_arrays": "03_fasta.ipynb",
+         "read_database_chunks": "03_fasta.ipynb",
+         "merge_database_shards": "03_fasta.ipynb",
+         "append_database_arrays": "03_fasta.ipynb",
+         "merge_database_peptides": "03_fasta.ipynb",
+         "digest_fasta_block_to_shard": "03_fasta.ipynb",
+         "save_database_parallel": "03_fasta.ipynb",
+         "DATABASE_MERGE_CHUNK": "03_fasta.ipynb",
+         "DATABASE_IGNORED_SETTINGS": "03_fasta.ipynb",
+         "MERGE_ARRAYS": "03_fasta.ipynb",
+         "DatabaseCache": "03_fasta.ipynb",
+         "get_fragment_index": "03_fasta.ipynb",
+         "save_fragment_index": "03_fasta.ipynb",
+         "read_fragment_index": "03_fasta.ipynb",
+         "read_fragment_index_slice": "03_fasta.ipynb",
+         "FRAGMENT_INDEX_CHUNK": "03_fasta.ipynb",
+         "get_database_memmap_path": "03_fasta.ipynb",
+         "save_database_memmap": "03_fasta.ipynb",
+         "read_database_memmap": "03_fasta.ipynb",
+         "MEMMAP_ARRAYS": "03_fasta.ipynb",
+         "FRAGMENT_INDEX_ARRAYS": "03_fasta.ipynb",
+         "append_database_fasta": "03_fasta.ipynb",
          "connect_centroids_unidirection": "04_feature_finding.ipynb",
          "find_centroid_connections": "04_feature_finding.ipynb",
          "convert_connections_to_array": "04_feature_finding.ipynb",
@@ -102,7 +163,6 @@ index = {"print_settings": "00_settings.ipynb",
          "remove_duplicates": "04_feature_finding.ipynb",
          "get_hill_data": "04_feature_finding.ipynb",
          "check_isotope_pattern": "04_feature_finding.ipynb",
-         "DELTA_M": "04_feature_finding.ipynb",
          "DELTA_S": "04_feature_finding.ipynb",
          "maximum_offset": "04_feature_finding.ipynb",
          "correlate": "04_feature_finding.ipynb",
@@ -137,24 +197,84 @@ index = {"print_settings": "00_settings.ipynb",
          "compare_frags": "05_search.ipynb",
          "ppm_to_dalton": "05_search.ipynb",
          "get_idxs": "05_search.ipynb",
+         "get_prec_tols": "05_search.ipynb",
+         "compare_spectrum": "05_search.ipynb",
+         "get_compare_spectrum_costs": "05_search.ipynb",
          "compare_spectrum_parallel": "05_search.ipynb",
+         "get_query_tiles": "05_search.ipynb",
+         "get_compare_tile_costs": "05_search.ipynb",
+         "compare_spectrum_tiles": "05_search.ipynb",
+         "compare_spectrum_fragment_index": "05_search.ipynb",
          "query_data_to_features": "05_search.ipynb",
+         "gather_query_fragments": "05_search.ipynb",
+         "get_feature_fragments": "05_search.ipynb",
+         "time_kernel": "05_search.ipynb",
+         "count_fragment_comparisons": "05_search.ipynb",
+         "get_search_stats": "05_search.ipynb",
+         "combine_search_stats": "05_search.ipynb",
+         "SEARCH_STATS_BINS": "05_search.ipynb",
+         "SEARCH_STATS_FIELDS": "05_search.ipynb",
          "get_psms": "05_search.ipynb",
+         "TILES_PER_WORKER": "05_search.ipynb",
+         "TOP_N": "05_search.ipynb",
+         "score_candidates": "05_search.ipynb",
+         "rescore_candidates": "05_search.ipynb",
+         "get_top_psms": "05_search.ipynb",
+         "get_delta_psms": "05_search.ipynb",
+         "bin_spectra": "05_search.ipynb",
+         "spectrum_similarity": "05_search.ipynb",
+         "get_top_bins": "05_search.ipynb",
+         "get_cluster_index": "05_search.ipynb",
+         "cluster_spectra_index": "05_search.ipynb",
+         "cluster_spectra": "05_search.ipynb",
+         "consensus_spectra": "05_search.ipynb",
+         "get_candidate_psms": "05_search.ipynb",
+         "CLUSTER_BIN_WIDTH": "05_search.ipynb",
+         "CLUSTER_TOP_N": "05_search.ipynb",
+         "CLUSTER_INDEX_PEAKS": "05_search.ipynb",
+         "CLUSTER_KEY_OFFSET": "05_search.ipynb",
+         "CLUSTER_CONSENSUS_FRACTION": "05_search.ipynb",
          "frag_delta": "05_search.ipynb",
          "intensity_fraction": "05_search.ipynb",
          "add_column": "05_search.ipynb",
          "remove_column": "05_search.ipynb",
+         "PSMColumns": "05_search.ipynb",
          "get_hits": "05_search.ipynb",
+         "count_hits": "05_search.ipynb",
+         "score_hits": "05_search.ipynb",
          "score": "11_interface.ipynb",
          "LOSS_DICT": "05_search.ipynb",
          "LOSSES": "05_search.ipynb",
+         "SCORE_FIELDS": "05_search.ipynb",
          "get_sequences": "05_search.ipynb",
          "get_score_columns": "05_search.ipynb",
          "plot_psms": "05_search.ipynb",
+         "SearchResultCache": "05_search.ipynb",
          "store_hdf": "05_search.ipynb",
+         "set_calibrated_tolerances": "05_search.ipynb",
+         "get_db_data": "05_search.ipynb",
+         "save_psms": "05_search.ipynb",
+         "save_cluster_candidates": "05_search.ipynb",
+         "read_cluster_candidates": "05_search.ipynb",
+         "save_search_stats": "05_search.ipynb",
          "search_db": "05_search.ipynb",
+         "ION_COLUMNS": "05_search.ipynb",
+         "get_memory_chunks": "05_search.ipynb",
+         "search_db_chunked": "05_search.ipynb",
+         "QUERY_FRAGMENT_BYTES": "05_search.ipynb",
+         "DB_FRAGMENT_BYTES": "05_search.ipynb",
+         "PSM_BYTES": "05_search.ipynb",
+         "read_cluster_run": "05_search.ipynb",
+         "get_cluster_groups": "05_search.ipynb",
+         "search_cluster_group": "05_search.ipynb",
+         "search_db_clustered": "05_search.ipynb",
+         "QueryDataCache": "05_search.ipynb",
+         "QUERY_DATA_CACHE": "05_search.ipynb",
          "search_fasta_block": "05_search.ipynb",
          "filter_top_n": "05_search.ipynb",
+         "PSMTopN": "05_search.ipynb",
+         "get_sequence_fragments": "05_search.ipynb",
+         "extract_hits": "05_search.ipynb",
          "ion_extractor": "05_search.ipynb",
          "search_parallel": "05_search.ipynb",
          "filter_score": "06_score.ipynb",
@@ -172,6 +292,7 @@ index = {"print_settings": "00_settings.ipynb",
          "score_ML": "06_score.ipynb",
          "filter_with_ML": "06_score.ipynb",
          "assign_proteins": "06_score.ipynb",
+         "get_peptide_protein_map": "06_score.ipynb",
          "get_shared_proteins": "06_score.ipynb",
          "get_protein_groups": "06_score.ipynb",
          "perform_protein_grouping": "06_score.ipynb",
@@ -245,6 +366,7 @@ index = {"print_settings": "00_settings.ipynb",
          "get_file_summary": "11_interface.ipynb",
          "get_summary": "11_interface.ipynb",
          "parallel_execute": "11_interface.ipynb",
+         "SEARCH_MEMORY_MIN": "11_interface.ipynb",
          "bcolors": "11_interface.ipynb",
          "is_port_in_use": "11_interface.ipynb",
          "run_cli": "11_interface.ipynb",
@@ -271,8 +393,11 @@ index = {"print_settings": "00_settings.ipynb",
          "compile_function": "12_performance.ipynb",
          "__copy_func": "12_performance.ipynb",
          "DYNAMIC_COMPILATION_ENABLED": "12_performance.ipynb",
+         "get_chunk_bounds": "12_performance.ipynb",
          "performance_function": "12_performance.ipynb",
+         "DYNAMIC_CHUNKS_PER_WORKER": "12_performance.ipynb",
          "AlphaPool": "12_performance.ipynb",
+         "bounded_imap": "12_performance.ipynb",
          "mq_ouput_files": "13_export.ipynb",
          "mod_translation": "13_export.ipynb",
          "remove_mods": "13_export.ipynb",
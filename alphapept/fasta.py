@@ -3,11 +3,23 @@
 __all__ = ['get_missed_cleavages', 'cleave_sequence', 'count_missed_cleavages', 'count_internal_cleavages', 'parse',
            'list_to_numba', 'get_decoy_sequence', 'swap_KR', 'swap_AL', 'get_decoys', 'add_decoy_tag', 'add_fixed_mods',
            'add_variable_mod', 'get_isoforms', 'add_variable_mods', 'add_fixed_mod_terminal', 'add_fixed_mods_terminal',
-           'add_variable_mods_terminal', 'get_unique_peptides', 'generate_peptides', 'check_peptide', 'get_precmass',
-           'get_fragmass', 'get_frag_dict', 'get_spectrum', 'get_spectra', 'read_fasta_file', 'read_fasta_file_entries',
-           'check_sequence', 'add_to_pept_dict', 'merge_pept_dicts', 'generate_fasta_list', 'generate_database',
-           'generate_spectra', 'block_idx', 'blocks', 'digest_fasta_block', 'generate_database_parallel', 'mass_dict',
-           'pept_dict_from_search', 'save_database', 'read_database']
+           'add_variable_mods_terminal', 'get_unique_peptides', 'generate_peptides', 'check_peptide', 'encode_mods',
+           'insert_code', 'encoded_fixed_mods', 'encoded_terminal_mod', 'encoded_unique',
+           'encoded_variable_mods_terminal', 'encoded_parse', 'encoded_decoy', 'encoded_isoform', 'encoded_isoforms',
+           'encoded_modify', 'get_cleavage_windows', 'digest_encoded', 'generate_peptides_block', 'DECOY_TAG',
+           'get_precmass', 'get_fragmass', 'get_frag_dict', 'get_spectrum', 'get_spectra', 'FastaBlock',
+           'parse_fasta_buffer', 'parse_fasta_chunk', 'read_fasta_blocks', 'read_fasta_file', 'read_fasta_file_entries',
+           'check_sequence', 'FASTA_CHUNK_SIZE', 'add_to_pept_dict', 'merge_pept_dicts', 'generate_fasta_list',
+           'FastaMap', 'generate_database', 'generate_spectra', 'block_idx', 'blocks', 'digest_fasta_block',
+           'generate_database_parallel', 'mass_dict', 'pept_dict_from_search', 'save_database',
+           'save_database_proteins', 'save_database_fasta', 'get_range_positions', 'PeptideProteinMap', 'read_database',
+           'read_database_slice', 'PRECURSOR_ARRAYS', 'FRAGMENT_ARRAYS', 'get_digestion_settings',
+           'save_database_shard', 'get_database_arrays', 'take_database_arrays', 'concatenate_database_arrays',
+           'read_database_chunks', 'merge_database_shards', 'append_database_arrays', 'merge_database_peptides',
+           'digest_fasta_block_to_shard', 'save_database_parallel', 'DATABASE_MERGE_CHUNK', 'DATABASE_IGNORED_SETTINGS',
+           'MERGE_ARRAYS', 'DatabaseCache', 'get_fragment_index', 'save_fragment_index', 'read_fragment_index',
+           'read_fragment_index_slice', 'FRAGMENT_INDEX_CHUNK', 'get_database_memmap_path', 'save_database_memmap',
+           'read_database_memmap', 'MEMMAP_ARRAYS', 'FRAGMENT_INDEX_ARRAYS', 'append_database_fasta']
 
 # Cell
 from alphapept import constants
@@ -516,6 +528,502 @@ def check_peptide(peptide:str, AAs:set)->bool:
     else:
         return False
 
+# Cell
+import numpy as np
+from numba import types
+
+DECOY_TAG = np.frombuffer(b'_decoy', dtype=np.uint8).copy()
+
+def encode_mods(mods:list, terminal:bool=False)->tuple:
+    """
+    Encode modifications as arrays for the digestion with numba.
+    Args:
+        mods (list of str): list of modifications, e.g. oxM or a<^.
+        terminal (bool): If True, the modifications are terminal modifications. (Default: False)
+    Raises:
+        ValueError: if a terminal modification is invalid.
+    Returns:
+        Tuple[np.ndarray(np.int8), np.ndarray(np.uint8), np.ndarray(np.int64), np.ndarray(np.uint8)]: (kind, amino acid, indptr, code) of the modifications.
+        The kind of terminal modifications is 0 for any n-term, 1 for any c-term, 2 for a specific AA at the n-term and 3 for a specific AA at the c-term.
+        The code is the modified amino acid or, for terminal modifications, the prefix that is added.
+    """
+    kinds = np.zeros(len(mods), dtype=np.int8)
+    aas = np.zeros(len(mods), dtype=np.uint8)
+    indptr = np.zeros(len(mods) + 1, dtype=np.int64)
+    codes = []
+
+    for i, mod in enumerate(mods):
+        aas[i] = ord(mod[-1])
+        if terminal:
+            if "<^" in mod:
+                kinds[i] = 0
+            elif ">^" in mod:
+                kinds[i] = 1
+            elif "<" in mod:
+                kinds[i] = 2
+            elif ">" in mod:
+                kinds[i] = 3
+            else:
+                raise ValueError("Invalid terminal modification {}.".format(mod))
+            code = mod[:-2]
+        else:
+            code = mod
+        codes.append(code.encode())
+        indptr[i + 1] = indptr[i] + len(codes[-1])
+
+    return kinds, aas, indptr, np.frombuffer(b''.join(codes), dtype=np.uint8).copy()
+
+@njit
+def insert_code(peptide:np.ndarray, position:int, code:np.ndarray)->np.ndarray:
+    """
+    Insert a modification code into an encoded peptide.
+    """
+    new = np.empty(len(peptide) + len(code), dtype=np.uint8)
+    new[:position] = peptide[:position]
+    new[position:position + len(code)] = code
+    new[position + len(code):] = peptide[position:]
+
+    return new
+
+@njit
+def encoded_fixed_mods(peptide:np.ndarray, aas:np.ndarray, indptr:np.ndarray, codes:np.ndarray)->np.ndarray:
+    """
+    Add fixed modifications to an encoded peptide. See add_fixed_mods.
+    """
+    for j in range(len(aas)):
+        code = codes[indptr[j]:indptr[j + 1]]
+        n_sites = np.sum(peptide == aas[j])
+        if n_sites == 0:
+            continue
+
+        new = np.empty(len(peptide) + n_sites * (len(code) - 1), dtype=np.uint8)
+        k = 0
+        for c in peptide:
+            if c == aas[j]:
+                new[k:k + len(code)] = code
+                k += len(code)
+            else:
+                new[k] = c
+                k += 1
+        peptide = new
+
+    return peptide
+
+@njit
+def encoded_terminal_mod(peptide:np.ndarray, kind:int, aa:int, code:np.ndarray)->np.ndarray:
+    """
+    Add a terminal modification to an encoded peptide. See add_fixed_mod_terminal.
+    """
+    if kind == 0:
+        return insert_code(peptide, 0, code)
+    elif len(peptide) == 0:
+        return peptide
+    elif kind == 1:
+        return insert_code(peptide, len(peptide) - 1, code)
+    elif kind == 2:
+        if peptide[0] == aa:
+            return insert_code(peptide, 0, code)
+    else:
+        if peptide[-1] == aa:
+            return insert_code(peptide, len(peptide) - 1, code)
+
+    return peptide
+
+@njit
+def encoded_unique(peptides:List)->List:
+    """
+    Unique encoded peptides in the order of their first occurrence. See get_unique_peptides.
+    """
+    unique = List()
+    for peptide in peptides:
+        found = False
+        for other in unique:
+            if (len(other) == len(peptide)) and np.all(other == peptide):
+                found = True
+                break
+        if not found:
+            unique.append(peptide)
+
+    return unique
+
+@njit
+def encoded_variable_mods_terminal(peptides:List, kinds:np.ndarray, aas:np.ndarray, indptr:np.ndarray, codes:np.ndarray)->List:
+    """
+    Add variable terminal modifications to encoded peptides. See add_variable_mods_terminal.
+    """
+    if len(kinds) == 0:
+        return peptides
+
+    new_peptides = List()
+    for peptide in peptides:
+        new_peptides.append(peptide)
+
+    for j in range(len(kinds)):
+        if (kinds[j] == 0) or (kinds[j] == 2):
+            for peptide in peptides:
+                new_peptides.append(encoded_terminal_mod(peptide, kinds[j], aas[j], codes[indptr[j]:indptr[j + 1]]))
+    new_peptides = encoded_unique(new_peptides)
+
+    # C-terminal modifications are also added to peptides with another c-terminal modification
+    for j in range(len(kinds)):
+        if (kinds[j] == 1) or (kinds[j] == 3):
+            n_peptides = len(new_peptides)
+            for i in range(n_peptides):
+                new_peptides.append(encoded_terminal_mod(new_peptides[i], kinds[j], aas[j], codes[indptr[j]:indptr[j + 1]]))
+
+    return encoded_unique(new_peptides)
+
+@njit
+def encoded_parse(peptide:np.ndarray)->(np.ndarray, np.ndarray):
+    """
+    Bounds of the (modified) amino acids of an encoded peptide. See parse.
+    """
+    n_chars = len(peptide)
+    for i in range(len(peptide)):
+        if peptide[i] == 95: # _
+            n_chars = i
+            break
+
+    n_tokens = 0
+    for i in range(n_chars):
+        if (peptide[i] >= 65) and (peptide[i] <= 90):
+            n_tokens += 1
+
+    starts = np.empty(n_tokens, dtype=np.int64)
+    ends = np.empty(n_tokens, dtype=np.int64)
+    start = 0
+    k = 0
+    for i in range(n_chars):
+        if (peptide[i] >= 65) and (peptide[i] <= 90):
+            starts[k] = start
+            ends[k] = i + 1
+            start = i + 1
+            k += 1
+
+    return starts, ends
+
+@njit
+def encoded_decoy(peptide:np.ndarray, pseudo_reverse:bool, AL_swap:bool, KR_swap:bool)->np.ndarray:
+    """
+    Get the decoy of an encoded peptide. See get_decoy_sequence.
+    """
+    starts, ends = encoded_parse(peptide)
+    n_tokens = len(starts)
+
+    order = np.arange(n_tokens)[::-1].copy()
+    if pseudo_reverse and (n_tokens > 0):
+        # Keep the C-terminal amino acid
+        order[:-1] -= 1
+        order[-1] = n_tokens - 1
+
+    if AL_swap:
+        i = 0
+        while i < n_tokens - 1:
+            token = order[i]
+            if (ends[token] - starts[token] == 1) and ((peptide[starts[token]] == 65) or (peptide[starts[token]] == 76)): # A, L
+                order[i] = order[i + 1]
+                order[i + 1] = token
+                i += 1
+            i += 1
+
+    decoy = np.empty(np.sum(ends - starts), dtype=np.uint8)
+    k = 0
+    for token in order:
+        decoy[k:k + ends[token] - starts[token]] = peptide[starts[token]:ends[token]]
+        k += ends[token] - starts[token]
+
+    if KR_swap and (n_tokens > 0):
+        token = order[-1]
+        if ends[token] - starts[token] == 1:
+            if decoy[-1] == 75: # K
+                decoy[-1] = 82
+            elif decoy[-1] == 82: # R
+                decoy[-1] = 75
+
+    return decoy
+
+@njit
+def encoded_isoform(peptide:np.ndarray, starts:np.ndarray, ends:np.ndarray, mods:np.ndarray, indptr:np.ndarray, codes:np.ndarray, suffix:np.ndarray)->np.ndarray:
+    """
+    Join the (modified) amino acids of an encoded peptide and a suffix.
+    """
+    length = len(suffix)
+    for i in range(len(starts)):
+        if mods[i] >= 0:
+            length += indptr[mods[i] + 1] - indptr[mods[i]]
+        else:
+            length += ends[i] - starts[i]
+
+    isoform = np.empty(length, dtype=np.uint8)
+    k = 0
+    for i in range(len(starts)):
+        if mods[i] >= 0:
+            code = codes[indptr[mods[i]]:indptr[mods[i] + 1]]
+        else:
+            code = peptide[starts[i]:ends[i]]
+        isoform[k:k + len(code)] = code
+        k += len(code)
+    isoform[k:] = suffix
+
+    return isoform
+
+@njit
+def encoded_isoforms(peptide:np.ndarray, aas:np.ndarray, indptr:np.ndarray, codes:np.ndarray, isoforms_max:int, n_modifications_max:int, suffix:np.ndarray, isoforms:List):
+    """
+    Add the modified forms of an encoded peptide with variable modifications to a list. See get_isoforms.
+    The positions of the modifications of each form are stored as indices to the modifications per amino acid.
+    """
+    starts, ends = encoded_parse(peptide)
+    n_tokens = len(starts)
+
+    # The amino acid of unmodified tokens
+    unmodified = np.zeros(n_tokens, dtype=np.uint8)
+    for i in range(n_tokens):
+        if ends[i] - starts[i] == 1:
+            unmodified[i] = peptide[starts[i]]
+
+    level_mods = np.full((1, n_tokens), -1, dtype=np.int8)
+    level_min = np.zeros(1, dtype=np.int64)
+
+    isoforms.append(encoded_isoform(peptide, starts, ends, level_mods[0], indptr, codes, suffix))
+    n_isoforms = 1
+
+    iteration = 0
+    while n_isoforms < isoforms_max:
+        if (n_modifications_max > 0) and (iteration >= n_modifications_max):
+            break
+
+        n_new = 0
+        for e in range(len(level_min)):
+            for j in range(len(aas)):
+                for i in range(level_min[e], n_tokens):
+                    if (level_mods[e, i] == -1) and (unmodified[i] == aas[j]):
+                        n_new += 1
+
+        if n_new == 0:
+            break
+
+        new_mods = np.empty((n_new, n_tokens), dtype=np.int8)
+        new_min = np.empty(n_new, dtype=np.int64)
+        k = 0
+        for e in range(len(level_min)):
+            for j in range(len(aas)):
+                for i in range(level_min[e], n_tokens):
+                    if (level_mods[e, i] == -1) and (unmodified[i] == aas[j]):
+                        new_mods[k] = level_mods[e]
+                        new_mods[k, i] = j
+                        new_min[k] = i
+                        k += 1
+
+        if (n_new > 1) and np.all(new_mods[0] == new_mods[1]):
+            new_mods = new_mods[:1].copy()
+            new_min = new_min[:1].copy()
+
+        for e in range(len(new_min)):
+            if n_isoforms < isoforms_max:
+                isoforms.append(encoded_isoform(peptide, starts, ends, new_mods[e], indptr, codes, suffix))
+                n_isoforms += 1
+
+        level_mods = new_mods
+        level_min = new_min
+        iteration += 1
+
+@njit
+def encoded_modify(peptide:np.ndarray, fixed_mods:tuple, fixed_mods_terminal:tuple, variable_mods_terminal:tuple, variable_mods:tuple, isoforms_max:int, n_modifications_max:int, suffix:np.ndarray, peptides:List):
+    """
+    Add all modified forms of an encoded peptide to a list. See generate_peptides.
+    """
+    peptide = encoded_fixed_mods(peptide, fixed_mods[1], fixed_mods[2], fixed_mods[3])
+
+    kinds, aas, indptr, codes = fixed_mods_terminal
+    for j in range(len(kinds)):
+        peptide = encoded_terminal_mod(peptide, kinds[j], aas[j], codes[indptr[j]:indptr[j + 1]])
+
+    mod_peptides = List()
+    mod_peptides.append(peptide)
+    mod_peptides = encoded_variable_mods_terminal(mod_peptides, variable_mods_terminal[0], variable_mods_terminal[1], variable_mods_terminal[2], variable_mods_terminal[3])
+
+    if len(variable_mods[1]) == 0:
+        for mod_peptide in mod_peptides:
+            peptides.append(np.concatenate((mod_peptide, suffix)))
+    else:
+        # The number of isoforms is limited per cleaved peptide, see add_variable_mods
+        max_ = max(isoforms_max - 2 * len(mod_peptides) + 1, 0)
+        for mod_peptide in mod_peptides:
+            encoded_isoforms(mod_peptide, variable_mods[1], variable_mods[2], variable_mods[3], max_, n_modifications_max, suffix, peptides)
+
+@njit
+def get_cleavage_windows(cutpos:np.ndarray, n_missed_cleavages:int)->(np.ndarray, np.ndarray):
+    """
+    Bounds of the cleaved sequences with up to n_missed_cleavages in the order of cleave_sequence.
+    Args:
+        cutpos (np.ndarray): cleavage sites including the start and end of the sequence.
+        n_missed_cleavages (int): the number of max missed cleavages.
+    Returns:
+        np.ndarray: start of each cleaved sequence.
+        np.ndarray: end of each cleaved sequence.
+    """
+    n_pieces = len(cutpos) - 1
+    n_windows = n_pieces
+    for n_missed in range(1, n_missed_cleavages + 1):
+        n_windows += max(n_pieces - n_missed, 0)
+
+    starts = np.zeros(n_windows, dtype=np.int64)
+    ends = np.zeros(n_windows, dtype=np.int64)
+    starts[:n_pieces] = cutpos[:-1]
+    ends[:n_pieces] = cutpos[1:]
+
+    k = n_pieces
+    for n_missed in range(1, n_missed_cleavages + 1):
+        # The first window of get_missed_cleavages is empty
+        for i in range(1, n_pieces - n_missed):
+            starts[k + i] = cutpos[i - 1]
+            ends[k + i] = cutpos[i + n_missed]
+        k += max(n_pieces - n_missed, 0)
+
+    return starts, ends
+
+@njit
+def digest_encoded(buffer:np.ndarray, offsets:np.ndarray, cut_indptr:np.ndarray, cuts:np.ndarray, n_missed_cleavages:int, pep_length_min:int, pep_length_max:int, valid_aas:np.ndarray, fixed_mods:tuple, fixed_mods_terminal:tuple, variable_mods_terminal:tuple, variable_mods:tuple, isoforms_max:int, n_modifications_max:int, pseudo_reverse:bool, AL_swap:bool, KR_swap:bool)->(np.ndarray, np.ndarray, np.ndarray):
+    """
+    Digest encoded protein sequences and add modifications and decoys.
+    Args:
+        buffer (np.ndarray): concatenated protein sequences.
+        offsets (np.ndarray): bounds of the protein sequences in the buffer.
+        cut_indptr (np.ndarray): bounds of the cleavage sites of each protein in cuts.
+        cuts (np.ndarray): cleavage sites relative to the start of each protein.
+        valid_aas (np.ndarray): True for all characters that are valid amino acids, see check_peptide.
+        See generate_peptides and encode_mods for the other arguments.
+    Returns:
+        np.ndarray: concatenated peptide sequences.
+        np.ndarray: bounds of the peptide sequences.
+        np.ndarray: the protein of each peptide.
+    """
+    peptides = List.empty_list(types.uint8[::1])
+    proteins = List.empty_list(types.int64)
+    empty = np.zeros(0, dtype=np.uint8)
+
+    for p in range(len(offsets) - 1):
+        sequence = buffer[offsets[p]:offsets[p + 1]]
+
+        cutpos = np.empty(cut_indptr[p + 1] - cut_indptr[p] + 2, dtype=np.int64)
+        cutpos[0] = 0
+        cutpos[1:-1] = cuts[cut_indptr[p]:cut_indptr[p + 1]]
+        cutpos[-1] = len(sequence)
+        starts, ends = get_cleavage_windows(np.minimum(cutpos, len(sequence)), n_missed_cleavages)
+
+        for start, end in zip(starts, ends):
+            if (end - start < pep_length_min) or (end - start > pep_length_max):
+                continue
+
+            peptide = sequence[start:end].copy()
+            if not np.all(valid_aas[peptide]):
+                continue
+
+            n_peptides = len(peptides)
+            encoded_modify(peptide, fixed_mods, fixed_mods_terminal, variable_mods_terminal, variable_mods, isoforms_max, n_modifications_max, empty, peptides)
+
+            decoy = encoded_decoy(peptide, pseudo_reverse, AL_swap, KR_swap)
+            encoded_modify(decoy, fixed_mods, fixed_mods_terminal, variable_mods_terminal, variable_mods, isoforms_max, n_modifications_max, DECOY_TAG, peptides)
+
+            for i in range(len(peptides) - n_peptides):
+                proteins.append(p)
+
+    indptr = np.zeros(len(peptides) + 1, dtype=np.int64)
+    for i in range(len(peptides)):
+        indptr[i + 1] = indptr[i] + len(peptides[i])
+
+    peptide_buffer = np.empty(indptr[-1], dtype=np.uint8)
+    for i in range(len(peptides)):
+        peptide_buffer[indptr[i]:indptr[i + 1]] = peptides[i]
+
+    protein_idx = np.empty(len(proteins), dtype=np.int64)
+    for i in range(len(proteins)):
+        protein_idx[i] = proteins[i]
+
+    return peptide_buffer, indptr, protein_idx
+
+def generate_peptides_block(sequences:list, **kwargs)->list:
+    """
+    Get modified peptides (fixed and variable mods) and decoys from a list of protein sequences. See generate_peptides.
+    Args:
+        sequences (list of str): the protein sequences.
+    Returns:
+        list (of list of str): all modified peptides of each protein.
+    """
+    pattern = re.compile(constants.protease_dict[kwargs['protease']])
+
+    mods_variable_r = {}
+    for _ in kwargs['mods_variable']:
+        mods_variable_r[_[-1]] = _
+
+    fixed_mods = encode_mods(kwargs['mods_fixed'])
+    fixed_mods_terminal = encode_mods(kwargs['mods_fixed_terminal'], terminal=True)
+    variable_mods_terminal = encode_mods(kwargs['mods_variable_terminal'], terminal=True)
+    variable_mods = encode_mods(list(mods_variable_r.values()))
+
+    valid_aas = np.ones(256, dtype=np.bool_)
+    valid_aas[128:] = False
+    for _ in range(ord('A'), ord('Z') + 1):
+        valid_aas[_] = chr(_) in constants.AAs
+
+    all_peptides = [None for _ in sequences]
+
+    # Protein terminal modifications
+    proteins = []
+    protein_sequences = []
+    cuts = []
+    cut_indptr = [0]
+    for idx, sequence in enumerate(sequences):
+        if not sequence.isascii():
+            all_peptides[idx] = generate_peptides(sequence, **kwargs)
+            continue
+
+        mod_sequences = add_fixed_mods_terminal([sequence], kwargs['mods_fixed_terminal_prot'])
+        mod_sequences = add_variable_mods_terminal(mod_sequences, kwargs['mods_variable_terminal_prot'])
+
+        for mod_sequence in mod_sequences:
+            proteins.append(idx)
+            protein_sequences.append(mod_sequence)
+            cuts.extend([m.start()+1 for m in pattern.finditer(mod_sequence)])
+            cut_indptr.append(len(cuts))
+
+    offsets = np.zeros(len(protein_sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(_) for _ in protein_sequences])
+
+    buffer, indptr, protein_idx = digest_encoded(
+        np.frombuffer(''.join(protein_sequences).encode(), dtype=np.uint8),
+        offsets,
+        np.array(cut_indptr, dtype=np.int64),
+        np.array(cuts, dtype=np.int64),
+        kwargs['n_missed_cleavages'],
+        kwargs['pep_length_min'],
+        kwargs['pep_length_max'],
+        valid_aas,
+        fixed_mods,
+        fixed_mods_terminal,
+        variable_mods_terminal,
+        variable_mods,
+        kwargs['isoforms_max'],
+        kwargs['n_modifications_max'] or 0,
+        kwargs.get('pseudo_reverse', False),
+        kwargs.get('AL_swap', False),
+        kwargs.get('KR_swap', False),
+    )
+
+    text = buffer.tobytes().decode()
+    indptr = indptr.tolist()
+    peptides = [text[s:e] for s, e in zip(indptr[:-1], indptr[1:])]
+
+    protein_idx = np.array(proteins, dtype=np.int64)[protein_idx]
+    bounds = np.searchsorted(protein_idx, np.arange(len(sequences) + 1)).tolist()
+    for idx in range(len(sequences)):
+        if all_peptides[idx] is None:
+            all_peptides[idx] = peptides[bounds[idx]:bounds[idx + 1]]
+
+    return all_peptides
+
+
 # Cell
 from numba import njit
 from numba.typed import List
@@ -648,61 +1156,265 @@ def get_spectra(peptides:numba.typed.List, mass_dict:numba.typed.Dict)->List:
     return spectra
 
 # Cell
-from Bio import SeqIO
 import os
 from glob import glob
 import logging
+import pandas as pd
+
+FASTA_CHUNK_SIZE = 2**22
+
+class FastaBlock():
+    """Columnar block of FASTA entries. The sequences are stored in a single buffer instead of one Python object per entry.
+
+    Args:
+        index (int): Protein index of the first entry.
+        ids (np.ndarray): Protein ids.
+        names (np.ndarray): Protein names, i.e. the first word of the header.
+        descriptions (np.ndarray): Complete headers.
+        sequence_buffer (np.ndarray): Concatenated protein sequences as np.uint8.
+        sequence_indptr (np.ndarray): Start positions of the sequences in sequence_buffer with a trailing end position.
+    """
+    def __init__(self, index:int, ids:np.ndarray, names:np.ndarray, descriptions:np.ndarray, sequence_buffer:np.ndarray, sequence_indptr:np.ndarray):
+        self.index = index
+        self.ids = ids
+        self.names = names
+        self.descriptions = descriptions
+        self.sequence_buffer = sequence_buffer
+        self.sequence_indptr = sequence_indptr
+
+    @classmethod
+    def concatenate(cls, blocks:list, index:int=0):
+        """Concatenate a list of FastaBlocks into a single block starting at index."""
+        indptrs = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for block in blocks:
+            indptrs.append(block.sequence_indptr[1:] - block.sequence_indptr[0] + offset)
+            offset += block.sequence_indptr[-1] - block.sequence_indptr[0]
+
+        return cls(
+            index,
+            np.concatenate([_.ids for _ in blocks]),
+            np.concatenate([_.names for _ in blocks]),
+            np.concatenate([_.descriptions for _ in blocks]),
+            np.concatenate([_.sequence_buffer[_.sequence_indptr[0]:_.sequence_indptr[-1]] for _ in blocks]),
+            np.concatenate(indptrs),
+        )
+
+    def __len__(self)->int:
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        """Get the entry dict of the i-th protein of the block or a FastaBlock for a slice."""
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Only contiguous slices of a FastaBlock are supported.")
+            stop = max(start, stop)
+            indptr = self.sequence_indptr[start:stop+1]
+            return FastaBlock(
+                self.index + start,
+                self.ids[start:stop],
+                self.names[start:stop],
+                self.descriptions[start:stop],
+                self.sequence_buffer[indptr[0]:indptr[-1]],
+                indptr - indptr[0],
+            )
+        return {
+            "id": str(self.ids[key]),
+            "name": str(self.names[key]),
+            "description": str(self.descriptions[key]),
+            "sequence": self.get_sequence(key),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_sequence(self, i:int)->str:
+        """Get the sequence of the i-th protein of the block."""
+        return self.sequence_buffer[self.sequence_indptr[i]:self.sequence_indptr[i+1]].tobytes().decode()
+
+    def get_sequences(self)->list:
+        """Get the sequences of all proteins of the block."""
+        return [self.get_sequence(i) for i in range(len(self))]
+
+    def to_dataframe(self)->pd.DataFrame:
+        """Get the block as a table with the columns of the protein entry dict, indexed by the protein index."""
+        return pd.DataFrame({
+                "id": self.ids.astype(object),
+                "name": self.names.astype(object),
+                "description": self.descriptions.astype(object),
+                "sequence": np.array(self.get_sequences(), dtype=object),
+            },
+            index=pd.RangeIndex(self.index, self.index + len(self)),
+        )
+
+
+@njit
+def parse_fasta_buffer(buffer:np.ndarray)->tuple:
+    """
+    Find the headers and sequences of the FASTA records in a buffer. Text before the first header is ignored.
+    Whitespace is removed from the sequences.
+    Args:
+        buffer (np.ndarray): complete FASTA records as np.uint8.
+    Returns:
+        np.ndarray: start positions of the headers (after the '>').
+        np.ndarray: end positions of the headers.
+        np.ndarray: concatenated sequences as np.uint8.
+        np.ndarray: start positions of the sequences with a trailing end position.
+    """
+    n_records = 0
+    line_start = True
+    for c in buffer:
+        if line_start and (c == 62):
+            n_records += 1
+        line_start = c == 10
+
+    header_starts = np.zeros(n_records, dtype=np.int64)
+    header_ends = np.zeros(n_records, dtype=np.int64)
+    sequence_indptr = np.zeros(n_records + 1, dtype=np.int64)
+    sequence_buffer = np.zeros(len(buffer), dtype=np.uint8)
+
+    record = -1
+    pos = 0
+    in_header = False
+    line_start = True
+    for i in range(len(buffer)):
+        c = buffer[i]
+        if in_header:
+            if c == 10:
+                header_ends[record] = i
+                in_header = False
+        elif line_start and (c == 62):
+            record += 1
+            header_starts[record] = i + 1
+            sequence_indptr[record] = pos
+            in_header = True
+        elif (record >= 0) and (c > 32):
+            sequence_buffer[pos] = c
+            pos += 1
+        line_start = c == 10
+
+    if in_header:
+        header_ends[record] = len(buffer)
+    sequence_indptr[n_records] = pos
+
+    return header_starts, header_ends, sequence_buffer[:pos].copy(), sequence_indptr
+
+
+def parse_fasta_chunk(data:bytes, index:int=0)->FastaBlock:
+    """
+    Parse FASTA records from a bytes chunk. See parse_fasta_buffer.
+    Args:
+        data (bytes): complete FASTA records.
+        index (int): protein index of the first record. (Default: 0)
+    Returns:
+        FastaBlock: the parsed records.
+    """
+    header_starts, header_ends, sequence_buffer, sequence_indptr = parse_fasta_buffer(np.frombuffer(data, dtype=np.uint8))
+
+    descriptions = [data[start:end].decode().rstrip() for start, end in zip(header_starts, header_ends)]
+    names = [_.split(None, 1)[0] if _.strip() else "" for _ in descriptions]
+    ids = [_.split("|")[1] if "|" in _ else _ for _ in names]
+
+    return FastaBlock(
+        index,
+        np.array(ids, dtype=str),
+        np.array(names, dtype=str),
+        np.array(descriptions, dtype=str),
+        sequence_buffer,
+        sequence_indptr,
+    )
+
+
+def read_fasta_blocks(fasta_paths:list, block_size:int=1000, chunk_size:int=FASTA_CHUNK_SIZE, index:int=0):
+    """
+    Read FASTA files in buffered chunks and yield columnar blocks of entries.
+    Args:
+        fasta_paths (str or list of str): fasta path or a list of fasta paths. Entries are numbered consecutively over all files.
+        block_size (int): number of entries per block. (Default: 1000)
+        chunk_size (int): number of bytes read at once. (Default: FASTA_CHUNK_SIZE)
+        index (int): protein index of the first entry. (Default: 0)
+    Yields:
+        FastaBlock: block of up to block_size entries.
+    """
+    if type(fasta_paths) is str:
+        fasta_paths = [fasta_paths]
+
+    block_size = max(1, block_size)
+    pending = []
+    n_pending = 0
+
+    for fasta_path in fasta_paths:
+        with open(fasta_path, "rb") as handle:
+            remainder = b""
+            while True:
+                chunk = handle.read(chunk_size)
+                data = remainder + chunk
+                if chunk:
+                    # Only parse complete records, the last one might continue in the next chunk
+                    cut = data.rfind(b"\n>")
+                    if cut == -1:
+                        remainder = data
+                        continue
+                    remainder = data[cut+1:]
+                    data = data[:cut+1]
+
+                parsed = parse_fasta_chunk(data)
+                if len(parsed) > 0:
+                    pending.append(parsed)
+                    n_pending += len(parsed)
+
+                if n_pending >= block_size:
+                    merged = FastaBlock.concatenate(pending, index)
+                    start = 0
+                    while len(merged) - start >= block_size:
+                        yield merged[start:start+block_size]
+                        start += block_size
+                    pending = [merged[start:]] if start < len(merged) else []
+                    index += start
+                    n_pending -= start
+
+                if not chunk:
+                    break
+
+    if n_pending > 0:
+        yield FastaBlock.concatenate(pending, index)
+
 
 def read_fasta_file(fasta_filename:str=""):
     """
-    Read a FASTA file line by line
+    Read a FASTA file entry by entry
     Args:
         fasta_filename (str): fasta.
     Yields:
         dict {id:str, name:str, description:str, sequence:str}: protein information.
     """
-    with open(fasta_filename, "rt") as handle:
-        iterator = SeqIO.parse(handle, "fasta")
-        while iterator:
-            try:
-                record = next(iterator)
-                parts = record.id.split("|")  # pipe char
-                if len(parts) > 1:
-                    id = parts[1]
-                else:
-                    id = record.name
-                sequence = str(record.seq)
-                entry = {
-                    "id": id,
-                    "name": record.name,
-                    "description": record.description,
-                    "sequence": sequence,
-                }
-
-                yield entry
-            except StopIteration:
-                break
+    for block in read_fasta_blocks(fasta_filename):
+        yield from block
 
 
-def read_fasta_file_entries(fasta_filename=""):
+def read_fasta_file_entries(fasta_filename="", chunk_size:int=FASTA_CHUNK_SIZE):
     """
     Function to count entries in fasta file
     Args:
         fasta_filename (str): fasta.
+        chunk_size (int): number of bytes read at once. (Default: FASTA_CHUNK_SIZE)
     Returns:
         int: number of entries.
     """
-    with open(fasta_filename, "rt") as handle:
-        iterator = SeqIO.parse(handle, "fasta")
-        count = 0
-        while iterator:
-            try:
-                record = next(iterator)
-                count+=1
-            except StopIteration:
+    count = 0
+    with open(fasta_filename, "rb") as handle:
+        # A header starts at the beginning of the file or after a newline
+        last = b"\n"
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
                 break
+            count += (last + chunk).count(b"\n>")
+            last = chunk[-1:]
 
-        return count
+    return count
 
 
 def check_sequence(element:dict, AAs:set, verbose:bool = False)->bool:
@@ -776,6 +1488,7 @@ def merge_pept_dicts(list_of_pept_dicts:list)->dict:
 
 # Cell
 from collections import OrderedDict
+from collections.abc import Mapping
 
 def generate_fasta_list(fasta_paths:list, callback = None, **kwargs)->tuple:
     """
@@ -800,12 +1513,8 @@ def generate_fasta_list(fasta_paths:list, callback = None, **kwargs)->tuple:
     elif type(fasta_paths) is list:
         n_fastas = len(fasta_paths)
 
-    for f_id, fasta_file in enumerate(fasta_paths):
-        n_entries = read_fasta_file_entries(fasta_file)
-
-        fasta_generator = read_fasta_file(fasta_file)
-
-        for element in fasta_generator:
+    for block in read_fasta_blocks(fasta_paths):
+        for element in block:
             check_sequence(element, constants.AAs)
             fasta_list.append(element)
             fasta_dict[fasta_index] = element
@@ -815,6 +1524,43 @@ def generate_fasta_list(fasta_paths:list, callback = None, **kwargs)->tuple:
     return fasta_list, fasta_dict
 
 
+class FastaMap(Mapping):
+    """Read-only fasta_dict that is backed by a FastaBlock. See generate_fasta_list().
+    The FASTA files are only read on first access, so that the entries are not held in memory while they are not needed.
+
+    Args:
+        fasta_paths (str or list of str): fasta path or a list of fasta paths.
+        block_size (int): number of entries per block that is read at once. (Default: 1000)
+    """
+    def __init__(self, fasta_paths:list, block_size:int=1000):
+        self.fasta_paths = fasta_paths
+        self.block_size = block_size
+        self._block = None
+
+    @property
+    def block(self)->FastaBlock:
+        """All FASTA entries as a single block."""
+        if self._block is None:
+            blocks = list(read_fasta_blocks(self.fasta_paths, self.block_size))
+            self._block = FastaBlock.concatenate(blocks) if len(blocks) > 0 else parse_fasta_chunk(b"")
+        return self._block
+
+    def __len__(self)->int:
+        return len(self.block)
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __getitem__(self, fasta_index:int)->dict:
+        if not 0 <= fasta_index < len(self):
+            raise KeyError(fasta_index)
+
+        return self.block[fasta_index]
+
+    def to_dataframe(self)->pd.DataFrame:
+        """Get the entries as a table with the columns of the protein entry dict, indexed by the protein index."""
+        return self.block.to_dataframe()
+
 
 # Cell
 
@@ -939,23 +1685,19 @@ mass_dict = constants.mass_dict
 #This function is a wrapper function and to be tested by the integration test
 def digest_fasta_block(to_process:tuple)-> (list, dict):
     """
-    Digest and create spectra for a whole fasta_block for multiprocessing. See generate_database_parallel.
+    Digest and create spectra for a whole fasta_block (FastaBlock) for multiprocessing. See digest_fasta_block_to_shard.
     """
 
     fasta_index, fasta_block, settings = to_process
 
     to_add = List()
 
-    f_index = 0
-
     pept_dict = {}
-    for element in fasta_block:
-        sequence = element["sequence"]
-        mod_peptides = generate_peptides(sequence, **settings['fasta'])
+    all_peptides = generate_peptides_block(fasta_block.get_sequences(), **settings['fasta'])
+    for f_index, mod_peptides in enumerate(all_peptides):
         pept_dict, added_peptides = add_to_pept_dict(pept_dict, mod_peptides, fasta_index+f_index)
         if len(added_peptides) > 0:
             to_add.extend(added_peptides)
-        f_index += 1
 
     spectra = []
     if len(to_add) > 0:
@@ -965,49 +1707,48 @@ def digest_fasta_block(to_process:tuple)-> (list, dict):
     return (spectra, pept_dict)
 
 import alphapept.performance
+import shutil
+import tempfile
 
 #This function is a wrapper function and to be tested by the integration test
 def generate_database_parallel(settings:dict, callback = None):
     """
     Function to generate a database from a fasta file in parallel.
+    The database is built on disk with save_database_parallel() and read back, so that the spectra are sorted and deduplicated without collecting them from the workers first.
     Args:
         settings: alphapept settings.
+        callback (function, optional): callback function. (Default: None)
     Returns:
         list: theoretical spectra. See generate_spectra()
         dict: peptide dict. See add_to_pept_dict()
-        dict: fasta_dict. See generate_fasta_list()
+        FastaMap: fasta_dict. See generate_fasta_list()
     """
+    fasta_paths = settings['experiment']['fasta_paths']
+    if type(fasta_paths) is str:
+        fasta_paths = [fasta_paths]
 
-    n_processes = alphapept.performance.set_worker_count(
-        worker_count=settings['general']['n_processes'],
-        set_global=False
-    )
-
-    fasta_list, fasta_dict = generate_fasta_list(fasta_paths = settings['experiment']['fasta_paths'], **settings['fasta'])
-
-    logging.info(f'FASTA contains {len(fasta_list):,} entries.')
-
-    blocks = block_idx(len(fasta_list), settings['fasta']['fasta_block'])
-
-    to_process = [(idx_start, fasta_list[idx_start:idx_end], settings) for idx_start, idx_end in  blocks]
+    tmp_dir = tempfile.mkdtemp(prefix='db_')
 
-    spectra = []
-    pept_dicts = []
-    with Pool(n_processes) as p:
-        max_ = len(to_process)
-        for i, _ in enumerate(p.imap_unordered(digest_fasta_block, to_process)):
-            if callback:
-                callback((i+1)/max_)
-            spectra.extend(_[0])
-            pept_dicts.append(_[1])
+    try:
+        database_path = os.path.join(tmp_dir, 'database.hdf')
+        save_database_parallel(settings, database_path, callback)
 
-    spectra = sorted(spectra, key=lambda x: x[1])
-    spectra_set = [spectra[idx] for idx in range(len(spectra)-1) if spectra[idx][1] != spectra[idx+1][1]]
-    spectra_set.append(spectra[-1])
+        db_data = read_database(database_path)
+        split_points = db_data['indices'][1:-1]
+        spectra = list(zip(
+            db_data['precursors'],
+            db_data['seqs'],
+            np.split(db_data['fragmasses'], split_points),
+            np.split(db_data['fragtypes'], split_points)
+        ))
+        # Spectra are returned sorted by sequence
+        spectra = [spectra[idx] for idx in np.argsort(db_data['seqs'], kind='stable')]
+        pept_dict = db_data['pept_dict'].item().to_dict()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    pept_dict = merge_pept_dicts(pept_dicts)
+    return spectra, pept_dict, FastaMap(fasta_paths, settings['fasta']['fasta_block'])
 
-    return spectra_set, pept_dict, fasta_dict
 
 # Cell
 #This function is a wrapper function and to be tested by the integration test
@@ -1096,7 +1837,6 @@ def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:s
 
     to_save["precursors"] = np.array(precmasses)[sortindex]
     to_save["seqs"] = np.array(seqs, dtype=object)[sortindex]
-    to_save["proteins"] = pd.DataFrame(fasta_dict).T
 
     to_save["fragmasses"] = frags
     to_save["fragtypes"] = frag_types
@@ -1106,13 +1846,33 @@ def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:s
     for key, value in to_save.items():
         db_file.write(value, dataset_name=key)
 
-    peps = np.array(list(pept_dict), dtype=object)
-    indices = np.empty(len(peps) + 1, dtype=np.int64)
-    indices[0] = 0
-    indices[1:] = np.cumsum([len(pept_dict[i]) for i in peps])
-    proteins = np.concatenate([pept_dict[i] for i in peps])
+    save_database_proteins(pept_dict, fasta_dict, database_path)
+
+def save_database_proteins(pept_dict:dict, fasta_dict:dict, database_path:str):
+    """
+    Function to save the proteins and the peptide dictionary to an existing *.hdf database.
+
+    Args:
+        pept_dict (dict): peptide dict or PeptideProteinMap. See add_to_pept_dict().
+        fasta_dict (dict): fasta_dict. See generate_fasta_list(). If None, only the peptide dictionary is saved, see save_database_fasta().
+        database_path (str): Path to database.
+    """
+    db_file = alphapept.io.HDF_File(database_path, is_read_only=False)
+    if fasta_dict is not None:
+        proteins = fasta_dict.to_dataframe() if isinstance(fasta_dict, FastaMap) else pd.DataFrame(fasta_dict).T
+        db_file.write(proteins, dataset_name="proteins", overwrite=True)
+
+    # Sorted sequences allow a binary search, see PeptideProteinMap
+    if isinstance(pept_dict, PeptideProteinMap):
+        peps, indices, proteins = pept_dict.to_csr()
+    else:
+        peps = np.array(sorted(pept_dict), dtype=object)
+        indices = np.empty(len(peps) + 1, dtype=np.int64)
+        indices[0] = 0
+        indices[1:] = np.cumsum([len(pept_dict[i]) for i in peps])
+        proteins = np.concatenate([pept_dict[i] for i in peps])
 
-    db_file.write("peptides")
+    db_file.write("peptides", overwrite=True)
     db_file.write(
         peps,
         dataset_name="sequences",
@@ -1129,50 +1889,913 @@ def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:s
         group_name="peptides"
     )
 
+def save_database_fasta(fasta_paths:list, database_path:str, block_size:int=1000)->int:
+    """
+    Function to save the proteins of FASTA files block by block to an existing *.hdf database.
+
+    Args:
+        fasta_paths (str or list of str): fasta path or a list of fasta paths.
+        database_path (str): Path to database.
+        block_size (int): number of entries that are written at once. (Default: 1000)
+    Returns:
+        int: number of FASTA entries.
+    """
+    db_file = alphapept.io.HDF_File(database_path, is_read_only=False)
+    n_entries = 0
+    for block in read_fasta_blocks(fasta_paths, block_size):
+        db_file.append(block.to_dataframe(), dataset_name="proteins")
+        n_entries += len(block)
+
+    return n_entries
+
+
 # Cell
-import collections
 
-def read_database(database_path:str, array_name:str=None)->dict:
+def get_range_positions(starts:np.ndarray, ends:np.ndarray)->(np.ndarray, np.ndarray):
     """
-    Read database from hdf file.
+    Positions of the elements of ranges in compressed sparse row format, e.g., to gather the fragments of database entries.
     Args:
-        database_path (str): hdf database file generate by alphapept.
-        array_name (str): the dataset name to read
-    return:
-        dict: key is the dataset_name in hdf file, value is the python object read from the dataset_name
+        starts (np.ndarray): start of each range.
+        ends (np.ndarray): end of each range.
+    Returns:
+        np.ndarray: bounds of each range in the positions (indptr).
+        np.ndarray: the concatenated positions of all ranges.
     """
-    db_file = alphapept.io.HDF_File(database_path)
-    if array_name is None:
-        db_data = {
-            key: db_file.read(
-                dataset_name=key
-            ) for key in db_file.read() if key not in (
-                "proteins",
-                "peptides"
-            )
-        }
-        db_data["fasta_dict"] = np.array(
-            collections.OrderedDict(db_file.read(dataset_name="proteins").T)
-        )
-        peps = db_file.read(dataset_name="sequences", group_name="peptides")
-        protein_indptr = db_file.read(
-            dataset_name="protein_indptr",
-            group_name="peptides"
-        )
-        protein_indices = db_file.read(
-            dataset_name="protein_indices",
-            group_name="peptides"
-        )
-        db_data["pept_dict"] = np.array(
-            {
-                pep: (protein_indices[s: e]).tolist() for pep, s, e in zip(
-                    peps,
-                    protein_indptr[:-1],
-                    protein_indptr[1:],
-                )
-            }
-        )
-        db_data["seqs"] = db_data["seqs"].astype(str)
-    else:
-        db_data = db_file.read(dataset_name=array_name)
-    return db_data
\ No newline at end of file
+    lengths = ends - starts
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+
+    return indptr, positions
+
+class PeptideProteinMap():
+    """Map of peptide sequences to the indices of their proteins in compressed sparse row format.
+
+    Args:
+        sequences (np.ndarray): The peptide sequences.
+        protein_indptr (np.ndarray): Bounds of the proteins of each peptide in protein_indices.
+        protein_indices (np.ndarray): The protein indices of all peptides.
+    """
+    def __init__(self, sequences:np.ndarray, protein_indptr:np.ndarray, protein_indices:np.ndarray):
+        sequences = np.asarray(sequences).astype(np.bytes_)
+        starts = np.asarray(protein_indptr[:-1], dtype=np.int64)
+        ends = np.asarray(protein_indptr[1:], dtype=np.int64)
+
+        if np.any(sequences[1:] < sequences[:-1]):
+            order = np.argsort(sequences, kind='stable')
+            sequences = sequences[order]
+            starts = starts[order]
+            ends = ends[order]
+
+        self.sequences = sequences
+        self.starts = starts
+        self.ends = ends
+        self.protein_indices = np.asarray(protein_indices, dtype=np.int64)
+
+    @classmethod
+    def from_dict(cls, pept_dict:dict)->'PeptideProteinMap':
+        """Create the map from a peptide dict. See add_to_pept_dict()."""
+        peps = list(pept_dict)
+        protein_indptr = np.zeros(len(peps) + 1, dtype=np.int64)
+        protein_indptr[1:] = np.cumsum([len(pept_dict[_]) for _ in peps])
+        protein_indices = np.concatenate([np.asarray(pept_dict[_], dtype=np.int64) for _ in peps]) if len(peps) > 0 else np.zeros(0, dtype=np.int64)
+
+        return cls(np.array(peps, dtype=object), protein_indptr, protein_indices)
+
+    def to_dict(self)->dict:
+        """Convert the map to a peptide dict. See add_to_pept_dict()."""
+        return {seq.decode(): self.protein_indices[s:e].tolist() for seq, s, e in zip(self.sequences, self.starts, self.ends)}
+
+    def __len__(self)->int:
+        return len(self.sequences)
+
+    def _find(self, sequences:np.ndarray)->(np.ndarray, np.ndarray):
+        sequences = np.asarray(sequences).astype(np.bytes_)
+        idxs = np.minimum(np.searchsorted(self.sequences, sequences), max(len(self.sequences) - 1, 0))
+        if len(self.sequences) == 0:
+            return idxs, np.zeros(len(sequences), dtype=np.bool_)
+
+        return idxs, self.sequences[idxs] == sequences
+
+    def __contains__(self, sequence:str)->bool:
+        return bool(self._find([sequence])[1][0])
+
+    def __getitem__(self, sequence:str)->list:
+        idx, found = self._find([sequence])
+        if not found[0]:
+            raise KeyError(sequence)
+
+        return self.protein_indices[self.starts[idx[0]]:self.ends[idx[0]]].tolist()
+
+    def get_indices(self, sequences:np.ndarray)->np.ndarray:
+        """Positions of sequences in the map.
+
+        Args:
+            sequences (np.ndarray): The peptide sequences.
+
+        Raises:
+            KeyError: If a sequence is not in the map.
+
+        Returns:
+            np.ndarray: The positions of the sequences.
+        """
+        idxs, found = self._find(sequences)
+        if not np.all(found):
+            raise KeyError(np.asarray(sequences)[~found][0])
+
+        return idxs
+
+    def count_proteins(self, sequences:np.ndarray)->np.ndarray:
+        """Number of proteins of each sequence.
+
+        Args:
+            sequences (np.ndarray): The peptide sequences.
+
+        Raises:
+            KeyError: If a sequence is not in the map.
+
+        Returns:
+            np.ndarray: The number of proteins of each sequence.
+        """
+        idxs = self.get_indices(sequences)
+
+        return self.ends[idxs] - self.starts[idxs]
+
+    def get_proteins(self, sequences:np.ndarray)->(np.ndarray, np.ndarray):
+        """Protein indices of many sequences in compressed sparse row format.
+
+        Args:
+            sequences (np.ndarray): The peptide sequences.
+
+        Raises:
+            KeyError: If a sequence is not in the map.
+
+        Returns:
+            np.ndarray: Bounds of the proteins of each sequence in the protein indices.
+            np.ndarray: The protein indices.
+        """
+        idxs = self.get_indices(sequences)
+        indptr, positions = get_range_positions(self.starts[idxs], self.ends[idxs])
+
+        return indptr, self.protein_indices[positions]
+
+    def to_csr(self)->(np.ndarray, np.ndarray, np.ndarray):
+        """The map in the format of the peptides group of a database. See from_database().
+
+        Returns:
+            np.ndarray: The sorted peptide sequences.
+            np.ndarray: Bounds of the proteins of each peptide in protein_indices.
+            np.ndarray: The protein indices of all peptides.
+        """
+        indptr, positions = get_range_positions(self.starts, self.ends)
+
+        return self.sequences.astype(str).astype(object), indptr, self.protein_indices[positions]
+
+    @classmethod
+    def merge(cls, maps:list)->'PeptideProteinMap':
+        """Merge maps without converting them to peptide dicts. See merge_pept_dicts().
+        The protein indices of a sequence that is in several maps are kept in the order of the maps.
+
+        Args:
+            maps (list): The PeptideProteinMaps.
+
+        Returns:
+            PeptideProteinMap: The merged map.
+        """
+        sequences = np.concatenate([_.sequences for _ in maps])
+        protein_indices = np.concatenate([_.protein_indices[get_range_positions(_.starts, _.ends)[1]] for _ in maps])
+        lengths = np.concatenate([_.ends - _.starts for _ in maps])
+        starts = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+
+        # The stable sort keeps the order of the maps for duplicate sequences
+        order = np.argsort(sequences, kind='stable')
+        sequences, starts, lengths = sequences[order], starts[order], lengths[order]
+        _, positions = get_range_positions(starts, starts + lengths)
+
+        is_first = np.ones(len(sequences), dtype=np.bool_)
+        is_first[1:] = sequences[1:] != sequences[:-1]
+        firsts = np.flatnonzero(is_first)
+
+        protein_indptr = np.zeros(len(firsts) + 1, dtype=np.int64)
+        if len(firsts) > 0:
+            np.cumsum(np.add.reduceat(lengths, firsts), out=protein_indptr[1:])
+
+        return cls(sequences[firsts], protein_indptr, protein_indices[positions])
+
+    @classmethod
+    def from_database(cls, database_path:str)->'PeptideProteinMap':
+        """Read the map from the peptides group of a database.
+
+        Args:
+            database_path (str): hdf database file generate by alphapept.
+
+        Returns:
+            PeptideProteinMap: The map of the database.
+        """
+        db_file = alphapept.io.HDF_File(database_path)
+
+        return cls(
+            db_file.read(dataset_name="sequences", group_name="peptides"),
+            db_file.read(dataset_name="protein_indptr", group_name="peptides"),
+            db_file.read(dataset_name="protein_indices", group_name="peptides"),
+        )
+
+
+# Cell
+import collections
+
+def read_database(database_path:str, array_name:str=None)->dict:
+    """
+    Read database from hdf file.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        array_name (str): the dataset name to read
+    return:
+        dict: key is the dataset_name in hdf file, value is the python object read from the dataset_name. The pept_dict is a PeptideProteinMap.
+    """
+    db_file = alphapept.io.HDF_File(database_path)
+    if array_name is None:
+        db_data = {
+            key: db_file.read(
+                dataset_name=key
+            ) for key in db_file.read() if key not in (
+                "proteins",
+                "peptides",
+                "fragment_index"
+            )
+        }
+        db_data["fasta_dict"] = np.array(
+            collections.OrderedDict(db_file.read(dataset_name="proteins").T)
+        )
+        # A 0-d object array, so that the map is accessed with .item() like the fasta_dict
+        db_data["pept_dict"] = np.empty((), dtype=object)
+        db_data["pept_dict"][()] = PeptideProteinMap.from_database(database_path)
+        db_data["seqs"] = db_data["seqs"].astype(str)
+    else:
+        db_data = db_file.read(dataset_name=array_name)
+    return db_data
+
+# Cell
+
+PRECURSOR_ARRAYS = ["precursors", "seqs"]
+# Arrays that are aligned with the fragments, db_ints is optional
+FRAGMENT_ARRAYS = ["fragmasses", "fragtypes", "db_ints"]
+
+def read_database_slice(database_path:str, start:int, end:int, array_names:list=None)->dict:
+    """
+    Read the entries [start, end) from a hdf database file.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        start (int): index of the first database entry to read.
+        end (int): index after the last database entry to read.
+        array_names (list): the dataset names to read. If None, all precursor and fragment arrays that are present are read.
+    Raises:
+        KeyError: if a dataset in array_names is not in the database.
+    return:
+        dict: key is the dataset_name in hdf file, value is the sliced array. Additionally contains the rebased indices, offset and frag_offset.
+    """
+    db_file = alphapept.io.HDF_File(database_path)
+    if array_names is None:
+        available = db_file.read()
+        array_names = [_ for _ in PRECURSOR_ARRAYS + FRAGMENT_ARRAYS if _ in available]
+
+    indices = db_file.read(dataset_name="indices", return_dataset_slice=slice(start, end + 1))
+    frag_offset = indices[0] if len(indices) > 0 else 0
+
+    db_data = {}
+    for key in array_names:
+        if key == "indices":
+            continue
+        elif key in FRAGMENT_ARRAYS:
+            dataset_slice = slice(frag_offset, indices[-1] if len(indices) > 0 else 0)
+        else:
+            dataset_slice = slice(start, end)
+        db_data[key] = db_file.read(dataset_name=key, return_dataset_slice=dataset_slice)
+
+    if "seqs" in db_data:
+        db_data["seqs"] = db_data["seqs"].astype(str)
+
+    db_data["indices"] = indices - frag_offset
+    db_data["offset"] = start
+    db_data["frag_offset"] = frag_offset
+
+    return db_data
+
+
+# Cell
+import json
+
+DATABASE_MERGE_CHUNK = 100000
+
+# FASTA settings that do not change the database
+DATABASE_IGNORED_SETTINGS = ['spectra_block', 'fasta_block', 'save_db', 'fasta_size_max', 'database_cache_path', 'database_cache_size']
+
+def get_digestion_settings(fasta_settings:dict)->str:
+    """
+    Get the FASTA settings that determine the content of a database.
+    Args:
+        fasta_settings (dict): the FASTA settings.
+    Returns:
+        str: the settings that change the database as JSON with sorted keys.
+    """
+    settings = {_: fasta_settings[_] for _ in fasta_settings if _ not in DATABASE_IGNORED_SETTINGS}
+
+    return json.dumps(settings, sort_keys=True, default=str)
+
+def save_database_shard(spectra:list, pept_dict:dict, shard_path:str)->int:
+    """
+    Save spectra sorted by precursor mass and sequence to a database shard. Duplicate sequences are removed.
+    The peptide dict is saved with the spectra, see save_database_proteins().
+    Args:
+        spectra (list): theoretical spectra. See generate_spectra().
+        pept_dict (dict): peptide dict. See add_to_pept_dict().
+        shard_path (str): Path to the shard.
+    Returns:
+        int: number of saved spectra.
+    """
+    spectra = sorted(spectra, key=lambda x: (x[0], x[1]))
+    spectra = [spectra[idx] for idx in range(len(spectra)) if (idx == 0) or (spectra[idx][1] != spectra[idx-1][1])]
+
+    shard_file = alphapept.io.HDF_File(shard_path, is_new_file=True)
+    for key, value in get_database_arrays(spectra).items():
+        shard_file.write(value, dataset_name=key)
+    save_database_proteins(pept_dict, None, shard_path)
+
+    return len(spectra)
+
+def get_database_arrays(spectra:list)->dict:
+    """
+    Convert spectra to the columnar arrays of a database.
+    Args:
+        spectra (list): theoretical spectra. See generate_spectra().
+    Returns:
+        dict: precursors, seqs, fragmasses, fragtypes and indices.
+    """
+    precmasses, seqs, fragmasses, fragtypes = zip(*spectra)
+
+    indices = np.zeros(len(spectra) + 1, np.int64)
+    indices[1:] = np.cumsum([len(_) for _ in fragmasses])
+
+    return {
+        "precursors": np.array(precmasses),
+        "seqs": np.array(seqs, dtype=object),
+        "fragmasses": np.concatenate(fragmasses),
+        "fragtypes": np.concatenate(fragtypes),
+        "indices": indices,
+    }
+
+# Arrays of a database that are merged, the indices are rebased
+MERGE_ARRAYS = ["precursors", "seqs", "fragmasses", "fragtypes"]
+
+def take_database_arrays(db_arrays:dict, selection:np.ndarray)->dict:
+    """
+    Select entries of columnar database arrays.
+    Args:
+        db_arrays (dict): the arrays, see read_database_slice().
+        selection (np.ndarray): indices of the selected entries.
+    Returns:
+        dict: the arrays of the selected entries with rebased indices.
+    """
+    indptr, positions = get_range_positions(db_arrays["indices"][:-1][selection], db_arrays["indices"][1:][selection])
+    taken = {key: db_arrays[key][positions if key in FRAGMENT_ARRAYS else selection] for key in MERGE_ARRAYS}
+    taken["indices"] = indptr
+
+    return taken
+
+def concatenate_database_arrays(db_arrays:list)->dict:
+    """
+    Concatenate columnar database arrays.
+    Args:
+        db_arrays (list): the arrays, see read_database_slice().
+    Returns:
+        dict: the concatenated arrays with rebased indices.
+    """
+    indices = [np.zeros(1, np.int64)]
+    frag_offset = 0
+    for _ in db_arrays:
+        indices.append(_["indices"][1:] + frag_offset)
+        frag_offset += _["indices"][-1]
+
+    concatenated = {key: np.concatenate([_[key] for _ in db_arrays]) for key in MERGE_ARRAYS}
+    concatenated["indices"] = np.concatenate(indices)
+
+    return concatenated
+
+def read_database_chunks(database_path:str, chunk_size:int=DATABASE_MERGE_CHUNK)->Generator[dict, None, None]:
+    """
+    Read a database or database shard in chunks.
+    Args:
+        database_path (str): Path to the database.
+        chunk_size (int): number of entries that are read at once.
+    Yields:
+        dict: columnar arrays of the chunk, see read_database_slice().
+    """
+    n_entries = alphapept.io.HDF_File(database_path).read(dataset_name="precursors", return_dataset_shape=True)[0]
+
+    for start in range(0, n_entries, chunk_size):
+        yield read_database_slice(database_path, start, min(start + chunk_size, n_entries), array_names=MERGE_ARRAYS)
+
+def merge_database_shards(shard_paths:list, database_path:str, chunk_size:int=DATABASE_MERGE_CHUNK)->int:
+    """
+    Merge database shards into a database sorted by precursor mass and sequence. Sequences that are in multiple shards are only saved once.
+    The shards are read in chunks that share chunk_size. All buffered entries below the smallest last precursor mass of the unfinished shards are complete, so they are sorted, deduplicated and appended at once.
+    Args:
+        shard_paths (list): Paths to the shards. See save_database_shard(). A database can be used as a shard as well.
+        database_path (str): Path to database.
+        chunk_size (int): number of entries that are buffered over all shards.
+    Returns:
+        int: number of saved spectra.
+    """
+    db_file = alphapept.io.HDF_File(database_path, is_new_file=True)
+    db_file.append(np.zeros(1, np.int64), dataset_name="indices")
+
+    readers = [read_database_chunks(_, max(1, chunk_size // max(1, len(shard_paths)))) for _ in shard_paths]
+    buffers = [None for _ in shard_paths]
+    finished = [False for _ in shard_paths]
+
+    def read_next(i):
+        chunk = next(readers[i], None)
+        if chunk is None:
+            finished[i] = True
+        else:
+            buffers[i] = chunk if buffers[i] is None else concatenate_database_arrays([buffers[i], chunk])
+
+    for i in range(len(shard_paths)):
+        read_next(i)
+
+    n_spectra = 0
+    n_frags = 0
+
+    while True:
+        # Identical sequences have identical precursor masses, so all copies of a sequence are in the same batch
+        unfinished = [i for i in range(len(shard_paths)) if not finished[i]]
+        bound = min(buffers[i]["precursors"][-1] for i in unfinished) if len(unfinished) > 0 else np.inf
+
+        batch = []
+        for i, buffer in enumerate(buffers):
+            if buffer is not None:
+                n_complete = np.searchsorted(buffer["precursors"], bound, side='left')
+                batch.append(take_database_arrays(buffer, np.arange(n_complete)))
+                buffers[i] = take_database_arrays(buffer, np.arange(n_complete, len(buffer["precursors"])))
+
+        if len(batch) > 0:
+            batch = concatenate_database_arrays(batch)
+            order = np.lexsort((batch["seqs"], batch["precursors"]))
+            precursors, seqs = batch["precursors"][order], batch["seqs"][order]
+            is_first = np.ones(len(order), dtype=np.bool_)
+            is_first[1:] = (precursors[1:] != precursors[:-1]) | (seqs[1:] != seqs[:-1])
+
+            n_frags = append_database_arrays(take_database_arrays(batch, order[is_first]), db_file, n_frags)
+            n_spectra += int(is_first.sum())
+
+        if len(unfinished) == 0:
+            break
+
+        # Shards whose remaining entries are all at the bound need more entries to progress
+        for i in unfinished:
+            if buffers[i]["precursors"][-1] == bound:
+                read_next(i)
+
+    return n_spectra
+
+def append_database_arrays(db_arrays:dict, db_file:alphapept.io.HDF_File, frag_offset:int)->int:
+    """
+    Append columnar arrays to the arrays of a database.
+    Args:
+        db_arrays (dict): the arrays with indices that start at 0, see get_database_arrays().
+        db_file (alphapept.io.HDF_File): the database.
+        frag_offset (int): number of fragments in the database.
+    Returns:
+        int: number of fragments in the database after appending.
+    """
+    if len(db_arrays["precursors"]) == 0:
+        return frag_offset
+
+    for key in MERGE_ARRAYS:
+        db_file.append(db_arrays[key].astype(object) if key == "seqs" else db_arrays[key], dataset_name=key)
+    db_file.append(db_arrays["indices"][1:] + frag_offset, dataset_name="indices")
+
+    return frag_offset + db_arrays["indices"][-1]
+
+def merge_database_peptides(database_paths:list)->PeptideProteinMap:
+    """
+    Merge the peptide maps of databases or database shards.
+    Args:
+        database_paths (list): Paths to the databases.
+    Returns:
+        PeptideProteinMap: the merged map, see PeptideProteinMap.merge().
+    """
+    return PeptideProteinMap.merge([PeptideProteinMap.from_database(_) for _ in database_paths])
+
+def digest_fasta_block_to_shard(to_process:tuple)->int:
+    """
+    Digest and create spectra for a whole fasta_block and save them with the peptide dict to a shard for multiprocessing. See save_database_parallel.
+    """
+    fasta_index, fasta_block, settings, shard_path = to_process
+
+    spectra, pept_dict = digest_fasta_block((fasta_index, fasta_block, settings))
+
+    n_spectra = 0
+    if len(spectra) > 0:
+        n_spectra = save_database_shard(spectra, pept_dict, shard_path)
+
+    return n_spectra
+
+#This function is a wrapper function and to be tested by the integration test
+def save_database_parallel(settings:dict, database_path:str, callback = None)->(int, int):
+    """
+    Function to generate a database from a fasta file in parallel and save it to the *.hdf format.
+    The spectra of each FASTA block are saved to temporary shards next to the database, which are then merged.
+    Args:
+        settings: alphapept settings.
+        database_path (str): Path to database.
+        callback (function, optional): callback function. (Default: None)
+    Raises:
+        ValueError: if no spectra are generated.
+    Returns:
+        int: number of spectra.
+        int: number of FASTA entries.
+    """
+    n_processes = alphapept.performance.set_worker_count(
+        worker_count=settings['general']['n_processes'],
+        set_global=False
+    )
+
+    fasta_paths = settings['experiment']['fasta_paths']
+    if type(fasta_paths) is str:
+        fasta_paths = [fasta_paths]
+    fasta_block = settings['fasta']['fasta_block']
+
+    n_fasta = sum(read_fasta_file_entries(_) for _ in fasta_paths)
+
+    logging.info(f'FASTA contains {n_fasta:,} entries.')
+
+    shard_dir = tempfile.mkdtemp(prefix='db_shards_', dir=os.path.dirname(os.path.abspath(database_path)))
+
+    try:
+        # The blocks are read while the workers digest them
+        to_process = ((block.index, block, settings, os.path.join(shard_dir, f'{i}.hdf')) for i, block in enumerate(read_fasta_blocks(fasta_paths, fasta_block)))
+
+        shard_paths = []
+        with Pool(n_processes) as p:
+            max_ = max(1, -(-n_fasta // fasta_block))
+            for i, n_spectra in enumerate(alphapept.performance.bounded_imap(p, digest_fasta_block_to_shard, to_process, 2 * n_processes)):
+                if callback:
+                    callback((i+1)/max_)
+                if n_spectra > 0:
+                    shard_paths.append(os.path.join(shard_dir, f'{i}.hdf'))
+
+        if len(shard_paths) == 0:
+            raise ValueError("No spectra to generate.")
+
+        logging.info(f'Merging {len(shard_paths):,} database shards.')
+        n_spectra = merge_database_shards(shard_paths, database_path)
+        pept_map = merge_database_peptides(shard_paths)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    save_database_fasta(fasta_paths, database_path, fasta_block)
+    save_database_proteins(pept_map, None, database_path)
+    alphapept.io.HDF_File(database_path, is_read_only=False).write(get_digestion_settings(settings['fasta']), attr_name="digestion_settings", overwrite=True)
+
+    return n_spectra, n_fasta
+
+
+# Cell
+import hashlib
+import alphapept.utils
+from .__version__ import VERSION_NO
+
+class DatabaseCache(alphapept.utils.DiskCache):
+    """Persistent LRU cache on disk for databases.
+
+    Args:
+        path (str): Directory of the cache.
+        max_size (float): Size budget of the cache in Mb. Defaults to 51200.
+    """
+    def __init__(self, path:str, max_size:float=51200):
+        super().__init__(path, max_size)
+
+    def get_key(self, fasta_paths:list, fasta_settings:dict)->str:
+        """Key of a database from the content of the FASTA files and from the FASTA settings.
+        The order of the FASTA files is part of the key, as it determines the protein indices.
+
+        Args:
+            fasta_paths (list): Paths to the FASTA files.
+            fasta_settings (dict): The FASTA settings.
+
+        Returns:
+            str: The key of the database.
+        """
+        hash_ = hashlib.sha256()
+
+        for fasta_path in fasta_paths:
+            hash_.update(self.file_hash(fasta_path).encode())
+
+        hash_.update(get_digestion_settings(fasta_settings).encode())
+        hash_.update(VERSION_NO.encode())
+
+        return hash_.hexdigest()
+
+    def load(self, key:str, database_path:str)->bool:
+        """Copy a cached database to a database path.
+
+        Args:
+            key (str): The key of the database.
+            database_path (str): Path to database.
+
+        Returns:
+            bool: True if the database was found in the cache.
+        """
+        try:
+            shutil.copyfile(self.entry_path(key), database_path)
+        except FileNotFoundError:
+            return False
+
+        self.touch(key)
+
+        return True
+
+    def save(self, key:str, database_path:str):
+        """Store a database in the cache.
+
+        Args:
+            key (str): The key of the database.
+            database_path (str): Path to database.
+        """
+        self.add(key, lambda entry: shutil.copyfile(database_path, entry))
+
+# Cell
+
+FRAGMENT_INDEX_CHUNK = 10**7
+
+def get_fragment_index(db_frags:np.ndarray, db_indices:np.ndarray, bin_width:float=0.05)->tuple:
+    """
+    Build an inverted fragment index that maps fragment mass bins to peptides.
+    Args:
+        db_frags (np.ndarray): fragment masses of the database, sorted per peptide.
+        db_indices (np.ndarray): indices to the fragment masses of each peptide.
+        bin_width (float): width of a fragment mass bin in Dalton.
+    Returns:
+        np.ndarray: bounds of each bin (indptr).
+        np.ndarray: peptide index of each fragment, sorted by bin.
+        np.ndarray: position of each fragment in db_frags, sorted by bin.
+        float: width of a fragment mass bin in Dalton.
+    """
+    peptides = np.repeat(np.arange(len(db_indices) - 1), np.diff(db_indices))
+    bins = (db_frags / bin_width).astype(np.int64)
+
+    # A stable sort keeps peptides sorted within each bin
+    order = np.argsort(bins, kind='stable')
+
+    n_bins = bins.max() + 1 if len(bins) > 0 else 0
+    indptr = np.zeros(n_bins + 1, np.int64)
+    indptr[1:] = np.cumsum(np.bincount(bins, minlength=n_bins))
+
+    return indptr, peptides[order], order.astype(np.int64), bin_width
+
+
+def save_fragment_index(database_path:str, bin_width:float=0.05):
+    """
+    Build the fragment index of a database and save it to the fragment_index group of the database.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        bin_width (float): width of a fragment mass bin in Dalton.
+    """
+    db_frags = read_database(database_path, array_name='fragmasses')
+    db_indices = read_database(database_path, array_name='indices')
+
+    indptr, peptides, positions, bin_width = get_fragment_index(db_frags, db_indices, bin_width)
+
+    db_file = alphapept.io.HDF_File(database_path, is_overwritable=True)
+    db_file.write("fragment_index")
+    db_file.write(bin_width, group_name="fragment_index", attr_name="bin_width")
+    for key, value in zip(["indptr", "peptides", "positions"], [indptr, peptides, positions]):
+        db_file.write(value, dataset_name=key, group_name="fragment_index")
+
+
+def read_fragment_index(database_path:str)->tuple:
+    """
+    Read the fragment index from a database.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+    Raises:
+        KeyError: if the database does not contain a fragment index.
+    Returns:
+        tuple: (indptr, peptides, positions, bin_width), see get_fragment_index.
+    """
+    db_file = alphapept.io.HDF_File(database_path)
+    bin_width = float(db_file.read(group_name="fragment_index", attr_name="bin_width"))
+    indptr, peptides, positions = [
+        db_file.read(dataset_name=key, group_name="fragment_index") for key in ["indptr", "peptides", "positions"]
+    ]
+
+    return indptr, peptides, positions, bin_width
+
+
+def read_fragment_index_slice(database_path:str, start:int, end:int, frag_offset:int=0, chunk_size:int=FRAGMENT_INDEX_CHUNK)->tuple:
+    """
+    Read the part of the fragment index of the database entries [start, end), see read_database_slice.
+    The index is read in chunks, so that only the fragments of the slice are kept in memory.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        start (int): index of the first database entry.
+        end (int): index after the last database entry.
+        frag_offset (int): position of the first fragment of the slice in the fragment arrays. (Default: 0)
+        chunk_size (int): number of fragments of the index that are read at once. (Default: FRAGMENT_INDEX_CHUNK)
+    Raises:
+        KeyError: if the database does not contain a fragment index.
+    Returns:
+        tuple: (indptr, peptides, positions, bin_width), see get_fragment_index. Peptides and positions are relative to start and frag_offset.
+    """
+    db_file = alphapept.io.HDF_File(database_path)
+    bin_width = float(db_file.read(group_name="fragment_index", attr_name="bin_width"))
+    indptr = db_file.read(dataset_name="indptr", group_name="fragment_index")
+
+    counts = np.zeros(len(indptr) - 1, dtype=np.int64)
+    peptides = [np.zeros(0, dtype=np.int64)]
+    positions = [np.zeros(0, dtype=np.int64)]
+
+    for chunk_start in range(0, indptr[-1], chunk_size):
+        chunk = slice(chunk_start, min(chunk_start + chunk_size, indptr[-1]))
+        chunk_peptides = db_file.read(dataset_name="peptides", group_name="fragment_index", return_dataset_slice=chunk)
+        selected = np.flatnonzero((chunk_peptides >= start) & (chunk_peptides < end))
+        if len(selected) == 0:
+            continue
+        chunk_positions = db_file.read(dataset_name="positions", group_name="fragment_index", return_dataset_slice=chunk)
+
+        peptides.append(chunk_peptides[selected] - start)
+        positions.append(chunk_positions[selected] - frag_offset)
+        # Peptides stay sorted within each bin, as the selection keeps the order of the index
+        counts += np.bincount(np.searchsorted(indptr, chunk_start + selected, side='right') - 1, minlength=len(counts))
+
+    slice_indptr = np.zeros(len(indptr), dtype=np.int64)
+    np.cumsum(counts, out=slice_indptr[1:])
+
+    return slice_indptr, np.concatenate(peptides), np.concatenate(positions), bin_width
+
+
+# Cell
+import os
+
+MEMMAP_ARRAYS = ["precursors", "seqs", "fragmasses", "fragtypes", "indices"]
+FRAGMENT_INDEX_ARRAYS = ["indptr", "peptides", "positions"]
+
+def get_database_memmap_path(database_path:str)->str:
+    """
+    Get the folder to which the memory mapped arrays of a database are exported.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+    Returns:
+        str: path to the folder with the memory mapped arrays.
+    """
+    return os.path.splitext(database_path)[0] + "_memmap"
+
+
+def save_database_memmap(database_path:str, chunk_size:int=10**7)->str:
+    """
+    Export the arrays of a database to .npy files that can be memory mapped by multiple processes.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        chunk_size (int): number of elements that are copied at once.
+    Returns:
+        str: path to the folder with the memory mapped arrays.
+    """
+    memmap_path = get_database_memmap_path(database_path)
+    db_file = alphapept.io.HDF_File(database_path)
+
+    to_save = [(key, None) for key in MEMMAP_ARRAYS]
+    if "fragment_index" in db_file.read():
+        to_save += [(key, "fragment_index") for key in FRAGMENT_INDEX_ARRAYS]
+
+    file_names = [os.path.join(memmap_path, f"{group_name}_{key}.npy" if group_name else f"{key}.npy") for key, group_name in to_save]
+    db_time = os.path.getmtime(database_path)
+
+    if all(os.path.isfile(_) and (os.path.getmtime(_) >= db_time) for _ in file_names):
+        logging.info(f'Using memory mapped database in {memmap_path}.')
+        return memmap_path
+
+    logging.info(f'Exporting database to memory mapped arrays in {memmap_path}.')
+    os.makedirs(memmap_path, exist_ok=True)
+
+    for (key, group_name), file_name in zip(to_save, file_names):
+        if key == "seqs":
+            np.save(file_name, db_file.read(dataset_name=key).astype(str))
+            continue
+
+        shape = db_file.read(dataset_name=key, group_name=group_name, return_dataset_shape=True)
+        dtype = db_file.read(dataset_name=key, group_name=group_name, return_dataset_dtype=True)
+        array = np.lib.format.open_memmap(file_name, mode="w+", dtype=dtype, shape=shape)
+        for start in range(0, shape[0], chunk_size):
+            end = min(start + chunk_size, shape[0])
+            array[start:end] = db_file.read(dataset_name=key, group_name=group_name, return_dataset_slice=slice(start, end))
+        array.flush()
+        del array
+
+    if "fragment_index" in db_file.read():
+        bin_width = db_file.read(group_name="fragment_index", attr_name="bin_width")
+        np.save(os.path.join(memmap_path, "fragment_index_bin_width.npy"), np.array([bin_width]))
+
+    return memmap_path
+
+
+def read_database_memmap(database_path:str)->dict:
+    """
+    Open the arrays that were exported with save_database_memmap as memory maps.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+    Raises:
+        FileNotFoundError: if the database was not exported.
+    Returns:
+        dict: key is the dataset_name in hdf file, value is the memory mapped array. Contains the fragment index if it was exported.
+    """
+    memmap_path = get_database_memmap_path(database_path)
+
+    db_data = {
+        key: np.asarray(np.load(os.path.join(memmap_path, f"{key}.npy"), mmap_mode="r")) for key in MEMMAP_ARRAYS
+    }
+
+    if os.path.isfile(os.path.join(memmap_path, "fragment_index_bin_width.npy")):
+        frag_index = [
+            np.asarray(np.load(os.path.join(memmap_path, f"fragment_index_{key}.npy"), mmap_mode="r")) for key in FRAGMENT_INDEX_ARRAYS
+        ]
+        bin_width = float(np.load(os.path.join(memmap_path, "fragment_index_bin_width.npy"))[0])
+        db_data["fragment_index"] = (*frag_index, bin_width)
+
+    return db_data
+
+
+# Cell
+#This function is a wrapper function and to be tested by the integration test
+def append_database_fasta(fasta_paths:list, database_path:str, settings:dict, callback = None)->(int, int):
+    """
+    Function to add the proteins of FASTA files to an existing *.hdf database. Only the new proteins are digested.
+    The new proteins are numbered after the existing ones, so that the indices of the existing proteins stay valid.
+    Args:
+        fasta_paths (str or list of str): fasta path or a list of fasta paths with the new proteins.
+        database_path (str): Path to database.
+        settings: alphapept settings. The fasta settings need to be the ones that were used to create the database.
+        callback (function, optional): callback function. (Default: None)
+    Raises:
+        ValueError: if the fasta settings differ from the ones that were used to create the database.
+    Returns:
+        int: number of spectra.
+        int: number of FASTA entries.
+    """
+    n_processes = alphapept.performance.set_worker_count(
+        worker_count=settings['general']['n_processes'],
+        set_global=False
+    )
+
+    if type(fasta_paths) is str:
+        fasta_paths = [fasta_paths]
+    fasta_block = settings['fasta']['fasta_block']
+
+    db_file = alphapept.io.HDF_File(database_path)
+    digestion_settings = get_digestion_settings(settings['fasta'])
+    db_attrs = db_file.read(attr_name="")
+    if "digestion_settings" not in db_attrs:
+        logging.warning(f'Database {database_path} does not store its FASTA settings. Assuming that they match the current ones.')
+    elif db_attrs["digestion_settings"] != digestion_settings:
+        raise ValueError(f'The FASTA settings differ from the ones of database {database_path}: {db_attrs["digestion_settings"]}')
+
+    proteins = db_file.read(dataset_name="proteins")
+    bin_width = None
+    if "fragment_index" in db_file.read():
+        bin_width = read_fragment_index(database_path)[3]
+
+    n_fasta = sum(read_fasta_file_entries(_) for _ in fasta_paths)
+
+    logging.info(f'Adding {n_fasta:,} FASTA entries to a database with {len(proteins):,} entries.')
+
+    shard_dir = tempfile.mkdtemp(prefix='db_shards_', dir=os.path.dirname(os.path.abspath(database_path)))
+
+    try:
+        to_process = ((block.index, block, settings, os.path.join(shard_dir, f'{i}.hdf')) for i, block in enumerate(read_fasta_blocks(fasta_paths, fasta_block, index=len(proteins))))
+
+        shard_paths = []
+        with Pool(n_processes) as p:
+            max_ = max(1, -(-n_fasta // fasta_block))
+            for i, n_spectra in enumerate(alphapept.performance.bounded_imap(p, digest_fasta_block_to_shard, to_process, 2 * n_processes)):
+                if callback:
+                    callback((i+1)/max_)
+                if n_spectra > 0:
+                    shard_paths.append(os.path.join(shard_dir, f'{i}.hdf'))
+
+        logging.info(f'Merging {len(shard_paths):,} database shards into the database.')
+        new_database_path = os.path.join(shard_dir, 'database.hdf')
+        n_spectra = merge_database_shards([database_path] + shard_paths, new_database_path)
+
+        alphapept.io.HDF_File(new_database_path, is_read_only=False).append(proteins, dataset_name="proteins")
+        save_database_fasta(fasta_paths, new_database_path, fasta_block)
+        save_database_proteins(merge_database_peptides([database_path] + shard_paths), None, new_database_path)
+        alphapept.io.HDF_File(new_database_path, is_read_only=False).write(digestion_settings, attr_name="digestion_settings", overwrite=True)
+        if bin_width is not None:
+            save_fragment_index(new_database_path, bin_width)
+
+        os.replace(new_database_path, database_path)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return n_spectra, len(proteins) + n_fasta
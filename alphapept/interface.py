@@ -3,10 +3,10 @@
 __all__ = ['tqdm_wrapper', 'check_version_and_hardware', 'wrapped_partial', 'create_database', 'import_raw_data',
            'feature_finding', 'search_data', 'recalibrate_data', 'score', 'isobaric_labeling', 'protein_grouping',
            'align', 'match', 'read_label_intensity', 'quantification', 'export', 'run_complete_workflow',
-           'extract_median_unique', 'get_file_summary', 'get_summary', 'parallel_execute', 'bcolors', 'is_port_in_use',
-           'run_cli', 'cli_overview', 'cli_database', 'cli_import', 'cli_feature_finding', 'cli_search',
-           'cli_recalibrate', 'cli_score', 'cli_align', 'cli_match', 'cli_quantify', 'cli_export', 'cli_workflow',
-           'cli_gui', 'CONTEXT_SETTINGS', 'CLICK_SETTINGS_OPTION']
+           'extract_median_unique', 'get_file_summary', 'get_summary', 'parallel_execute', 'SEARCH_MEMORY_MIN',
+           'bcolors', 'is_port_in_use', 'run_cli', 'cli_overview', 'cli_database', 'cli_import', 'cli_feature_finding',
+           'cli_search', 'cli_recalibrate', 'cli_score', 'cli_align', 'cli_match', 'cli_quantify', 'cli_export',
+           'cli_workflow', 'cli_gui', 'CONTEXT_SETTINGS', 'CLICK_SETTINGS_OPTION']
 
 # Cell
 
@@ -101,6 +101,7 @@ def create_database(
 
     """
     import alphapept.fasta
+    import alphapept.io
     if not logger_set:
         set_logger()
     if not settings_parsed:
@@ -123,6 +124,9 @@ def create_database(
 
     temp_settings = settings
 
+    database_cache = None
+    cached = False
+
     if os.path.isfile(database_path):
         logging.info(
             'Database path set and exists. Using {} as database.'.format(
@@ -166,35 +170,33 @@ def create_database(
 
             return settings
 
-        logging.info('Creating a new database from FASTA.')
+        if settings['fasta'].get('database_cache_path'):
+            database_cache = alphapept.fasta.DatabaseCache(settings['fasta']['database_cache_path'], settings['fasta'].get('database_cache_size', 51200))
+            cache_key = database_cache.get_key(settings['experiment']['fasta_paths'], settings['fasta'])
 
-        if not callback:
-            cb = functools.partial(tqdm_wrapper, tqdm.tqdm(total=1))
+        if (database_cache is not None) and database_cache.load(cache_key, database_path):
+            logging.info('Found database in cache {}.'.format(database_cache.path))
+            cached = True
         else:
-            cb = callback
+            logging.info('Creating a new database from FASTA.')
 
-        (
-            spectra,
-            pept_dict,
-            fasta_dict
-        ) = alphapept.fasta.generate_database_parallel(
-            temp_settings,
-            callback=cb
-        )
-        logging.info(
-            'Digested {:,} proteins and generated {:,} spectra'.format(
-                len(fasta_dict),
-                len(spectra)
+            if not callback:
+                cb = functools.partial(tqdm_wrapper, tqdm.tqdm(total=1))
+            else:
+                cb = callback
+
+            n_spectra, n_proteins = alphapept.fasta.save_database_parallel(
+                temp_settings,
+                database_path,
+                callback=cb
+            )
+            logging.info(
+                'Digested {:,} proteins and generated {:,} spectra'.format(
+                    n_proteins,
+                    n_spectra
+                )
             )
-        )
 
-        alphapept.fasta.save_database(
-            spectra,
-            pept_dict,
-            fasta_dict,
-            database_path = database_path,
-            **settings['fasta']
-        )
         logging.info(
             'Database saved to {}. Filesize of database is {:.2f} GB'.format(
                 database_path,
@@ -204,6 +206,17 @@ def create_database(
 
         settings['experiment']['database_path'] = database_path
 
+    if settings['search'].get('search_engine', 'pointer') == 'fragment_index':
+        if 'fragment_index' not in alphapept.io.HDF_File(database_path).read():
+            logging.info('Creating fragment index for database.')
+            alphapept.fasta.save_fragment_index(database_path)
+            cached = False
+
+    # The database is cached once it is complete, including its fragment index
+    if (database_cache is not None) and not cached:
+        database_cache.save(cache_key, database_path)
+        logging.info('Database saved to cache {}.'.format(database_cache.path))
+
     return settings
 
 # Cell
@@ -321,7 +334,13 @@ def search_data(
     if first_search:
         logging.info('Starting first search.')
         if settings['experiment']['database_path'] is not None:
-            settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
+            if settings['search'].get('database_memmap', False):
+                alphapept.fasta.save_database_memmap(settings['experiment']['database_path'])
+
+            if settings['search'].get('cluster_spectra', False):
+                settings = alphapept.search.search_db_clustered(settings, first_search = first_search, callback = cb)
+            else:
+                settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
 
             db_data = alphapept.fasta.read_database(settings['experiment']['database_path'])
 
@@ -346,7 +365,13 @@ def search_data(
         logging.info('Starting second search with DB.')
 
         if settings['experiment']['database_path'] is not None:
-            settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
+            if settings['search'].get('database_memmap', False):
+                alphapept.fasta.save_database_memmap(settings['experiment']['database_path'])
+
+            if settings['search'].get('cluster_spectra', False):
+                settings = alphapept.search.search_db_clustered(settings, first_search = first_search, callback = cb)
+            else:
+                settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
 
             db_data = alphapept.fasta.read_database(settings['experiment']['database_path'])
 
@@ -1096,6 +1121,8 @@ def get_file_summary(ms_data: alphapept.io.MS_Data_File, fields: list) -> dict:
         dict: A dictionary with summary statistics.
 
     """
+    import alphapept.search
+
     f_summary = {}
 
 
@@ -1127,6 +1154,12 @@ def get_file_summary(ms_data: alphapept.io.MS_Data_File, fields: list) -> dict:
                     if field in df.columns:
                         f_summary[f'{field} ({key}, median)'] = float(df[field].median())
 
+            if key in ['first_search','second_search']:
+                attrs = ms_data.read(attr_name="", group_name=key)
+                for field in alphapept.search.SEARCH_STATS_FIELDS:
+                    if field in attrs:
+                        f_summary[f'{field} ({key})'] = np.array(attrs[field]).tolist()
+
     return f_summary
 
 
@@ -1184,6 +1217,9 @@ import numpy as np
 import psutil
 
 
+# Smallest share of search_memory_limit in GB per search process
+SEARCH_MEMORY_MIN = 1
+
 def parallel_execute(
     settings: dict,
     step: callable,
@@ -1242,9 +1278,24 @@ def parallel_execute(
 
         if step.__name__ == 'search_db':
             memory_available = psutil.virtual_memory().available/1024**3
-            n_processes_temp = max((int(memory_available //8 ), 1)) # 8 gb per file: Todo: make this better
+            if settings['search'].get('database_memmap', False):
+                # The database is shared, only the query data is loaded per file
+                db_size = os.stat(settings['experiment']['database_path']).st_size/1024**3
+                n_processes_temp = max((int((memory_available - db_size) //2 ), 1))
+            else:
+                n_processes_temp = max((int(memory_available //8 ), 1)) # 8 gb per file: Todo: make this better
+            memory_limit = settings['search'].get('search_memory_limit', 0)
+            if memory_limit > 0:
+                # The budget is shared by the processes, each process gets at least SEARCH_MEMORY_MIN GB of it
+                memory_limit = min(memory_limit, memory_available)
+                n_processes_temp = max((int(memory_limit // SEARCH_MEMORY_MIN), 1))
             n_processes = min((n_processes, n_processes_temp))
             logging.info(f'Searching. Setting Process limit to {n_processes}.')
+            if memory_limit > 0:
+                worker_settings = copy.deepcopy(settings)
+                worker_settings['search']['search_memory_limit'] = memory_limit / n_processes
+                to_process = [(i, worker_settings) for i in range(n_files)]
+                logging.info(f'Searching each file with a memory limit of {memory_limit / n_processes:.2f} GB.')
 
 
         failed = []
@@ -1269,6 +1320,8 @@ def parallel_execute(
             ## Retry failed with more memory
             n_processes_ = max((1, int(n_processes // 2)))
             logging.info(f'Attempting to rerun failed runs with {n_processes_} processes')
+            if (step.__name__ == 'search_db') and (memory_limit > 0):
+                worker_settings['search']['search_memory_limit'] = memory_limit / n_processes_
 
             failed = []
             with alphapept.performance.AlphaPool(n_processes_) as p:
@@ -2,8 +2,9 @@
 
 __all__ = ['load_thermo_raw', 'load_bruker_raw', 'one_over_k0_to_CCS', 'check_sanity', 'extract_mzml_info',
            'load_mzml_data', '__extract_nested', 'extract_mq_settings', 'parse_mq_seq', 'get_peaks', 'get_centroid',
-           'gaussian_estimator', 'centroid_data', 'get_most_abundant', 'list_to_numpy_f32', 'HDF_File', 'MS_Data_File',
-           'index_ragged_list', 'raw_conversion']
+           'gaussian_estimator', 'centroid_data', 'get_most_abundant', 'deisotope_spectrum', 'deisotope_ms2', 'DELTA_M',
+           'M_PROTON', 'list_to_numpy_f32', 'HDF_File', 'MS_Data_File', 'index_ragged_list', 'QUERY_FRAGMENT_BLOCK',
+           'raw_conversion']
 
 # Cell
 def load_thermo_raw(
@@ -674,6 +675,141 @@ def get_most_abundant(
 
     return mass[sortindex], intensity[sortindex]
 
+# Cell
+from .constants import mass_dict
+
+DELTA_M = mass_dict['delta_M']
+M_PROTON = mass_dict['Proton']
+
+@njit
+def deisotope_spectrum(
+    mass: np.ndarray,
+    intensity: np.ndarray,
+    charge_max: int,
+    tol_ppm: float
+) -> tuple:
+    """Deisotopes a spectrum and converts multiply charged peaks to charge 1.
+
+    Args:
+        mass (np.ndarray): An array with mz values.
+        intensity (np.ndarray): An array with intensity values.
+        charge_max (int): The maximum charge of an isotope pattern.
+        tol_ppm (float): The mass tolerance in ppm to match isotope peaks.
+
+    Returns:
+        tuple: the deisotoped mass and intensity arrays, sorted by mass, and the index of the monoisotopic peak in the input arrays.
+
+    """
+    order = np.argsort(mass)
+    mz = mass[order]
+    ints = intensity[order]
+    n = len(mz)
+
+    assigned = np.zeros(n, dtype=np.bool_)
+    new_mass = np.zeros(n, dtype=np.float64)
+    new_int = np.zeros(n, dtype=np.float64)
+    new_idx = np.zeros(n, dtype=np.int64)
+    n_new = 0
+
+    for i in range(n):
+        if assigned[i]:
+            continue
+
+        charge = 1
+        int_sum = ints[i]
+
+        for z in range(charge_max, 0, -1):
+            last = i
+            j = i + 1
+            n_isotopes = 0
+            int_sum_z = ints[i]
+
+            # Follow the isotope pattern with a spacing of DELTA_M / z
+            while j < n:
+                target = mz[last] + DELTA_M / z
+                tol = target * tol_ppm * 1e-6
+                while (j < n) and (mz[j] < target - tol):
+                    j += 1
+                if (j < n) and (mz[j] <= target + tol) and not assigned[j]:
+                    n_isotopes += 1
+                    int_sum_z += ints[j]
+                    last = j
+                    j += 1
+                else:
+                    break
+
+            if n_isotopes > 0:
+                charge = z
+                int_sum = int_sum_z
+
+                # Mark the isotope peaks of the pattern
+                last = i
+                j = i + 1
+                for _ in range(n_isotopes):
+                    target = mz[last] + DELTA_M / z
+                    tol = target * tol_ppm * 1e-6
+                    while mz[j] < target - tol:
+                        j += 1
+                    assigned[j] = True
+                    last = j
+                    j += 1
+                break
+
+        new_mass[n_new] = (mz[i] - M_PROTON) * charge + M_PROTON
+        new_int[n_new] = int_sum
+        new_idx[n_new] = order[i]
+        n_new += 1
+
+    sortindex = np.argsort(new_mass[:n_new])
+
+    return new_mass[:n_new][sortindex], new_int[:n_new][sortindex], new_idx[:n_new][sortindex]
+
+
+@njit
+def deisotope_ms2(
+    indices: np.ndarray,
+    mass: np.ndarray,
+    intensity: np.ndarray,
+    charge: np.ndarray,
+    tol_ppm: float
+) -> tuple:
+    """Deisotopes concatenated MS2 spectra with `deisotope_spectrum`.
+
+    Args:
+        indices (np.ndarray): An array with indices to the start and end of each spectrum.
+        mass (np.ndarray): An array with the concatenated mz values.
+        intensity (np.ndarray): An array with the concatenated intensity values.
+        charge (np.ndarray): An array with the precursor charge of each spectrum.
+        tol_ppm (float): The mass tolerance in ppm to match isotope peaks.
+
+    Returns:
+        tuple: the new indices, the concatenated mass and intensity arrays and the index of each new peak in the input arrays.
+
+    """
+    new_indices = np.zeros(len(indices), dtype=np.int64)
+    new_mass = np.zeros(len(mass), dtype=mass.dtype)
+    new_int = np.zeros(len(mass), dtype=intensity.dtype)
+    new_idx = np.zeros(len(mass), dtype=np.int64)
+
+    for i in range(len(indices) - 1):
+        start = indices[i]
+        end = indices[i + 1]
+        charge_max = max(1, charge[i] - 1)
+
+        mass_, int_, idx_ = deisotope_spectrum(mass[start:end], intensity[start:end], charge_max, tol_ppm)
+
+        new_start = new_indices[i]
+        new_end = new_start + len(mass_)
+        new_mass[new_start:new_end] = mass_
+        new_int[new_start:new_end] = int_
+        new_idx[new_start:new_end] = idx_ + start
+        new_indices[i + 1] = new_end
+
+    n_peaks = new_indices[-1]
+
+    return new_indices, new_mass[:n_peaks], new_int[:n_peaks], new_idx[:n_peaks]
+
+
 # Cell
 def list_to_numpy_f32(
     long_list: list
@@ -842,6 +978,7 @@ class HDF_File(object):
 
 import pandas as pd
 from fastcore.foundation import patch
+from typing import Union
 
 
 @patch
@@ -1118,6 +1255,82 @@ def write(
                 except TypeError:
                     dataset.attrs[attr_name] = str(value) # e.g. dicts
         hdf_file.attrs["last_updated"] = time.asctime()
+@patch
+def append(
+    self:HDF_File,
+    value:Union[pd.DataFrame, np.ndarray],
+    dataset_name:str,
+    group_name:str=None,
+    swmr:bool=False,
+) -> None:
+    """Append the rows of a pd.DataFrame or the values of a 1D np.ndarray to a dataset of an HDF_File.
+
+    If the dataset does not exist or is an empty group, e.g. truncated with `write`,
+    it is created with resizable columns.
+    Datasets created by `write` are not resizable and cannot be appended to.
+
+    Args:
+        value (Union[pd.DataFrame, np.ndarray]): The rows or values to append.
+        dataset_name (str): The name of the dataset.
+        group_name (str): The group of the dataset.
+            If no `group_name` is provided, use the root group.
+            Defaults to None.
+        swmr (bool): Open files in swmr mode. Defaults to False.
+
+    Raises:
+        IOError: When the object is read-only.
+        ValueError: When the columns differ from the existing dataset.
+
+    """
+    if self.is_read_only:
+        raise IOError(
+            f"Trying to write to {self}, which is read_only."
+        )
+    with h5py.File(self.file_name, "a", swmr=swmr) as hdf_file:
+        group = hdf_file if group_name is None else hdf_file[group_name]
+        if isinstance(value, pd.core.frame.DataFrame):
+            if dataset_name not in group:
+                group.create_group(dataset_name)
+            df_group = group[dataset_name]
+            if len(df_group) == 0:
+                df_group.attrs["is_pd_dataframe"] = True
+            elif set(df_group.keys()) != set(value.columns):
+                raise ValueError(
+                    f"Columns of dataset {dataset_name} in {self} differ from "
+                    f"the appended columns."
+                )
+            for column in value.columns:
+                _append_dataset(df_group, column, value[column].values)
+        else:
+            if (dataset_name in group) and isinstance(group[dataset_name], h5py.Group):
+                if len(group[dataset_name]) > 0:
+                    raise ValueError(
+                        f"Dataset {dataset_name} in {self} is a group with content."
+                    )
+                del group[dataset_name]
+            _append_dataset(group, dataset_name, value)
+        hdf_file.attrs["last_updated"] = time.asctime()
+
+
+def _append_dataset(group:h5py.Group, dataset_name:str, values:np.ndarray) -> None:
+    """Append values to a resizable dataset of a group and create it if it does not exist."""
+    if dataset_name not in group:
+        dtype = values.dtype
+        if dtype == np.dtype('O'):
+            dtype = h5py.string_dtype()
+        group.create_dataset(
+            dataset_name,
+            data=values,
+            dtype=dtype,
+            maxshape=(None,),
+            chunks=True,
+        )
+    else:
+        dataset = group[dataset_name]
+        start = dataset.shape[0]
+        dataset.resize((start + len(values),))
+        dataset[start:] = values
+
 
 # Cell
 
@@ -1134,7 +1347,8 @@ def import_raw_DDA_data(
     n_most_abundant:int=-1,
     callback:callable=None,
     query_data:dict=None,
-    vendor:str=None
+    vendor:str=None,
+    ms2_deisotope:bool=False
 ) -> None:
     """Load centroided data and save it to this object.
 
@@ -1149,6 +1363,8 @@ def import_raw_DDA_data(
             Defaults to None.
         vendor (str): The vendor name, must be Thermo or Bruker if provided.
             Defaults to None.
+        ms2_deisotope (bool): If True, deisotoped MS2 spectra are saved in addition.
+            Defaults to False.
 
     """
     base, ext = os.path.splitext(file_name)
@@ -1158,7 +1374,7 @@ def import_raw_DDA_data(
             n_most_abundant=n_most_abundant,
             callback=callback
         )
-    self._save_DDA_query_data(query_data, vendor, acquisition_date_time)
+    self._save_DDA_query_data(query_data, vendor, acquisition_date_time, ms2_deisotope=ms2_deisotope)
 
 
 def index_ragged_list(ragged_list: list)  -> np.ndarray:
@@ -1241,7 +1457,8 @@ def _save_DDA_query_data(
     query_data:dict,
     vendor:str,
     acquisition_date_time:str,
-    overwrite:bool=False
+    overwrite:bool=False,
+    ms2_deisotope:bool=False
 ) -> None:
     """Save a query dict to this ms_data object.
 
@@ -1252,6 +1469,8 @@ def _save_DDA_query_data(
         overwrite (bool): Overwrite pre-existing data and truncate existing groups.
             If the False, ignore the is_overwritable flag of this HDF_File.
             Defaults to None.
+        ms2_deisotope (bool): If True, deisotoped MS2 spectra are saved in addition.
+            Defaults to False.
 
     Raises:
         KeyError: If the query_dict contains keys that do not end with 1 or 2.
@@ -1313,10 +1532,43 @@ def _save_DDA_query_data(
             )
         else:
             raise KeyError("Unspecified scan type")
+    if ms2_deisotope:
+        self.save_deisotoped_ms2()
     return
 #     to_save["bounds"] = np.sum(to_save['mass_list_ms2']>=0,axis=0).astype(np.int64)
 #     logging.info('Converted file saved to {}'.format(save_path))
 
+
+@patch
+def save_deisotoped_ms2(
+    self:MS_Data_File,
+    tol_ppm:float=10
+) -> None:
+    """Deisotope the MS2 spectra of this ms_data object and save them as a separate peak set in `Raw/MS2_deisotoped`.
+
+    Args:
+        tol_ppm (float): The mass tolerance in ppm to match isotope peaks. Defaults to 10.
+
+    """
+    group_name = "Raw/MS2_scans"
+    indices = self.read(dataset_name="indices_ms2", group_name=group_name)
+    mass = self.read(dataset_name="mass_list_ms2", group_name=group_name)
+    intensity = self.read(dataset_name="int_list_ms2", group_name=group_name)
+    charge = self.read(dataset_name="charge2", group_name=group_name).astype(np.int64)
+
+    new_indices, new_mass, new_int, new_idx = deisotope_ms2(indices, mass, intensity, charge, tol_ppm)
+
+    self.write("MS2_deisotoped", group_name="Raw", overwrite=True)
+    for dataset_name, value in [("indices_ms2", new_indices), ("mass_list_ms2", new_mass), ("int_list_ms2", new_int), ("peak_idx_ms2", new_idx)]:
+        self.write(
+            value,
+            dataset_name=dataset_name,
+            group_name="Raw/MS2_deisotoped"
+        )
+
+    logging.info(f'Deisotoped MS2 spectra from {len(mass):,} to {len(new_mass):,} peaks.')
+
+
 # Cell
 
 @patch
@@ -1325,6 +1577,8 @@ def read_DDA_query_data(
     calibrated_fragments:bool=False,
     force_recalibrate:bool=False,
     swmr:bool=False,
+    deisotoped:bool=False,
+    fragments:bool=True,
     **kwargs
 ) -> dict:
     """Read query data from this ms_data object and return it as a query_dict.
@@ -1337,6 +1591,11 @@ def read_DDA_query_data(
             recalibrate mzs values even if a recalibration is already provided.
             Defaults to False.
         swmr (bool): Open the file in swmr mode. Defaults to False.
+        deisotoped (bool): If True, the deisotoped MS2 spectra are retrieved if they were saved.
+            Defaults to False.
+        fragments (bool): If False, the MS1 scans and the fragments of the MS2 scans are not read,
+            e.g. to read them for a selection of MS2 scans with `read_DDA_query_fragments`.
+            Fragments are still calibrated if needed. Defaults to True.
         **kwargs (type): Can contain a database file name that was used for recalibration.
 
     Returns:
@@ -1344,7 +1603,7 @@ def read_DDA_query_data(
 
     """
     query_data = {}
-    for dataset_name in self.read(group_name="Raw/MS1_scans"):
+    for dataset_name in self.read(group_name="Raw/MS1_scans") if fragments else []:
         values = self.read(
             dataset_name=dataset_name,
             group_name="Raw/MS1_scans",
@@ -1352,6 +1611,8 @@ def read_DDA_query_data(
         )
         query_data[dataset_name] = values
     for dataset_name in self.read(group_name="Raw/MS2_scans"):
+        if (not fragments) and (dataset_name in ["mass_list_ms2", "int_list_ms2"]):
+            continue
         values = self.read(
             dataset_name=dataset_name,
             group_name="Raw/MS2_scans",
@@ -1379,6 +1640,23 @@ def read_DDA_query_data(
     if self.read(attr_name="vendor", group_name="Raw") == "Bruker":
         query_data["mobility"] = query_data["mobility2"]
         query_data["prec_id"] = query_data["prec_id2"]
+    peak_idx_ms2 = None
+    if deisotoped:
+        if "MS2_deisotoped" in self.read(group_name="Raw"):
+            for dataset_name in ["indices_ms2", "mass_list_ms2", "int_list_ms2"] if fragments else ["indices_ms2"]:
+                query_data[dataset_name] = self.read(
+                    dataset_name=dataset_name,
+                    group_name="Raw/MS2_deisotoped",
+                    swmr=swmr
+                )
+            if fragments:
+                peak_idx_ms2 = self.read(
+                    dataset_name="peak_idx_ms2",
+                    group_name="Raw/MS2_deisotoped",
+                    swmr=swmr
+                )
+        else:
+            logging.warning("No deisotoped MS2 spectra found, using the original spectra.")
     if calibrated_fragments:
         if ("corrected_fragment_mzs" not in self.read()) or force_recalibrate:
 #         if True:
@@ -1388,13 +1666,93 @@ def read_DDA_query_data(
                 kwargs["database_file_name"],
                 self.file_name,
             )
+    if calibrated_fragments and fragments:
+        corrected_fragment_mzs = self.read(
+            dataset_name="corrected_fragment_mzs", swmr=swmr
+        )
+        if peak_idx_ms2 is not None:
+            # Calibration is stored per original peak
+            corrected_fragment_mzs = corrected_fragment_mzs[peak_idx_ms2]
         query_data["mass_list_ms2"] *= (
-            1 - self.read(
-                dataset_name="corrected_fragment_mzs", swmr=swmr
-            ) / 10**6
+            1 - corrected_fragment_mzs / 10**6
         )
     return query_data
 
+QUERY_FRAGMENT_BLOCK = 10**7
+
+@patch
+def read_DDA_query_fragments(
+    self:MS_Data_File,
+    query_selection:np.ndarray,
+    calibrated_fragments:bool=False,
+    deisotoped:bool=False,
+    swmr:bool=False,
+    block_size:int=QUERY_FRAGMENT_BLOCK
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Read the fragments of selected MS2 scans from this ms_data object.
+    Only the fragments of the selected scans are kept, the fragment arrays are read in blocks of at most `block_size` fragments.
+
+    Args:
+        query_selection (np.ndarray): Indices of the selected MS2 scans.
+        calibrated_fragments (bool): If True, calibrated fragments are retrieved.
+            The calibration needs to be present, see `read_DDA_query_data`.
+            Defaults to False.
+        deisotoped (bool): If True, the deisotoped MS2 spectra are retrieved if they were saved.
+            Defaults to False.
+        swmr (bool): Open the file in swmr mode. Defaults to False.
+        block_size (int): The maximum number of fragments that are read at once. Defaults to QUERY_FRAGMENT_BLOCK.
+
+    Returns:
+        np.ndarray: Indices to the fragments of each selected scan.
+        np.ndarray: Fragment masses.
+        np.ndarray: Fragment intensities.
+
+    """
+    group_name = "Raw/MS2_scans"
+    if deisotoped:
+        if "MS2_deisotoped" in self.read(group_name="Raw"):
+            group_name = "Raw/MS2_deisotoped"
+        else:
+            logging.warning("No deisotoped MS2 spectra found, using the original spectra.")
+
+    query_indices = self.read(dataset_name="indices_ms2", group_name=group_name, swmr=swmr)
+    query_selection = np.asarray(query_selection, dtype=np.int64)
+    starts = query_indices[query_selection]
+    lengths = query_indices[query_selection + 1] - starts
+
+    indices = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indices[1:])
+    positions = np.repeat(starts - indices[:-1], lengths) + np.arange(indices[-1])
+
+    def read_positions(dataset_name, group_name, positions):
+        # Read the range of the sorted positions block by block
+        order = np.argsort(positions, kind="stable")
+        sorted_positions = positions[order]
+        values = np.empty(len(positions), dtype=self.read(dataset_name=dataset_name, group_name=group_name, return_dataset_dtype=True))
+        lower = 0
+        while lower < len(sorted_positions):
+            upper = np.searchsorted(sorted_positions, sorted_positions[lower] + block_size, side="left")
+            block = self.read(
+                dataset_name=dataset_name,
+                group_name=group_name,
+                return_dataset_slice=slice(sorted_positions[lower], sorted_positions[upper - 1] + 1),
+                swmr=swmr
+            )
+            values[order[lower:upper]] = block[sorted_positions[lower:upper] - sorted_positions[lower]]
+            lower = upper
+        return values
+
+    frags = read_positions("mass_list_ms2", group_name, positions)
+    ints = read_positions("int_list_ms2", group_name, positions)
+
+    if calibrated_fragments:
+        if group_name == "Raw/MS2_deisotoped":
+            # Calibration is stored per original peak
+            positions = read_positions("peak_idx_ms2", group_name, positions)
+        frags *= 1 - read_positions("corrected_fragment_mzs", None, positions) / 10**6
+
+    return indices, frags, ints
+
 # Cell
 
 def raw_conversion(
@@ -1430,8 +1788,18 @@ def raw_conversion(
             )
             ms_data_file.import_raw_DDA_data(
                 file_name,
-                n_most_abundant = settings["raw"]["n_most_abundant"]
+                n_most_abundant = settings["raw"]["n_most_abundant"],
+                ms2_deisotope = settings["raw"].get("ms2_deisotope", False)
+            )
+        elif settings["raw"].get("ms2_deisotope", False):
+            ms_data_file = MS_Data_File(
+                output_file_name,
+                is_read_only=False
             )
+            # Files converted without deisotoping only lack the deisotoped peak set
+            if "MS2_deisotoped" not in ms_data_file.read(group_name="Raw"):
+                logging.info(f'Deisotoping MS2 spectra of existing file {output_file_name}.')
+                ms_data_file.save_deisotoped_ms2()
 
         logging.info(f'File conversion of file {file_name} complete.')
         return True
@@ -1,8 +1,8 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/12_performance.ipynb (unless otherwise specified).
 
 __all__ = ['COMPILATION_MODE_OPTIONS', 'is_valid_compilation_mode', 'set_worker_count', 'MAX_WORKER_COUNT',
-           'set_compilation_mode', 'compile_function', '__copy_func', 'DYNAMIC_COMPILATION_ENABLED',
-           'performance_function', 'AlphaPool']
+           'set_compilation_mode', 'compile_function', '__copy_func', 'DYNAMIC_COMPILATION_ENABLED', 'get_chunk_bounds',
+           'performance_function', 'DYNAMIC_CHUNKS_PER_WORKER', 'AlphaPool', 'bounded_imap']
 
 # Cell
 
@@ -218,11 +218,36 @@ def __copy_func(f):
 
 # Cell
 
+DYNAMIC_CHUNKS_PER_WORKER = 16
+
+def get_chunk_bounds(costs: np.ndarray, chunk_count: int) -> np.ndarray:
+    """Split a sequence of elements into contiguous chunks of similar total cost.
+
+    Args:
+        costs (np.ndarray): The estimated cost of each element.
+        chunk_count (int): The maximum number of chunks.
+
+    Returns:
+        np.ndarray: Indices to the elements of each chunk (indptr).
+
+    """
+    cumulative_costs = np.cumsum(costs)
+    if len(cumulative_costs) > 0:
+        targets = cumulative_costs[-1] * np.arange(1, chunk_count) / chunk_count
+        bounds = np.searchsorted(cumulative_costs, targets, side='right')
+    else:
+        bounds = np.zeros(0, dtype=np.int64)
+    return np.unique(
+        np.concatenate([[0], bounds, [len(cumulative_costs)]])
+    ).astype(np.int64)
+
 def performance_function(
     _func: callable = None,
     *,
     worker_count: int = None,
     compilation_mode: str = None,
+    scheduling: str = "static",
+    chunk_costs: callable = None,
     **decorator_kwargs,
 ) -> callable:
     """A decorator to compile a given function and allow multithreading over an multiple indices.
@@ -240,6 +265,15 @@ def performance_function(
             If None, the global MAX_WORKER_COUNT is used at runtime.
             Default is None.
         compilation_mode (str): The compilation mode to use. Will be forwarded to the `compile_function` decorator.
+        scheduling (str): How the iterable is distributed over the threads of multithreaded CPU modes.
+            If "static", each worker processes a fixed share of the iterable.
+            If "dynamic", the iterable is split in small chunks that idle workers take from a queue,
+            starting with the most expensive chunks.
+            Default is "static".
+        chunk_costs (callable): Only for dynamic scheduling, a function that accepts the same arguments as the
+            decorated function and returns the estimated cost of each element of the iterable.
+            Chunks are formed with similar costs. If None, each element has the same cost.
+            Default is None.
         **decorator_kwargs: Keyword arguments that will be passed to numba.jit or cuda.jit compilation decorators.
 
     Returns:
@@ -248,6 +282,8 @@ def performance_function(
     """
     if worker_count is not None:
         worker_count = set_worker_count(worker_count, set_global=False)
+    if scheduling not in ["static", "dynamic"]:
+        raise NotImplementedError(f"Scheduling {scheduling} is not valid.")
     if compilation_mode is None:
         if DYNAMIC_COMPILATION_ENABLED:
             compilation_mode = "dynamic"
@@ -350,21 +386,51 @@ def performance_function(
                         *func_args
                     )
                 else:
-                    workers = []
-                    for worker_id in range(selected_worker_count):
-                        local_iterable = iterable[worker_id::selected_worker_count]
+                    def _parallel_local(local_iterable):
                         iterable_is_range = isinstance(local_iterable, range)
-                        worker = threading.Thread(
-                            target=parallel_function,
-                            args=(
-                                _compiled_function,
-                                np.empty(0, dtype=np.int64) if iterable_is_range else local_iterable,
-                                local_iterable.start if iterable_is_range else -1,
-                                local_iterable.stop if iterable_is_range else -1,
-                                local_iterable.step if iterable_is_range else -1,
-                                *func_args
-                            )
+                        parallel_function(
+                            _compiled_function,
+                            np.empty(0, dtype=np.int64) if iterable_is_range else local_iterable,
+                            local_iterable.start if iterable_is_range else -1,
+                            local_iterable.stop if iterable_is_range else -1,
+                            local_iterable.step if iterable_is_range else -1,
+                            *func_args
+                        )
+                    if scheduling == "dynamic":
+                        if chunk_costs is None:
+                            costs = np.ones(len(iterable))
+                        else:
+                            costs = chunk_costs(iterable, *func_args)
+                        chunk_bounds = get_chunk_bounds(
+                            costs,
+                            selected_worker_count * DYNAMIC_CHUNKS_PER_WORKER
                         )
+                        chunk_sums = np.add.reduceat(costs, chunk_bounds[:-1]) if len(costs) > 0 else np.zeros(0)
+                        # Expensive chunks first, so that cheap chunks fill up the idle workers at the end
+                        chunk_queue = list(np.argsort(-chunk_sums, kind="stable"))
+                        queue_lock = threading.Lock()
+                        def _dynamic_worker():
+                            while True:
+                                with queue_lock:
+                                    if len(chunk_queue) == 0:
+                                        return
+                                    chunk = chunk_queue.pop(0)
+                                _parallel_local(
+                                    iterable[chunk_bounds[chunk]:chunk_bounds[chunk + 1]]
+                                )
+                        worker_targets = [
+                            (_dynamic_worker, ()) for worker_id in range(selected_worker_count)
+                        ]
+                    else:
+                        worker_targets = [
+                            (
+                                _parallel_local,
+                                (iterable[worker_id::selected_worker_count],)
+                            ) for worker_id in range(selected_worker_count)
+                        ]
+                    workers = []
+                    for target, args in worker_targets:
+                        worker = threading.Thread(target=target, args=args)
                         worker.start()
                         workers.append(worker)
                     for worker in workers:
@@ -378,6 +444,7 @@ def performance_function(
 
 # Cell
 from multiprocessing import Pool
+import collections
 
 def AlphaPool(process_count: int) -> multiprocessing.Pool:
     """Create a multiprocessing.Pool object.
@@ -398,4 +465,28 @@ def AlphaPool(process_count: int) -> multiprocessing.Pool:
         new_max = 1
     logging.info(f"AlphaPool was set to {process_count} processes. Setting max to {new_max}.")
 
-    return Pool(new_max)
\ No newline at end of file
+    return Pool(new_max)
+
+
+def bounded_imap(pool: multiprocessing.Pool, func: callable, iterable, max_pending: int):
+    """Like pool.imap, but with at most max_pending submitted items that have no result yet.
+    Pool.imap consumes its iterable as fast as possible, so a lazy iterable of large items would be held in memory completely.
+
+    Args:
+        pool (multiprocessing.Pool): The pool to submit the items to.
+        func (callable): The function to apply to each item.
+        iterable (iterable): The items.
+        max_pending (int): The maximum number of pending items.
+
+    Yields:
+        The results of func in the order of the items.
+
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max(1, max_pending):
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
\ No newline at end of file
@@ -2,8 +2,9 @@
 
 __all__ = ['filter_score', 'filter_precursor', 'get_q_values', 'cut_fdr', 'cut_global_fdr', 'get_x_tandem_score',
            'score_x_tandem', 'filter_with_x_tandem', 'filter_with_score', 'score_psms', 'get_ML_features', 'train_RF',
-           'score_ML', 'filter_with_ML', 'assign_proteins', 'get_shared_proteins', 'get_protein_groups',
-           'perform_protein_grouping', 'get_ion', 'ion_dict', 'ecdf', 'score_hdf', 'protein_grouping_all']
+           'score_ML', 'filter_with_ML', 'assign_proteins', 'get_peptide_protein_map', 'get_shared_proteins',
+           'get_protein_groups', 'perform_protein_grouping', 'get_ion', 'ion_dict', 'ecdf', 'score_hdf',
+           'protein_grouping_all']
 
 # Cell
 import numpy as np
@@ -559,8 +560,10 @@ def filter_with_ML(df: pd.DataFrame,
 
 # Cell
 import networkx as nx
+import alphapept.fasta
+from typing import Union
 
-def assign_proteins(data: pd.DataFrame, pept_dict: dict) -> (pd.DataFrame, dict):
+def assign_proteins(data: pd.DataFrame, pept_dict: Union[dict, alphapept.fasta.PeptideProteinMap]) -> (pd.DataFrame, dict):
     """
     Assign psms to proteins.
     This function appends the dataframe with a column 'n_possible_proteins' which indicates how many proteins a psm could be matched to.
@@ -568,61 +571,80 @@ def assign_proteins(data: pd.DataFrame, pept_dict: dict) -> (pd.DataFrame, dict)
 
     Args:
         data (pd.DataFrame): psms table of scored and filtered search results from alphapept.
-        pept_dict (dict): dictionary that matches peptide sequences to proteins
+        pept_dict (Union[dict, alphapept.fasta.PeptideProteinMap]): dictionary or map that matches peptide sequences to proteins
 
     Returns:
         pd.DataFrame: psms table of search results from alphapept appended with the number of matched proteins.
         dict: dictionary mapping psms indices to proteins.
 
     """
+    pept_dict = get_peptide_protein_map(pept_dict)
 
     data = data.reset_index(drop=True)
 
-    data['n_possible_proteins'] = data['sequence'].apply(lambda x: len(pept_dict[x]))
+    indptr, protein_indices = pept_dict.get_proteins(data['sequence'].values)
+    data['n_possible_proteins'] = np.diff(indptr)
     unique_peptides = (data['n_possible_proteins'] == 1).sum()
     shared_peptides = (data['n_possible_proteins'] > 1).sum()
 
     logging.info(f'A total of {unique_peptides:,} unique and {shared_peptides:,} shared peptides.')
 
-    sub = data[data['n_possible_proteins']==1]
-    psms_to_protein = sub['sequence'].apply(lambda x: pept_dict[x])
+    unique = data['n_possible_proteins'].values == 1
 
     found_proteins = {}
-    for idx, _ in enumerate(psms_to_protein):
-        idx_ = psms_to_protein.index[idx]
-        p_str = 'p' + str(_[0])
+    for idx_, protein in zip(data.index[unique], protein_indices[indptr[:-1][unique]]):
+        p_str = 'p' + str(protein)
         if p_str in found_proteins:
-            found_proteins[p_str] = found_proteins[p_str] + [str(idx_)]
+            found_proteins[p_str].append(str(idx_))
         else:
             found_proteins[p_str] = [str(idx_)]
 
     return data, found_proteins
 
-def get_shared_proteins(data: pd.DataFrame, found_proteins: dict, pept_dict: dict) -> dict:
+def get_peptide_protein_map(pept_dict: Union[dict, alphapept.fasta.PeptideProteinMap]) -> alphapept.fasta.PeptideProteinMap:
+    """
+    Convert a peptide dictionary to a PeptideProteinMap for vectorized lookups.
+
+    Args:
+        pept_dict (Union[dict, alphapept.fasta.PeptideProteinMap]): dictionary or map that matches peptide sequences to proteins
+
+    Returns:
+        alphapept.fasta.PeptideProteinMap: map that matches peptide sequences to proteins
+    """
+    if isinstance(pept_dict, alphapept.fasta.PeptideProteinMap):
+        return pept_dict
+
+    return alphapept.fasta.PeptideProteinMap.from_dict(pept_dict)
+
+def get_shared_proteins(data: pd.DataFrame, found_proteins: dict, pept_dict: Union[dict, alphapept.fasta.PeptideProteinMap]) -> dict:
     """
     Assign peptides to razor proteins.
 
     Args:
         data (pd.DataFrame): psms table of scored and filtered search results from alphapept, appended with `n_possible_proteins`.
         found_proteins (dict): dictionary mapping psms indices to proteins
-        pept_dict (dict): dictionary mapping peptide indices to the originating proteins as a list
+        pept_dict (Union[dict, alphapept.fasta.PeptideProteinMap]): dictionary or map of peptide sequences to the originating proteins
 
     Returns:
         dict: dictionary mapping peptides to razor proteins
 
     """
+    pept_dict = get_peptide_protein_map(pept_dict)
 
     G = nx.Graph()
 
     sub = data[data['n_possible_proteins']>1]
 
-    for i in range(len(sub)):
-        seq, score = sub.iloc[i][['sequence','score']]
-        idx = sub.index[i]
-        possible_proteins = pept_dict[seq]
+    indptr, protein_indices = pept_dict.get_proteins(sub['sequence'].values)
+    n_proteins = np.diff(indptr)
 
-        for p in possible_proteins:
-            G.add_edge(str(idx), 'p'+str(p), score=score)
+    G.add_edges_from(
+        (str(idx), 'p'+str(p), {'score': score}) for idx, p, score in zip(
+            np.repeat(sub.index.values, n_proteins),
+            protein_indices,
+            np.repeat(sub['score'].values, n_proteins),
+        )
+    )
 
     connected_groups = np.array([list(c) for c in sorted(nx.connected_components(G), key=len, reverse=True)], dtype=object)
     n_groups = len(connected_groups)
@@ -687,7 +709,7 @@ def get_shared_proteins(data: pd.DataFrame, found_proteins: dict, pept_dict: dic
 
 
 
-def get_protein_groups(data: pd.DataFrame, pept_dict: dict, fasta_dict: dict, decoy = False, callback = None, **kwargs) -> pd.DataFrame:
+def get_protein_groups(data: pd.DataFrame, pept_dict: Union[dict, alphapept.fasta.PeptideProteinMap], fasta_dict: dict, decoy = False, callback = None, **kwargs) -> pd.DataFrame:
     """
     Function to perform protein grouping by razor approach.
     This function calls `assign_proteins` and `get_shared_proteins`.
@@ -696,7 +718,7 @@ def get_protein_groups(data: pd.DataFrame, pept_dict: dict, fasta_dict: dict, de
 
     Args:
         data (pd.DataFrame): psms table of scored and filtered search results from alphapept.
-        pept_dict (dict): A dictionary mapping peptide indices to the originating proteins as a list.
+        pept_dict (Union[dict, alphapept.fasta.PeptideProteinMap]): A dictionary or map of peptide sequences to the originating proteins.
         fasta_dict (dict): A dictionary with fasta sequences.
         decoy (bool, optional): Defaults to False.
         callback (bool, optional): Defaults to None.
@@ -704,6 +726,7 @@ def get_protein_groups(data: pd.DataFrame, pept_dict: dict, fasta_dict: dict, de
     Returns:
         pd.DataFrame: alphapept results table now including protein level information.
     """
+    pept_dict = get_peptide_protein_map(pept_dict)
     data, found_proteins = assign_proteins(data, pept_dict)
     found_proteins_razor = get_shared_proteins(data, found_proteins, pept_dict)
 
@@ -756,18 +779,20 @@ def get_protein_groups(data: pd.DataFrame, pept_dict: dict, fasta_dict: dict, de
 
     return report
 
-def perform_protein_grouping(data: pd.DataFrame, pept_dict: dict, fasta_dict: dict, **kwargs) -> pd.DataFrame:
+def perform_protein_grouping(data: pd.DataFrame, pept_dict: Union[dict, alphapept.fasta.PeptideProteinMap], fasta_dict: dict, **kwargs) -> pd.DataFrame:
     """
     Wrapper function to perform protein grouping by razor approach
 
     Args:
         data (pd.DataFrame): psms table of scored and filtered search results from alphapept.
-        pept_dict (dict): A dictionary mapping peptide indices to the originating proteins as a list.
+        pept_dict (Union[dict, alphapept.fasta.PeptideProteinMap]): A dictionary or map of peptide sequences to the originating proteins.
         fasta_dict (dict): A dictionary with fasta sequences.
 
     Returns:
         pd.DataFrame: alphapept results table now including protein level information.
     """
+    pept_dict = get_peptide_protein_map(pept_dict)
+
     data_sub = data[['sequence','score','decoy']]
     data_sub_unique = data_sub.groupby(['sequence','decoy'], as_index=False).agg({"score": "max"})
 
@@ -986,13 +1011,13 @@ def score_hdf(to_process: tuple, callback: Callable = None, parallel: bool=False
 import alphapept.utils
 
 #This function has no unit test and is covered by the quick_test
-def protein_grouping_all(settings:dict, pept_dict:dict, fasta_dict:dict, callback=None):
+def protein_grouping_all(settings:dict, pept_dict:Union[dict, alphapept.fasta.PeptideProteinMap], fasta_dict:dict, callback=None):
     """Apply protein grouping on all files in an experiment.
     This function will load all dataframes (peptide_fdr level) and perform protein grouping.
 
     Args:
         settings: (dict): Settings file for the experiment
-        pept_dict: (dict): A peptide dictionary.
+        pept_dict: (Union[dict, alphapept.fasta.PeptideProteinMap]): A peptide dictionary or map.
         fast_dict: (dict): A FASTA dictionary.
         callback: (Callable): Optional callback.
     """
@@ -1,9 +1,22 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/05_search.ipynb (unless otherwise specified).
 
-__all__ = ['compare_frags', 'ppm_to_dalton', 'get_idxs', 'compare_spectrum_parallel', 'query_data_to_features',
-           'get_psms', 'frag_delta', 'intensity_fraction', 'add_column', 'remove_column', 'get_hits', 'score',
-           'LOSS_DICT', 'LOSSES', 'get_sequences', 'get_score_columns', 'plot_psms', 'store_hdf', 'search_db',
-           'search_fasta_block', 'mass_dict', 'filter_top_n', 'ion_extractor', 'search_parallel']
+__all__ = ['compare_frags', 'ppm_to_dalton', 'get_idxs', 'get_prec_tols', 'compare_spectrum',
+           'get_compare_spectrum_costs', 'compare_spectrum_parallel', 'get_query_tiles', 'get_compare_tile_costs',
+           'compare_spectrum_tiles', 'compare_spectrum_fragment_index', 'query_data_to_features',
+           'gather_query_fragments', 'get_feature_fragments', 'time_kernel', 'count_fragment_comparisons',
+           'get_search_stats', 'combine_search_stats', 'SEARCH_STATS_BINS', 'SEARCH_STATS_FIELDS', 'get_psms',
+           'TILES_PER_WORKER', 'TOP_N', 'score_candidates', 'rescore_candidates', 'get_top_psms', 'get_delta_psms',
+           'bin_spectra', 'spectrum_similarity', 'get_top_bins', 'get_cluster_index', 'cluster_spectra_index',
+           'cluster_spectra', 'consensus_spectra', 'get_candidate_psms', 'CLUSTER_BIN_WIDTH', 'CLUSTER_TOP_N',
+           'CLUSTER_INDEX_PEAKS', 'CLUSTER_KEY_OFFSET', 'CLUSTER_CONSENSUS_FRACTION', 'frag_delta',
+           'intensity_fraction', 'add_column', 'remove_column', 'PSMColumns', 'get_hits', 'count_hits', 'score_hits',
+           'score', 'LOSS_DICT', 'LOSSES', 'SCORE_FIELDS', 'get_sequences', 'get_score_columns', 'plot_psms',
+           'SearchResultCache', 'store_hdf', 'set_calibrated_tolerances', 'get_db_data', 'save_psms',
+           'save_cluster_candidates', 'read_cluster_candidates', 'save_search_stats', 'search_db', 'ION_COLUMNS',
+           'get_memory_chunks', 'search_db_chunked', 'QUERY_FRAGMENT_BYTES', 'DB_FRAGMENT_BYTES', 'PSM_BYTES',
+           'read_cluster_run', 'get_cluster_groups', 'search_cluster_group', 'search_db_clustered', 'QueryDataCache',
+           'QUERY_DATA_CACHE', 'search_fasta_block', 'mass_dict', 'filter_top_n', 'PSMTopN', 'get_sequence_fragments',
+           'extract_hits', 'ion_extractor', 'search_parallel']
 
 # Cell
 import logging
@@ -65,14 +78,15 @@ def ppm_to_dalton(mass:float, prec_tol:int)->float:
     return mass / 1e6 * prec_tol
 
 # Cell
+from typing import Union
 
-def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:bool)-> (np.ndarray, np.ndarray):
+def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:Union[float, np.ndarray], ppm:bool)-> (np.ndarray, np.ndarray):
     """Function to get upper and lower limits to define search range for a given precursor tolerance.
 
     Args:
         db_masses (np.ndarray): Array containing database masses.
         query_masses (np.ndarray): Array containing query masses.
-        prec_tol (float): Precursor tolerance for search.
+        prec_tol (Union[float, np.ndarray]): Precursor tolerance for search, either global or per query.
         ppm: Flag to use ppm instead of Dalton.
 
     Returns:
@@ -89,17 +103,57 @@ def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:
 
     return idxs_lower, idxs_higher
 
+# Cell
+import pandas as pd
+
+def get_prec_tols(features:pd.DataFrame, prec_tol:float, ppm:bool, prec_tol_adaptive_min:float, prec_tol_adaptive_max:float, prec_tol_adaptive_std:float)->np.ndarray:
+    """Function to get a precursor tolerance per query from the mass precision of the features.
+
+    Args:
+        features (pd.DataFrame): Pandas dataframe containing feature data.
+        prec_tol (float): Global precursor tolerance, used for features without precision information and as upper bound.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        prec_tol_adaptive_min (float): Minimum precursor tolerance.
+        prec_tol_adaptive_max (float): Maximum precursor tolerance.
+        prec_tol_adaptive_std (float): Number of standard deviations of the feature mass for the tolerance.
+
+    Returns:
+        np.ndarray: Precursor tolerance for each query.
+    """
+    prec_tols = np.full(len(features), prec_tol, dtype=np.float64)
+
+    # Without mz_std, the mass error is assumed to scale with 1/sqrt(intensity)
+    if 'ms1_int_sum' in features:
+        intensity = features['ms1_int_sum'].values.astype(np.float64)
+        valid = np.isfinite(intensity) & (intensity > 0)
+        if valid.any():
+            prec_tols[valid] = prec_tol * np.sqrt(np.median(intensity[valid]) / intensity[valid])
+
+    if 'mz_std' in features:
+        mz_std = features['mz_std'].values.astype(np.float64)
+        valid = np.isfinite(mz_std) & (mz_std > 0)
+        if ppm:
+            mz_tol = prec_tol_adaptive_std * mz_std / features['mz_matched'].values * 1e6
+        else:
+            mz_tol = prec_tol_adaptive_std * mz_std * features['charge_matched'].values
+        prec_tols[valid] = mz_tol[valid]
+
+    upper = min(prec_tol_adaptive_max, prec_tol)
+
+    return np.clip(prec_tols, min(prec_tol_adaptive_min, upper), upper)
+
+
 # Cell
 
 import alphapept.performance
 
-@alphapept.performance.performance_function
-def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool):
-    """Compares a spectrum and writes to the best_hits and score.
+@alphapept.performance.compile_function
+def compare_spectrum(query_idx:int, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, pruned:np.ndarray):
+    """Compares a single query spectrum with its candidates and writes to the best_hits and score.
+    Candidates that cannot enter the current top-n are skipped and counted in pruned.
 
     Args:
         query_idx (int): Integer to the query_spectrum that should be compared.
-        query_masses (np.ndarray): Array with query masses.
         idxs_lower (np.ndarray): Array with indices for lower search boundary.
         idxs_higher (np.ndarray): Array with indices for upper search boundary.
         query_indices (np.ndarray): Array with indices to the query data.
@@ -111,6 +165,7 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
         score (np.ndarray): Reporting array that stores the scores of the best hits.
         frag_tol (float): Fragment tolerance for search.
         ppm (bool): Flag to use ppm instead of Dalton.
+        pruned (np.ndarray): Reporting array that stores the number of skipped candidates per query.
     """
 
     idx_low = idxs_lower[query_idx]
@@ -125,6 +180,14 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
     for qi in query_int:
         query_int_sum += qi
 
+    # Bounds for the database mass relative to the query mass, equivalent to the ppm mass difference
+    tol = frag_tol * 1e-6
+    factor_low = (1 - tol / 2) / (1 + tol / 2)
+    factor_high = (1 + tol / 2) / (1 - tol / 2)
+
+    len_ = best_hits.shape[1]
+    q_max = len(query_frag)
+
     for db_idx in range(idx_low, idx_high):
         db_idx_start = db_indices[db_idx]
         db_idx_next = db_idx +1
@@ -132,34 +195,51 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
 
         db_frag = db_frags[db_idx_start:db_idx_end]
 
-        q_max = len(query_frag)
         d_max = len(db_frag)
 
+        # Each match adds at most 1 + its intensity fraction, so hits can't exceed min(q_max, d_max) + 1
+        threshold = score[query_idx, len_-1]
+        if min(q_max, d_max) + 1 <= threshold:
+            pruned[query_idx] += 1
+            continue
+
         hits = 0
+        n_hits = 0
+        aborted = False
 
         q, d = 0, 0  # q > query, d > database
         while q < q_max and d < d_max:
             mass1 = query_frag[q]
             mass2 = db_frag[d]
-            delta_mass = mass1 - mass2
 
             if ppm:
-                sum_mass = mass1 + mass2
-                mass_difference = 2 * delta_mass / sum_mass * 1e6
+                mass_low = mass1 * factor_low
+                mass_high = mass1 * factor_high
             else:
-                mass_difference = delta_mass
+                mass_low = mass1 - frag_tol
+                mass_high = mass1 + frag_tol
 
-            if abs(mass_difference) <= frag_tol:
+            if mass2 < mass_low:
+                d += 1
+            elif mass2 > mass_high:
+                q += 1
+            else:
                 hits += 1
                 hits += query_int[q]/query_int_sum
+                n_hits += 1
                 d += 1
                 q += 1  # Only one query for each db element
-            elif delta_mass < 0:
-                q += 1
-            elif delta_mass > 0:
-                d += 1
+                continue
+
+            # After a miss, check if the remaining fragments can still reach the top-n
+            if n_hits + min(q_max - q, d_max - d) + 1 <= threshold:
+                aborted = True
+                break
+
+        if aborted:
+            pruned[query_idx] += 1
+            continue
 
-        len_ = best_hits.shape[1]
         for i in range(len_):
             if score[query_idx, i] < hits:
 
@@ -185,11 +265,233 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
                 best_hits[query_idx, i] = db_idx
                 break
 
+
+def get_compare_spectrum_costs(query_idx:np.ndarray, query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, *args)->np.ndarray:
+    """Estimated cost to compare queries with their candidates, used to schedule compare_spectrum_parallel.
+
+    Args:
+        query_idx (np.ndarray): Indices of the queries.
+        query_masses (np.ndarray): Array with query masses.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        *args: The remaining arguments of compare_spectrum_parallel.
+
+    Returns:
+        np.ndarray: The number of candidates of each query plus a constant overhead.
+    """
+    query_idx = np.asarray(query_idx)
+
+    return idxs_higher[query_idx] - idxs_lower[query_idx] + 1
+
+@alphapept.performance.performance_function(scheduling="dynamic", chunk_costs=get_compare_spectrum_costs)
+def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, pruned:np.ndarray):
+    """Compares a spectrum and writes to the best_hits and score.
+    Candidates that cannot enter the current top-n are skipped and counted in pruned.
+
+    Args:
+        query_idx (int): Integer to the query_spectrum that should be compared.
+        query_masses (np.ndarray): Array with query masses.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        pruned (np.ndarray): Reporting array that stores the number of skipped candidates per query.
+    """
+
+    compare_spectrum(query_idx, idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, pruned)
+
+
+# Cell
+
+def get_query_tiles(query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, n_tiles:int)->(np.ndarray, np.ndarray):
+    """Groups queries by precursor mass into tiles with a similar number of candidates.
+
+    Args:
+        query_masses (np.ndarray): Array with query masses.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        n_tiles (int): Number of tiles.
+
+    Returns:
+        np.ndarray: Indices to the queries of each tile (indptr).
+        np.ndarray: Queries sorted by precursor mass.
+    """
+    tile_queries = np.argsort(query_masses, kind='stable')
+
+    # Each query has a constant overhead in addition to its candidates
+    costs = np.cumsum(idxs_higher[tile_queries] - idxs_lower[tile_queries] + 1)
+
+    if len(costs) > 0:
+        targets = costs[-1] * np.arange(1, n_tiles) / n_tiles
+        bounds = np.searchsorted(costs, targets, side='right')
+    else:
+        bounds = np.zeros(0, dtype=np.int64)
+
+    tile_indptr = np.unique(np.concatenate([[0], bounds, [len(tile_queries)]])).astype(np.int64)
+
+    return tile_indptr, tile_queries
+
+
+def get_compare_tile_costs(tile_idx:np.ndarray, tile_indptr:np.ndarray, tile_queries:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, *args)->np.ndarray:
+    """Estimated cost to compare the queries of tiles, used to schedule compare_spectrum_tiles.
+
+    Args:
+        tile_idx (np.ndarray): Indices of the tiles.
+        tile_indptr (np.ndarray): Array with indices to the queries of each tile.
+        tile_queries (np.ndarray): Array with the queries of all tiles.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        *args: The remaining arguments of compare_spectrum_tiles.
+
+    Returns:
+        np.ndarray: The summed costs of the queries of each tile, see get_compare_spectrum_costs.
+    """
+    tile_idx = np.asarray(tile_idx)
+
+    query_costs = np.zeros(len(tile_queries) + 1, dtype=np.int64)
+    np.cumsum(get_compare_spectrum_costs(tile_queries, None, idxs_lower, idxs_higher), out=query_costs[1:])
+
+    return query_costs[tile_indptr[tile_idx + 1]] - query_costs[tile_indptr[tile_idx]]
+
+# A tile can be more expensive than the others if it only holds one expensive query, so tiles are scheduled by their costs
+@alphapept.performance.performance_function(scheduling="dynamic", chunk_costs=get_compare_tile_costs)
+def compare_spectrum_tiles(tile_idx:int, tile_indptr:np.ndarray, tile_queries:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, pruned:np.ndarray):
+    """Compares all spectra of a tile and writes to the best_hits and score.
+
+    Args:
+        tile_idx (int): Integer to the tile that should be compared.
+        tile_indptr (np.ndarray): Array with indices to the queries of each tile.
+        tile_queries (np.ndarray): Array with the queries of all tiles.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        pruned (np.ndarray): Reporting array that stores the number of skipped candidates per query.
+    """
+    for i in range(tile_indptr[tile_idx], tile_indptr[tile_idx + 1]):
+        compare_spectrum(tile_queries[i], idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, pruned)
+
+
+# Cell
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def compare_spectrum_fragment_index(query_idx:int, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, frag_index_indptr:np.ndarray, frag_index_peptides:np.ndarray, frag_index_positions:np.ndarray, bin_width:float, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool):
+    """Compares a spectrum with the candidates of a fragment index and writes to the best_hits and score.
+
+    Args:
+        query_idx (int): Integer to the query_spectrum that should be compared.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        frag_index_indptr (np.ndarray): Array with the bounds of each bin of the fragment index.
+        frag_index_peptides (np.ndarray): Array with the peptide of each fragment in the fragment index.
+        frag_index_positions (np.ndarray): Array with the position in db_frags of each fragment in the fragment index.
+        bin_width (float): Width of a bin of the fragment index.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+    """
+
+    idx_low = idxs_lower[query_idx]
+    idx_high = idxs_higher[query_idx]
+
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+
+    query_int_sum = 0
+    for qi in query_ints[query_idx_start:query_idx_end]:
+        query_int_sum += qi
+
+    n_bins = len(frag_index_indptr) - 1
+    n_candidates = max(idx_high - idx_low, 0)
+    frag_offset = db_indices[idx_low]
+
+    hits = np.zeros(n_candidates)
+    last_query = np.zeros(n_candidates, dtype=np.int64) - 1
+    frag_used = np.zeros(db_indices[idx_low + n_candidates] - frag_offset, dtype=np.bool_)
+
+    tol = frag_tol * 1e-6
+
+    for q in range(query_idx_start, query_idx_end):
+        mass1 = query_frags[q]
+
+        # Bounds for the database mass, equivalent to the mass difference in compare_frags
+        if ppm:
+            mass_low = mass1 * (1 - tol / 2) / (1 + tol / 2)
+            mass_high = mass1 * (1 + tol / 2) / (1 - tol / 2)
+        else:
+            mass_low = mass1 - frag_tol
+            mass_high = mass1 + frag_tol
+
+        bin_low = max(int(mass_low / bin_width), 0)
+        bin_high = min(int(mass_high / bin_width), n_bins - 1)
+
+        for b in range(bin_low, bin_high + 1):
+            bin_start = frag_index_indptr[b]
+            bin_end = frag_index_indptr[b + 1]
+
+            j = bin_start + np.searchsorted(frag_index_peptides[bin_start:bin_end], idx_low)
+
+            while j < bin_end:
+                db_idx = frag_index_peptides[j]
+                if db_idx >= idx_high:
+                    break
+
+                candidate = db_idx - idx_low
+                position = frag_index_positions[j]
+
+                # Only one db element for each query and vice versa
+                if (last_query[candidate] != q) and not frag_used[position - frag_offset]:
+                    mass2 = db_frags[position]
+                    if (mass2 >= mass_low) and (mass2 <= mass_high):
+                        hits[candidate] += 1
+                        hits[candidate] += query_ints[q]/query_int_sum
+                        last_query[candidate] = q
+                        frag_used[position - frag_offset] = True
+                j += 1
+
+    len_ = best_hits.shape[1]
+    for candidate in range(n_candidates):
+        hit = hits[candidate]
+        for i in range(len_):
+            if score[query_idx, i] < hit:
+                j = 1
+
+                while len_-j >= (i+1):
+                    k = len_-j
+                    score[query_idx, k] = score[query_idx, k-1]
+                    best_hits[query_idx, k] = best_hits[query_idx, k-1]
+                    j+=1
+
+                score[query_idx, i] = hit
+                best_hits[query_idx, i] = idx_low + candidate
+                break
+
+
 # Cell
 
 import pandas as pd
 import logging
-from .fasta import read_database
+from .fasta import read_database, read_database_slice, read_fragment_index_slice, get_fragment_index
 
 def query_data_to_features(query_data: dict)->pd.DataFrame:
     """Helper function to extract features from query data.
@@ -214,9 +516,182 @@ def query_data_to_features(query_data: dict)->pd.DataFrame:
 
     return features
 
+# Cell
+
+@njit
+def gather_query_fragments(query_indices:np.ndarray, query_selection:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray)->(np.ndarray, np.ndarray, np.ndarray):
+    """Gathers the fragments and intensities of selected query spectra in one pass.
+
+    Args:
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_selection (np.ndarray): Array with the query spectra to select.
+        query_frags (np.ndarray): Array with fragment masses of the query data.
+        query_ints (np.ndarray): Array with fragment intensities of the query data.
+
+    Returns:
+        np.ndarray: Indices to the fragments of each selected spectrum.
+        np.ndarray: Fragment masses.
+        np.ndarray: Fragment intensities.
+    """
+    indices = np.zeros(len(query_selection) + 1, np.int64)
+    for i, query_idx in enumerate(query_selection):
+        indices[i + 1] = indices[i] + query_indices[query_idx + 1] - query_indices[query_idx]
+
+    frags = np.empty(indices[-1], dtype=query_frags.dtype)
+    ints = np.empty(indices[-1], dtype=query_ints.dtype)
+
+    for i, query_idx in enumerate(query_selection):
+        start = query_indices[query_idx]
+        for j in range(indices[i + 1] - indices[i]):
+            frags[indices[i] + j] = query_frags[start + j]
+            ints[indices[i] + j] = query_ints[start + j]
+
+    return indices, frags, ints
+
+
+def get_feature_fragments(query_data: dict, features: pd.DataFrame, cache: bool = False)->(np.ndarray, np.ndarray, np.ndarray):
+    """Helper function to reindex the fragment arrays of the query data to the order of the features.
+    With cache, the arrays are stored in the query data together with the query_idx of the features, e.g. once per search by `search_db` and `QueryDataCache`.
+    Stored arrays are only returned for the same query_idx.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        features (pd.DataFrame): Pandas dataframe containing feature data.
+        cache (bool, optional): Flag to store the arrays in the query data. Defaults to False.
+
+    Returns:
+        np.ndarray: Indices to the fragments of each feature.
+        np.ndarray: Fragment masses.
+        np.ndarray: Fragment intensities.
+    """
+    query_selection = features['query_idx'].values.astype(np.int64)
+
+    if 'feature_fragments' in query_data:
+        cached_selection, feature_fragments = query_data['feature_fragments']
+        if np.array_equal(cached_selection, query_selection):
+            return feature_fragments
+
+    feature_fragments = gather_query_fragments(query_data["indices_ms2"], query_selection, query_data['mass_list_ms2'], query_data['int_list_ms2'])
+
+    if cache:
+        query_data['feature_fragments'] = (query_selection, feature_fragments)
+
+    return feature_fragments
+
+
+# Cell
+import time
+import numba.core.event
+from typing import Callable
+
+SEARCH_STATS_BINS = np.array([0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000])
+SEARCH_STATS_FIELDS = ['n_queries', 'n_candidates', 'candidates_histogram', 'candidates_histogram_bins', 'fragment_comparisons', 'n_pruned', 'prune_rate', 'kernel_time', 'compile_time', 'search_time', 'n_psms', 'psms_per_second']
+
+def time_kernel(kernel:Callable, *args)->(object, float, float):
+    """Call a compiled function and measure the time spent for JIT compilation.
+
+    Args:
+        kernel (Callable): The function to call.
+        *args: Arguments of the function.
+
+    Returns:
+        object: The return value of the function.
+        float: Time in seconds spent for the execution of the function.
+        float: Time in seconds spent for JIT compilation.
+    """
+    compile_time = []
+
+    with numba.core.event.install_timer("numba:compile", compile_time.append):
+        start = time.time()
+        result = kernel(*args)
+        wall_time = time.time() - start
+
+    compile_time = sum(compile_time)
+
+    return result, wall_time - compile_time, compile_time
+
+def count_fragment_comparisons(query_lengths:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, db_indices:np.ndarray)->int:
+    """Upper bound of the fragment comparisons when comparing queries to a window of database entries.
+    Comparing two spectra compares each fragment at most once.
+
+    Args:
+        query_lengths (np.ndarray): Number of fragments per query.
+        idxs_lower (np.ndarray): Lower index of the database window of each query.
+        idxs_higher (np.ndarray): Higher index of the database window of each query.
+        db_indices (np.ndarray): Indices to the database fragments.
+
+    Returns:
+        int: The number of fragment comparisons.
+    """
+    n_candidates = idxs_higher - idxs_lower
+    db_lengths = db_indices[idxs_higher] - db_indices[idxs_lower]
+
+    return int(np.sum(query_lengths * n_candidates) + np.sum(db_lengths))
+
+def get_search_stats(n_candidates:np.ndarray, fragment_comparisons:int, n_pruned:int, kernel_time:float, compile_time:float, search_time:float, n_psms:int)->dict:
+    """Summarize the statistics of a search.
+
+    Args:
+        n_candidates (np.ndarray): Number of candidates per query.
+        fragment_comparisons (int): Number of fragment comparisons.
+        n_pruned (int): Number of candidates that were pruned.
+        kernel_time (float): Time in seconds spent for the execution of the search kernels.
+        compile_time (float): Time in seconds spent for JIT compilation.
+        search_time (float): Wall time in seconds of the search.
+        n_psms (int): Number of PSMs found.
+
+    Returns:
+        dict: The search statistics with the fields of SEARCH_STATS_FIELDS.
+    """
+    n_queries = len(n_candidates)
+    histogram, _ = np.histogram(n_candidates, np.append(SEARCH_STATS_BINS, np.inf))
+    n_candidates = int(np.sum(n_candidates))
+
+    stats = {
+        'n_queries': n_queries,
+        'n_candidates': n_candidates,
+        'candidates_histogram': histogram.tolist(),
+        'candidates_histogram_bins': SEARCH_STATS_BINS.tolist(),
+        'fragment_comparisons': int(fragment_comparisons),
+        'n_pruned': int(n_pruned),
+        'prune_rate': n_pruned / n_candidates if n_candidates > 0 else 0.0,
+        'kernel_time': float(kernel_time),
+        'compile_time': float(compile_time),
+        'search_time': float(search_time),
+        'n_psms': int(n_psms),
+        'psms_per_second': n_psms / search_time if search_time > 0 else 0.0,
+    }
+
+    return stats
+
+def combine_search_stats(search_stats:list)->dict:
+    """Combine the statistics of searches of separate sets of queries.
+
+    Args:
+        search_stats (list): Statistics of the searches, see `get_search_stats`.
+
+    Returns:
+        dict: The combined search statistics.
+    """
+    stats = get_search_stats(np.zeros(0), 0, 0, 0, 0, 0, 0)
+
+    for stats_ in search_stats:
+        for key in ['n_queries', 'n_candidates', 'fragment_comparisons', 'n_pruned', 'kernel_time', 'compile_time', 'search_time', 'n_psms']:
+            stats[key] += stats_[key]
+        stats['candidates_histogram'] = (np.array(stats['candidates_histogram']) + stats_['candidates_histogram']).tolist()
+
+    stats['prune_rate'] = stats['n_pruned'] / stats['n_candidates'] if stats['n_candidates'] > 0 else 0.0
+    stats['psms_per_second'] = stats['n_psms'] / stats['search_time'] if stats['search_time'] > 0 else 0.0
+
+    return stats
+
+
 # Cell
 from typing import Callable
 
+TILES_PER_WORKER = 16
+TOP_N = 5
+
 #this wrapper function is covered by the quick_test
 def get_psms(
     query_data: dict,
@@ -230,6 +705,11 @@ def get_psms(
     callback: Callable = None,
     prec_tol_calibrated:float = None,
     frag_tol_calibrated:float = None,
+    search_engine:str = 'pointer',
+    prec_tol_adaptive:bool = False,
+    prec_tol_adaptive_min:float = 2,
+    prec_tol_adaptive_max:float = 30,
+    prec_tol_adaptive_std:float = 3,
     **kwargs
 )->(np.ndarray, int):
     """[summary]
@@ -246,25 +726,31 @@ def get_psms(
         callback (Callable, optional): Optional callback. Defaults to None.
         prec_tol_calibrated (float, optional): Precursor tolerance if calibration exists. Defaults to None.
         frag_tol_calibrated (float, optional): Fragment tolerance if calibration exists. Defaults to None.
+        search_engine (str, optional): Engine to compare spectra, either 'pointer' or 'fragment_index'. Defaults to 'pointer'.
+        prec_tol_adaptive (bool, optional): Flag to use a precursor tolerance per query from the feature mass precision, only used with prec_tol_calibrated. Defaults to False.
+        prec_tol_adaptive_min (float, optional): Minimum precursor tolerance per query. Defaults to 2.
+        prec_tol_adaptive_max (float, optional): Maximum precursor tolerance per query. Defaults to 30.
+        prec_tol_adaptive_std (float, optional): Number of standard deviations of the feature mass for the tolerance. Defaults to 3.
 
     Returns:
         np.ndarray: Numpy recordarray storing the PSMs.
-        int: 0
+        dict: Statistics of the search, see `get_search_stats`.
+
+    Raises:
+        NotImplementedError: If the search_engine is not known.
     """
+    search_start = time.time()
+
+    if search_engine not in ['pointer', 'fragment_index']:
+        raise NotImplementedError(f'Search engine {search_engine} not implemented.')
 
     if isinstance(db_data, str):
         db_masses = read_database(db_data, array_name = 'precursors')
-        db_frags = read_database(db_data, array_name = 'fragmasses')
-        db_indices = read_database(db_data, array_name = 'indices')
     else:
         db_masses = db_data['precursors']
         db_frags = db_data['fragmasses']
         db_indices = db_data['indices']
 
-    query_indices = query_data["indices_ms2"]
-    query_frags = query_data['mass_list_ms2']
-    query_ints = query_data['int_list_ms2']
-
     if frag_tol_calibrated:
         frag_tol = frag_tol_calibrated
 
@@ -276,26 +762,10 @@ def get_psms(
             query_masses = features['mass_matched'].values
         query_mz = features['mz_matched'].values
         query_rt = features['rt_matched'].values
-        query_selection = features['query_idx'].values
-        indices = np.zeros(len(query_selection) + 1, np.int64)
-        indices[1:] = np.diff(query_indices)[query_selection]
-        indices = np.cumsum(indices)
-        query_frags = np.concatenate(
-            [
-                query_frags[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
+        query_indices, query_frags, query_ints = get_feature_fragments(query_data, features)
 
-        query_ints = np.concatenate(
-            [
-                query_ints[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_indices = indices
+        if prec_tol_adaptive and prec_tol_calibrated:
+            prec_tol = get_prec_tols(features, prec_tol, ppm, prec_tol_adaptive_min, prec_tol_adaptive_max, prec_tol_adaptive_std)
     else:
         if prec_tol_calibrated:
             prec_tol = prec_tol_calibrated
@@ -303,6 +773,9 @@ def get_psms(
         query_masses = query_data['prec_mass_list2']
         query_mz = query_data['mono_mzs2']
         query_rt = query_data['rt_list_ms2']
+        query_indices = query_data["indices_ms2"]
+        query_frags = query_data['mass_list_ms2']
+        query_ints = query_data['int_list_ms2']
 
     idxs_lower, idxs_higher = get_idxs(
         db_masses,
@@ -311,11 +784,42 @@ def get_psms(
         ppm
     )
 
+    db_offset = 0
+    db_frag_offset = 0
+
+    if isinstance(db_data, str):
+        # Only read the database entries within the precursor range of the queries
+        if len(query_masses) > 0:
+            db_offset = idxs_lower.min()
+            db_end = max(idxs_higher.max(), db_offset)
+        else:
+            db_end = db_offset
+        db_slice = read_database_slice(db_data, db_offset, db_end, array_names = ['fragmasses'])
+        db_frags = db_slice['fragmasses']
+        db_indices = db_slice['indices']
+        db_frag_offset = db_slice['frag_offset']
+
+        idxs_lower = idxs_lower - db_offset
+        idxs_higher = idxs_higher - db_offset
+
+    if search_engine == 'fragment_index':
+        try:
+            if isinstance(db_data, str):
+                frag_index_indptr, frag_index_peptides, frag_index_positions, bin_width = read_fragment_index_slice(db_data, db_offset, db_end, db_frag_offset)
+            else:
+                frag_index_indptr, frag_index_peptides, frag_index_positions, bin_width = db_data['fragment_index']
+        except KeyError:
+            logging.info('No fragment index found in database. Creating fragment index.')
+            frag_index_indptr, frag_index_peptides, frag_index_positions, bin_width = get_fragment_index(db_frags, db_indices)
+
     n_queries = len(query_masses)
     n_db = len(db_masses)
-    top_n = 5
+    top_n = TOP_N
+
+    n_candidates = idxs_higher - idxs_lower
+    fragment_comparisons = count_fragment_comparisons(np.diff(query_indices), idxs_lower, idxs_higher, db_indices)
 
-    if alphapept.performance.COMPILATION_MODE == "cuda":
+    if (alphapept.performance.COMPILATION_MODE == "cuda") and (search_engine == 'pointer'):
         import cupy
         cupy = cupy
 
@@ -334,13 +838,31 @@ def get_psms(
 
     best_hits = cupy.zeros((n_queries, top_n), dtype=cupy.int_)-1
     score = cupy.zeros((n_queries, top_n), dtype=cupy.float_)
+    pruned = cupy.zeros(n_queries, dtype=cupy.int64)
 
-    logging.info(f'Performing search on {n_queries:,} query and {n_db:,} db entries with frag_tol = {frag_tol:.2f} and prec_tol = {prec_tol:.2f}.')
+    if np.ndim(prec_tol) > 0:
+        prec_tol_str = f'{np.median(prec_tol):.2f} (median per query)' if len(prec_tol) > 0 else '-'
+    else:
+        prec_tol_str = f'{prec_tol:.2f}'
+
+    logging.info(f'Performing search on {n_queries:,} query and {n_db:,} db entries with frag_tol = {frag_tol:.2f} and prec_tol = {prec_tol_str}.')
+
+    if search_engine == 'fragment_index':
+        _, kernel_time, compile_time = time_kernel(compare_spectrum_fragment_index, cupy.arange(n_queries), idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, frag_index_indptr, frag_index_peptides, frag_index_positions, bin_width, best_hits, score, frag_tol, ppm)
+    else:
+        if cupy.__name__ != 'numpy':
+            _, kernel_time, compile_time = time_kernel(compare_spectrum_parallel, cupy.arange(n_queries), cupy.arange(n_queries), idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, pruned)
+        else:
+            n_tiles = min(n_queries, alphapept.performance.MAX_WORKER_COUNT * TILES_PER_WORKER)
+            tile_indptr, tile_queries = get_query_tiles(query_masses, idxs_lower, idxs_higher, n_tiles)
+            _, kernel_time, compile_time = time_kernel(compare_spectrum_tiles, range(len(tile_indptr) - 1), tile_indptr, tile_queries, idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, pruned)
 
-    compare_spectrum_parallel(cupy.arange(n_queries), cupy.arange(n_queries), idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm)
+    n_pruned = int(pruned.sum())
+    if (search_engine != 'fragment_index') and (n_candidates.sum() > 0):
+        logging.info(f'Pruned {n_pruned:,} of {n_candidates.sum():,} candidates ({n_pruned/n_candidates.sum()*100:.2f} %) that could not enter the top {top_n}.')
 
     query_idx, db_idx_ = cupy.where(score > min_frag_hits)
-    db_idx = best_hits[query_idx, db_idx_]
+    db_idx = best_hits[query_idx, db_idx_] + db_offset
     score_ = score[query_idx, db_idx_]
 
     if cupy.__name__ != 'numpy':
@@ -354,7 +876,517 @@ def get_psms(
 
     logging.info('Found {:,} psms.'.format(len(psms)))
 
-    return psms, 0
+    search_stats = get_search_stats(n_candidates, fragment_comparisons, n_pruned, kernel_time, compile_time, time.time() - search_start, len(psms))
+
+    return psms, search_stats
+
+# Cell
+from typing import Union
+
+def score_candidates(query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, cand_query_idx:np.ndarray, cand_db_idx:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, frag_tol:float, ppm:bool)->np.ndarray:
+    """Count the fragment hits for given pairs of query and database entries.
+
+    Args:
+        query_indices (np.ndarray): Indices to the query fragments.
+        query_frags (np.ndarray): Query fragment masses.
+        query_ints (np.ndarray): Query fragment intensities.
+        cand_query_idx (np.ndarray): Query index of each candidate.
+        cand_db_idx (np.ndarray): Database index of each candidate, relative to db_indices.
+        db_indices (np.ndarray): Indices to the database fragments.
+        db_frags (np.ndarray): Database fragment masses.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        np.ndarray: The number of fragment hits per candidate.
+    """
+    n_cand = len(cand_query_idx)
+
+    best_hits = np.zeros((n_cand, 1), dtype=np.int_)-1
+    score = np.zeros((n_cand, 1), dtype=np.float_)
+    pruned = np.zeros(n_cand, dtype=np.int64)
+
+    if n_cand > 0:
+        # Each candidate is compared as a separate query with a window of one database entry
+        cand_indices, cand_frags, cand_ints = gather_query_fragments(query_indices, cand_query_idx, query_frags, query_ints)
+        cand_lower = cand_db_idx
+        cand_higher = cand_lower + 1
+
+        compare_spectrum_parallel(range(n_cand), np.arange(n_cand), cand_lower, cand_higher, cand_indices, cand_frags, cand_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, pruned)
+
+    return score[:, 0]
+
+def rescore_candidates(query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, cand_query_idx:np.ndarray, cand_db_idx:np.ndarray, db_data:Union[dict, str], frag_tol:float, ppm:bool)->(np.ndarray, float, float, int):
+    """Count the fragment hits for given pairs of query and database entries and read the database range of the candidates.
+
+    Args:
+        query_indices (np.ndarray): Indices to the query fragments.
+        query_frags (np.ndarray): Query fragment masses.
+        query_ints (np.ndarray): Query fragment intensities.
+        cand_query_idx (np.ndarray): Query index of each candidate.
+        cand_db_idx (np.ndarray): Database index of each candidate.
+        db_data (Union[dict, str]): Data structure containing the database data or path to database.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        np.ndarray: The number of fragment hits per candidate.
+        float: Time in seconds spent for the execution of the search kernels.
+        float: Time in seconds spent for JIT compilation.
+        int: The number of fragment comparisons.
+    """
+    if len(cand_db_idx) == 0:
+        return np.zeros(0), 0, 0, 0
+
+    if isinstance(db_data, str):
+        db_offset = cand_db_idx.min()
+        db_slice = read_database_slice(db_data, db_offset, cand_db_idx.max() + 1, array_names = ['fragmasses'])
+        db_frags = db_slice['fragmasses']
+        db_indices = db_slice['indices']
+    else:
+        db_offset = 0
+        db_frags = db_data['fragmasses']
+        db_indices = db_data['indices']
+
+    hits, kernel_time, compile_time = time_kernel(score_candidates, query_indices, query_frags, query_ints, cand_query_idx, cand_db_idx - db_offset, db_indices, db_frags, frag_tol, ppm)
+    fragment_comparisons = count_fragment_comparisons(np.diff(query_indices)[cand_query_idx], cand_db_idx - db_offset, cand_db_idx - db_offset + 1, db_indices)
+
+    return hits, kernel_time, compile_time, fragment_comparisons
+
+def get_top_psms(psms:np.ndarray, top_n:int = TOP_N)->np.ndarray:
+    """Keep the top-n PSMs per query as in get_psms.
+
+    Args:
+        psms (np.ndarray): Numpy recordarray with query_idx, db_idx and hits.
+        top_n (int, optional): Number of PSMs to keep per query. Defaults to TOP_N.
+
+    Returns:
+        np.ndarray: The PSMs sorted by query_idx and decreasing hits.
+    """
+    order = np.lexsort((-psms['hits'], psms['query_idx']))
+    psms = psms[order]
+    rank = np.arange(len(psms)) - np.searchsorted(psms['query_idx'], psms['query_idx'])
+
+    return psms[rank < top_n]
+
+def get_delta_psms(
+    query_data: dict,
+    db_data: Union[dict, str],
+    features: pd.DataFrame,
+    first_psms: pd.DataFrame,
+    prec_tol: float,
+    ppm: bool,
+    min_frag_hits: int,
+    frag_tol: float,
+    prec_tol_calibrated: float = None,
+    frag_tol_calibrated: float = None,
+    prec_tol_adaptive: bool = False,
+    prec_tol_adaptive_min: float = 2,
+    prec_tol_adaptive_max: float = 30,
+    prec_tol_adaptive_std: float = 3,
+    **kwargs
+)->(np.ndarray, int):
+    """Second search that rescores the candidates of the first search.
+    Queries whose calibrated precursor window reaches outside the window of the first search are searched with `get_psms`.
+    This also applies to queries with TOP_N PSMs in the first search, as candidates below the top-n might be missing.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        db_data (Union[dict, str]): Data structure containing the database data or path to database.
+        features (pd.DataFrame): Pandas dataframe containing feature data with the corrected masses.
+        first_psms (pd.DataFrame): PSMs of the first search, needs query_idx and db_idx.
+        prec_tol (float): Precursor tolerance of the first search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_frag_hits (int): Minimum number of frag hits to report a PSMs.
+        frag_tol (float): Fragment tolerance for search.
+        prec_tol_calibrated (float, optional): Calibrated precursor tolerance. Defaults to None.
+        frag_tol_calibrated (float, optional): Calibrated fragment tolerance. Defaults to None.
+        prec_tol_adaptive (bool, optional): Flag to use a precursor tolerance per query from the feature mass precision, only used with prec_tol_calibrated. Defaults to False.
+        prec_tol_adaptive_min (float, optional): Minimum precursor tolerance per query. Defaults to 2.
+        prec_tol_adaptive_max (float, optional): Maximum precursor tolerance per query. Defaults to 30.
+        prec_tol_adaptive_std (float, optional): Number of standard deviations of the feature mass for the tolerance. Defaults to 3.
+
+    Returns:
+        np.ndarray: Numpy recordarray storing the PSMs.
+        dict: Statistics of the search, see `get_search_stats`.
+    """
+    search_start = time.time()
+    search_settings = dict(kwargs, prec_tol=prec_tol, ppm=ppm, min_frag_hits=min_frag_hits, frag_tol=frag_tol, prec_tol_calibrated=prec_tol_calibrated, frag_tol_calibrated=frag_tol_calibrated, prec_tol_adaptive=prec_tol_adaptive, prec_tol_adaptive_min=prec_tol_adaptive_min, prec_tol_adaptive_max=prec_tol_adaptive_max, prec_tol_adaptive_std=prec_tol_adaptive_std)
+
+    if frag_tol_calibrated:
+        frag_tol = frag_tol_calibrated
+
+    if isinstance(db_data, str):
+        db_masses = read_database(db_data, array_name = 'precursors')
+    else:
+        db_masses = db_data['precursors']
+
+    # The first search always uses the global tolerance
+    if not prec_tol_calibrated:
+        prec_tol_calibrated = prec_tol
+    elif prec_tol_adaptive:
+        prec_tol_calibrated = get_prec_tols(features, prec_tol_calibrated, ppm, prec_tol_adaptive_min, prec_tol_adaptive_max, prec_tol_adaptive_std)
+
+    idxs_lower_first, idxs_higher_first = get_idxs(db_masses, features['mass_matched'].values, prec_tol, ppm)
+    idxs_lower, idxs_higher = get_idxs(db_masses, features['corrected_mass'].values, prec_tol_calibrated, ppm)
+
+    outside = (idxs_lower < idxs_lower_first) | (idxs_higher > idxs_higher_first)
+    # Only the top-n candidates per query are stored, so a full list might miss candidates that score higher after calibration
+    outside |= np.bincount(first_psms['query_idx'].values.astype(np.int64), minlength=len(features)) >= TOP_N
+    outside_idx = np.flatnonzero(outside)
+
+    query_indices, query_frags, query_ints = get_feature_fragments(query_data, features)
+
+    # Candidates of the first search that are within the calibrated window
+    cand_query_idx = first_psms['query_idx'].values.astype(np.int64)
+    cand_db_idx = first_psms['db_idx'].values.astype(np.int64)
+    valid = ~outside[cand_query_idx]
+    valid &= (cand_db_idx >= idxs_lower[cand_query_idx]) & (cand_db_idx < idxs_higher[cand_query_idx])
+    cand_query_idx = cand_query_idx[valid]
+    cand_db_idx = cand_db_idx[valid]
+
+    # Remove duplicates as the first search can report the same candidate for a query twice
+    cand = np.unique(np.stack([cand_query_idx, cand_db_idx], axis=1), axis=0)
+    cand_query_idx = cand[:, 0]
+    cand_db_idx = cand[:, 1]
+    n_cand = len(cand)
+
+    logging.info(f'Rescoring {n_cand:,} candidates of the first search. Searching {len(outside_idx):,} of {len(features):,} queries again.')
+
+    hits, kernel_time, compile_time, fragment_comparisons = rescore_candidates(query_indices, query_frags, query_ints, cand_query_idx, cand_db_idx, db_data, frag_tol, ppm)
+
+    n_candidates = np.bincount(cand_query_idx, minlength=len(features))
+    n_pruned = 0
+
+    keep = hits > min_frag_hits
+
+    psms = [np.array(
+        list(zip(cand_query_idx[keep], cand_db_idx[keep], hits[keep])), dtype=[("query_idx", int), ("db_idx", int), ("hits", float)]
+    )]
+
+    if len(outside_idx) > 0:
+        psms_, search_stats_ = get_psms(query_data, db_data, features.iloc[outside_idx], **search_settings)
+        psms_['query_idx'] = outside_idx[psms_['query_idx']]
+        psms.append(psms_)
+
+        n_candidates[outside_idx] += idxs_higher[outside_idx] - idxs_lower[outside_idx]
+        fragment_comparisons += search_stats_['fragment_comparisons']
+        n_pruned += search_stats_['n_pruned']
+        kernel_time += search_stats_['kernel_time']
+        compile_time += search_stats_['compile_time']
+
+    psms = get_top_psms(np.concatenate(psms))
+
+    logging.info('Found {:,} psms.'.format(len(psms)))
+
+    search_stats = get_search_stats(n_candidates, fragment_comparisons, n_pruned, kernel_time, compile_time, time.time() - search_start, len(psms))
+
+    return psms, search_stats
+
+
+# Cell
+CLUSTER_BIN_WIDTH = 1.0005079
+CLUSTER_TOP_N = 2 * TOP_N
+CLUSTER_INDEX_PEAKS = 6
+CLUSTER_KEY_OFFSET = 2**32
+CLUSTER_CONSENSUS_FRACTION = 0.5
+
+@njit
+def bin_spectra(query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, bin_width:float)->(np.ndarray, np.ndarray, np.ndarray):
+    """Convert spectra to sparse vectors of binned fragment masses.
+
+    Args:
+        query_indices (np.ndarray): Indices to the query fragments.
+        query_frags (np.ndarray): Query fragment masses.
+        query_ints (np.ndarray): Query fragment intensities.
+        bin_width (float): Width of a fragment mass bin.
+
+    Returns:
+        np.ndarray: Indices to the bins of each spectrum.
+        np.ndarray: Sorted bins of each spectrum.
+        np.ndarray: Weights of the bins, normalized to unit length per spectrum.
+    """
+    n_spectra = len(query_indices) - 1
+    bin_indptr = np.zeros(n_spectra + 1, np.int64)
+    bins = np.zeros(len(query_frags), np.int64)
+    weights = np.zeros(len(query_frags), np.float64)
+
+    pos = 0
+    for i in range(n_spectra):
+        start = query_indices[i]
+        end = query_indices[i + 1]
+        spec_bins = (query_frags[start:end] / bin_width).astype(np.int64)
+        spec_weights = np.sqrt(query_ints[start:end].astype(np.float64))
+        order = np.argsort(spec_bins)
+
+        spec_start = pos
+        for j in order:
+            if pos > spec_start and bins[pos - 1] == spec_bins[j]:
+                weights[pos - 1] += spec_weights[j]
+            else:
+                bins[pos] = spec_bins[j]
+                weights[pos] = spec_weights[j]
+                pos += 1
+
+        norm = np.sqrt(np.sum(weights[spec_start:pos] ** 2))
+        if norm > 0:
+            weights[spec_start:pos] /= norm
+        bin_indptr[i + 1] = pos
+
+    return bin_indptr, bins[:pos], weights[:pos]
+
+@njit
+def spectrum_similarity(idx_a:int, idx_b:int, bin_indptr:np.ndarray, bins:np.ndarray, weights:np.ndarray)->float:
+    """Cosine similarity of two binned spectra.
+
+    Args:
+        idx_a (int): Index of the first spectrum.
+        idx_b (int): Index of the second spectrum.
+        bin_indptr (np.ndarray): Indices to the bins of each spectrum.
+        bins (np.ndarray): Sorted bins of each spectrum.
+        weights (np.ndarray): Normalized weights of the bins.
+
+    Returns:
+        float: The cosine similarity.
+    """
+    a = bin_indptr[idx_a]
+    a_end = bin_indptr[idx_a + 1]
+    b = bin_indptr[idx_b]
+    b_end = bin_indptr[idx_b + 1]
+
+    similarity = 0.0
+    while (a < a_end) and (b < b_end):
+        if bins[a] == bins[b]:
+            similarity += weights[a] * weights[b]
+            a += 1
+            b += 1
+        elif bins[a] < bins[b]:
+            a += 1
+        else:
+            b += 1
+
+    return similarity
+
+@njit
+def get_top_bins(bin_indptr:np.ndarray, bins:np.ndarray, weights:np.ndarray, n_peaks:int)->(np.ndarray, np.ndarray):
+    """Get the bins with the highest weights of each spectrum.
+
+    Args:
+        bin_indptr (np.ndarray): Indices to the bins of each spectrum.
+        bins (np.ndarray): Sorted bins of each spectrum.
+        weights (np.ndarray): Normalized weights of the bins.
+        n_peaks (int): Number of bins per spectrum.
+
+    Returns:
+        np.ndarray: Indices to the top bins of each spectrum.
+        np.ndarray: The top bins of each spectrum.
+    """
+    n_spectra = len(bin_indptr) - 1
+    top_indptr = np.zeros(n_spectra + 1, np.int64)
+    for i in range(n_spectra):
+        top_indptr[i + 1] = top_indptr[i] + min(n_peaks, bin_indptr[i + 1] - bin_indptr[i])
+
+    top_bins = np.zeros(top_indptr[-1], np.int64)
+    for i in range(n_spectra):
+        start = bin_indptr[i]
+        order = np.argsort(-weights[start:bin_indptr[i + 1]])
+        for j in range(top_indptr[i + 1] - top_indptr[i]):
+            top_bins[top_indptr[i] + j] = bins[start + order[j]]
+
+    return top_indptr, top_bins
+
+def get_cluster_index(masses:np.ndarray, charges:np.ndarray, top_indptr:np.ndarray, top_bins:np.ndarray)->(np.ndarray, np.ndarray, np.ndarray):
+    """Inverted index from the charge and the top bins to the spectra, sorted by precursor mass for each key.
+
+    Args:
+        masses (np.ndarray): Precursor masses.
+        charges (np.ndarray): Precursor charges.
+        top_indptr (np.ndarray): Indices to the top bins of each spectrum.
+        top_bins (np.ndarray): The top bins of each spectrum.
+
+    Returns:
+        np.ndarray: Sorted keys of the index.
+        np.ndarray: The spectrum of each key.
+        np.ndarray: The precursor mass of each key.
+    """
+    spectra = np.repeat(np.arange(len(masses)), np.diff(top_indptr))
+    keys = charges[spectra].astype(np.int64) * CLUSTER_KEY_OFFSET + top_bins
+    order = np.lexsort((masses[spectra], keys))
+
+    return keys[order], spectra[order], masses[spectra][order]
+
+@njit
+def cluster_spectra_index(order:np.ndarray, masses:np.ndarray, charges:np.ndarray, mass_tols:np.ndarray, bin_indptr:np.ndarray, bins:np.ndarray, weights:np.ndarray, min_similarity:float, top_indptr:np.ndarray, top_bins:np.ndarray, index_keys:np.ndarray, index_spectra:np.ndarray, index_masses:np.ndarray)->np.ndarray:
+    """Greedy clustering of spectra that only compares spectra sharing a top bin, see `cluster_spectra`.
+
+    Args:
+        order (np.ndarray): Order of the spectra sorted by charge and precursor mass.
+        masses (np.ndarray): Precursor masses.
+        charges (np.ndarray): Precursor charges.
+        mass_tols (np.ndarray): Precursor tolerance in Dalton per spectrum.
+        bin_indptr (np.ndarray): Indices to the bins of each spectrum.
+        bins (np.ndarray): Sorted bins of each spectrum.
+        weights (np.ndarray): Normalized weights of the bins.
+        min_similarity (float): Minimum cosine similarity to the representative of a cluster.
+        top_indptr (np.ndarray): Indices to the top bins of each spectrum.
+        top_bins (np.ndarray): The top bins of each spectrum.
+        index_keys (np.ndarray): Sorted keys of the index.
+        index_spectra (np.ndarray): The spectrum of each key.
+        index_masses (np.ndarray): The precursor mass of each key.
+
+    Returns:
+        np.ndarray: The index of the representative spectrum for each spectrum.
+    """
+    labels = np.zeros(len(masses), np.int64) - 1
+
+    for i in order:
+        if labels[i] >= 0:
+            continue
+        labels[i] = i
+        for k in range(top_indptr[i], top_indptr[i + 1]):
+            key = charges[i] * CLUSTER_KEY_OFFSET + top_bins[k]
+            start = np.searchsorted(index_keys, key)
+            end = np.searchsorted(index_keys, key + 1)
+            pos = start + np.searchsorted(index_masses[start:end], masses[i])
+            while (pos < end) and (index_masses[pos] - masses[i] <= mass_tols[i]):
+                j = index_spectra[pos]
+                if labels[j] < 0:
+                    if spectrum_similarity(i, j, bin_indptr, bins, weights) >= min_similarity:
+                        labels[j] = i
+                pos += 1
+
+    return labels
+
+def cluster_spectra(order:np.ndarray, masses:np.ndarray, charges:np.ndarray, mass_tols:np.ndarray, bin_indptr:np.ndarray, bins:np.ndarray, weights:np.ndarray, min_similarity:float, n_peaks:int = CLUSTER_INDEX_PEAKS)->np.ndarray:
+    """Greedy clustering of spectra with the same charge, similar precursor mass and similar fragments.
+    Spectra are only compared if they share one of their most intense bins, which are looked up in an inverted index.
+
+    Args:
+        order (np.ndarray): Order of the spectra sorted by charge and precursor mass.
+        masses (np.ndarray): Precursor masses.
+        charges (np.ndarray): Precursor charges.
+        mass_tols (np.ndarray): Precursor tolerance in Dalton per spectrum.
+        bin_indptr (np.ndarray): Indices to the bins of each spectrum.
+        bins (np.ndarray): Sorted bins of each spectrum.
+        weights (np.ndarray): Normalized weights of the bins.
+        min_similarity (float): Minimum cosine similarity to the representative of a cluster.
+        n_peaks (int, optional): Number of the most intense bins per spectrum in the index. Defaults to CLUSTER_INDEX_PEAKS.
+
+    Returns:
+        np.ndarray: The index of the representative spectrum for each spectrum.
+    """
+    charges = charges.astype(np.int64)
+    top_indptr, top_bins = get_top_bins(bin_indptr, bins, weights, n_peaks)
+    index_keys, index_spectra, index_masses = get_cluster_index(masses, charges, top_indptr, top_bins)
+
+    return cluster_spectra_index(order, masses, charges, mass_tols, bin_indptr, bins, weights, min_similarity, top_indptr, top_bins, index_keys, index_spectra, index_masses)
+
+@njit
+def consensus_spectra(peak_clusters:np.ndarray, peak_frags:np.ndarray, peak_ints:np.ndarray, n_members:np.ndarray, frag_tol:float, ppm:bool, min_fraction:float)->(np.ndarray, np.ndarray, np.ndarray):
+    """Merge the fragments of the members of each cluster to a consensus spectrum.
+    Fragments within the fragment tolerance are merged to their intensity-weighted mean mass and their mean intensity per member.
+    Only fragments that are found in at least a fraction of the members are kept.
+
+    Args:
+        peak_clusters (np.ndarray): Cluster of each fragment, sorted.
+        peak_frags (np.ndarray): Fragment masses, sorted within each cluster.
+        peak_ints (np.ndarray): Fragment intensities.
+        n_members (np.ndarray): Number of members of each cluster.
+        frag_tol (float): Fragment tolerance to merge fragments.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_fraction (float): Minimum fraction of the members with a fragment.
+
+    Returns:
+        np.ndarray: Indices to the fragments of each consensus spectrum.
+        np.ndarray: Fragment masses.
+        np.ndarray: Fragment intensities.
+    """
+    n_clusters = len(n_members)
+    n_peaks = len(peak_frags)
+    indices = np.zeros(n_clusters + 1, np.int64)
+    frags = np.zeros(n_peaks, peak_frags.dtype)
+    ints = np.zeros(n_peaks, peak_ints.dtype)
+
+    pos = 0
+    start = 0
+    for c in range(n_clusters):
+        min_count = max(1, int(np.ceil(min_fraction * n_members[c])))
+        while (start < n_peaks) and (peak_clusters[start] == c):
+            if ppm:
+                tol = peak_frags[start] * frag_tol * 1e-6
+            else:
+                tol = frag_tol
+
+            end = start
+            int_sum = 0.0
+            mass_sum = 0.0
+            while (end < n_peaks) and (peak_clusters[end] == c) and (peak_frags[end] - peak_frags[start] <= tol):
+                int_sum += peak_ints[end]
+                mass_sum += peak_frags[end] * peak_ints[end]
+                end += 1
+
+            if end - start >= min_count:
+                if int_sum > 0:
+                    frags[pos] = mass_sum / int_sum
+                else:
+                    frags[pos] = peak_frags[start]
+                ints[pos] = int_sum / n_members[c]
+                pos += 1
+            start = end
+        indices[c + 1] = pos
+
+    return indices, frags[:pos], ints[:pos]
+
+def get_candidate_psms(
+    query_data: dict,
+    db_data: Union[dict, str],
+    features: pd.DataFrame,
+    candidates: pd.DataFrame,
+    ppm: bool,
+    min_frag_hits: int,
+    frag_tol: float,
+    frag_tol_calibrated: float = None,
+    **kwargs
+)->(np.ndarray, dict):
+    """Search that rescores given candidates of each query, e.g. the candidates of a cluster of spectra.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        db_data (Union[dict, str]): Data structure containing the database data or path to database.
+        features (pd.DataFrame): Pandas dataframe containing feature data.
+        candidates (pd.DataFrame): The candidates, needs query_idx and db_idx.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_frag_hits (int): Minimum number of frag hits to report a PSMs.
+        frag_tol (float): Fragment tolerance for search.
+        frag_tol_calibrated (float, optional): Calibrated fragment tolerance. Defaults to None.
+
+    Returns:
+        np.ndarray: Numpy recordarray storing the PSMs.
+        dict: Statistics of the search, see `get_search_stats`.
+    """
+    search_start = time.time()
+
+    if frag_tol_calibrated:
+        frag_tol = frag_tol_calibrated
+
+    query_indices, query_frags, query_ints = get_feature_fragments(query_data, features)
+    cand_query_idx = candidates['query_idx'].values.astype(np.int64)
+    cand_db_idx = candidates['db_idx'].values.astype(np.int64)
+
+    hits, kernel_time, compile_time, fragment_comparisons = rescore_candidates(query_indices, query_frags, query_ints, cand_query_idx, cand_db_idx, db_data, frag_tol, ppm)
+    keep = hits > min_frag_hits
+
+    psms = np.array(
+        list(zip(cand_query_idx[keep], cand_db_idx[keep], hits[keep])), dtype=[("query_idx", int), ("db_idx", int), ("hits", float)]
+    )
+    psms = get_top_psms(psms)
+
+    logging.info('Found {:,} psms.'.format(len(psms)))
+
+    n_candidates = np.bincount(cand_query_idx, minlength=len(features))
+    search_stats = get_search_stats(n_candidates, fragment_comparisons, 0, kernel_time, compile_time, time.time() - search_start, len(psms))
+
+    return psms, search_stats
 
 # Cell
 @njit
@@ -436,6 +1468,89 @@ def remove_column(recarray:np.ndarray, name:str)->np.ndarray:
         recarray = drop_fields(recarray, name, usemask=False, asrecarray=True)
     return recarray
 
+# Cell
+from typing import Union
+
+class PSMColumns():
+    """Column-wise container for PSMs.
+
+    Args:
+        psms (Union[np.ndarray, pd.DataFrame], optional): Recordarray or DataFrame with the initial columns. Defaults to None.
+    """
+    def __init__(self, psms:Union[np.ndarray, pd.DataFrame] = None):
+        self.columns = {}
+        if isinstance(psms, pd.DataFrame):
+            for name in psms.columns:
+                self.columns[name] = np.array(psms[name].values)
+        elif psms is not None:
+            for name in psms.dtype.names:
+                self.columns[name] = np.ascontiguousarray(psms[name])
+
+    def __len__(self)->int:
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __contains__(self, name:str)->bool:
+        return name in self.columns
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        selected = PSMColumns()
+        for name, column in self.columns.items():
+            selected.columns[name] = column[key]
+        return selected
+
+    def __setitem__(self, name:str, column:np.ndarray):
+        column = np.asarray(column)
+        if (len(self.columns) > 0) and (len(column) != len(self)):
+            raise ValueError(f'Column {name} has length {len(column)}, expected {len(self)}.')
+        self.columns[name] = column
+
+    def __delitem__(self, name:str):
+        del self.columns[name]
+
+    @property
+    def dtype(self)->np.dtype:
+        """The dtype of a recordarray with the same columns."""
+        return np.dtype([(name, column.dtype) for name, column in self.columns.items()])
+
+    def to_df(self)->pd.DataFrame:
+        """Converts the PSMs to a DataFrame.
+
+        Returns:
+            pd.DataFrame: Pandas DataFrame containing the PSMs.
+        """
+        return pd.DataFrame(self.columns)
+
+    def to_records(self)->np.ndarray:
+        """Converts the PSMs to a recordarray.
+
+        Returns:
+            np.ndarray: NumPy recordarray containing the PSMs.
+        """
+        psms = np.zeros(len(self), dtype=self.dtype)
+        for name, column in self.columns.items():
+            psms[name] = column
+        return psms.view(np.recarray)
+
+    def to_hdf(self, ms_file:alphapept.io.HDF_File, key:str):
+        """Writes the PSMs to an HDF file in the same format as a DataFrame.
+
+        Args:
+            ms_file (alphapept.io.HDF_File): HDF file to write to.
+            key (str): Name of the DataFrame in the HDF file.
+        """
+        ms_file.write(key, overwrite=True)
+        ms_file.write(True, group_name=key, attr_name="is_pd_dataframe", overwrite=True)
+        for name, column in self.columns.items():
+            # Strings are stored as objects, as for a DataFrame
+            if column.dtype.kind in 'US':
+                column = column.astype(object)
+            ms_file.write(column, group_name=key, dataset_name=name, overwrite=True)
+
+
 # Cell
 from numba.typed import List
 @njit
@@ -506,8 +1621,131 @@ from alphapept import constants
 LOSS_DICT = constants.loss_dict
 LOSSES = np.array(list(LOSS_DICT.values()))
 
+# Columns of the PSM values that are calculated by score_hits
+SCORE_FIELDS = ['mass_db','prec_offset', 'prec_offset_ppm', 'prec_offset_raw','prec_offset_raw_ppm','delta_m','delta_m_ppm','fragments_int_sum','fragments_matched_int_sum','fragments_matched_int_ratio','fragments_int_ratio'] + [f'hits_{a}{_}' for _ in LOSS_DICT for a in ['b','y']]
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def count_hits(psm_idx:int, psms_query_idx:np.ndarray, psms_db_idx:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, mtol:float, ppm:bool, losses:np.ndarray, n_hits:np.ndarray):
+    """Counts the matched fragment_ions of a PSM and writes them to n_hits.
+
+    Args:
+        psm_idx (int): Integer to the PSM that should be counted.
+        psms_query_idx (np.ndarray): Array with the query indices of the PSMs.
+        psms_db_idx (np.ndarray): Array with the database indices of the PSMs.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        db_indices (np.ndarray): Array with indices to the database array.
+        db_frags (np.ndarray): Array with fragment masses.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (np.ndarray): Array with losses.
+        n_hits (np.ndarray): Reporting array that stores the number of matched fragment_ions per PSM.
+    """
+    query_idx = psms_query_idx[psm_idx]
+    db_idx = psms_db_idx[psm_idx]
+    query_frag = query_frags[query_indices[query_idx]:query_indices[query_idx + 1]]
+    db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
+
+    count = 0
+    for off in losses:
+        hits = compare_frags(query_frag, db_frag-off, mtol, ppm)
+        for hit in hits:
+            if hit > 0:
+                count += 1
+
+    n_hits[psm_idx] = count
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def score_hits(psm_idx:int, psms_query_idx:np.ndarray, psms_db_idx:np.ndarray, query_masses:np.ndarray, query_masses_raw:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_masses:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, db_ints:np.ndarray, use_db_ints:bool, frag_types:np.ndarray, mtol:float, ppm:bool, losses:np.ndarray, fragment_ion_idx:np.ndarray, fragment_ions:np.ndarray, psm_values:np.ndarray):
+    """Matches the fragment_ions of a PSM and writes them to the preallocated fragment_ions array starting at fragment_ion_idx.
+    The PSM values are written to psm_values with the column order of SCORE_FIELDS.
+
+    Args:
+        psm_idx (int): Integer to the PSM that should be scored.
+        psms_query_idx (np.ndarray): Array with the query indices of the PSMs.
+        psms_db_idx (np.ndarray): Array with the database indices of the PSMs.
+        query_masses (np.ndarray): Array with query masses.
+        query_masses_raw (np.ndarray): Array with raw query masses.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_masses (np.ndarray): Array with database masses.
+        db_indices (np.ndarray): Array with indices to the database array.
+        db_frags (np.ndarray): Array with fragment masses.
+        db_ints (np.ndarray): Array with database intensities, aligned with db_frags.
+        use_db_ints (bool): Flag to use db_ints instead of unit intensities.
+        frag_types (np.ndarray): Array with fragment types.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (np.ndarray): Array with losses.
+        fragment_ion_idx (np.ndarray): Array with the start of the fragment_ions of each PSM.
+        fragment_ions (np.ndarray): Reporting array that stores the ion information.
+        psm_values (np.ndarray): Reporting array that stores the PSM values.
+    """
+    query_idx = psms_query_idx[psm_idx]
+    db_idx = psms_db_idx[psm_idx]
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+    db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
+    frag_type = frag_types[db_indices[db_idx]:db_indices[db_idx+1]]
+
+    if use_db_ints:
+        db_int = db_ints[db_indices[db_idx]:db_indices[db_idx+1]]
+    else:
+        db_int = np.ones(len(db_frag))
+
+    ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, losses)
+    n_ions = len(ions)
+
+    start = fragment_ion_idx[psm_idx]
+    for i in range(n_ions):
+        for j in range(8):
+            fragment_ions[start + i, j] = ions[i, j]
+        fragment_ions[start + i, 8] = psm_idx #Save psms index
+
+    query_mass = query_masses[query_idx]
+    query_mass_raw = query_masses_raw[query_idx]
+    db_mass = db_masses[db_idx]
+
+    # Offsets are rounded to float32 before deriving the ppm values, as they are stored as float32
+    prec_offset = np.float32(query_mass - db_mass)
+    prec_offset_raw = np.float32(query_mass_raw - db_mass)
+
+    delta_m = np.nan
+    fragments_int_ratio = np.nan
+    if n_ions > 0:
+        delta_m = np.float32(np.mean(ions[:,4]-ions[:,5]))
+        fragments_int_ratio = np.mean(ions[:,2]/ions[:,3]) #3 is db_int, 2 is query_int
+
+    fragments_int_sum = np.floor(np.sum(query_int))
+    fragments_matched_int_sum = np.floor(np.sum(ions[:,2]))
+
+    psm_values[psm_idx, 0] = db_mass
+    psm_values[psm_idx, 1] = prec_offset
+    psm_values[psm_idx, 2] = 2 * prec_offset / (query_mass + db_mass) * 1e6
+    psm_values[psm_idx, 3] = prec_offset_raw
+    psm_values[psm_idx, 4] = 2 * prec_offset_raw / (query_mass_raw + db_mass) * 1e6
+    psm_values[psm_idx, 5] = delta_m
+    psm_values[psm_idx, 6] = np.nan
+    if n_ions > 0:
+        psm_values[psm_idx, 6] = np.mean(2 * delta_m / (ions[:,4] + ions[:,5]) * 1e6)
+    psm_values[psm_idx, 7] = fragments_int_sum
+    psm_values[psm_idx, 8] = fragments_matched_int_sum
+    psm_values[psm_idx, 9] = fragments_matched_int_sum / fragments_int_sum
+    psm_values[psm_idx, 10] = fragments_int_ratio
+
+    for i in range(n_ions):
+        column = 11 + 2 * int(ions[i, 1])
+        if ions[i, 0] > 0:
+            psm_values[psm_idx, column] += 1
+        elif ions[i, 0] < 0:
+            psm_values[psm_idx, column + 1] += 1
+
+
 #This function is a wrapper and ist tested by the quick_test
-@njit
 def score(
     psms: np.recarray,
     query_masses: np.ndarray,
@@ -526,6 +1764,7 @@ def score(
     parallel: bool = False
 ) -> (np.ndarray, np.ndarray):
     """Function to extract score columns when giving a recordarray with PSMs.
+    Scoring is done in two passes: the matched fragment_ions are counted per PSM first, so that all ions can be written to a preallocated array in parallel.
 
     Args:
         psms (np.recarray): Recordarray containing PSMs.
@@ -541,74 +1780,41 @@ def score(
         db_indices (np.ndarray): Array with indices to the database array.
         ppm (bool): Flag to use ppm instead of Dalton.
         psms_dtype (list): List describing the dtype of the PSMs record array.
-        db_ints (np.ndarray, optional): Array with database intensities. Defaults to None.
+        db_ints (np.ndarray, optional): Array with database intensities, aligned with db_frags. Defaults to None.
         parallel (bool, optional): Flag to use parallel processing. Defaults to False.
 
     Returns:
         np.recarray: Recordarray containing PSMs with additional columns.
         np.ndarray: NumPy array containing ion information.
     """
+    n_psms = len(psms)
+    psms_query_idx = np.ascontiguousarray(psms["query_idx"]).astype(np.int64)
+    psms_db_idx = np.ascontiguousarray(psms["db_idx"]).astype(np.int64)
 
-    psms_ = np.zeros(len(psms), dtype=psms_dtype)
-
-    ions_ = List()
-
-    ion_count = 0
-
-    for i in range(len(psms)):
-        query_idx = psms[i]["query_idx"]
-        db_idx = psms[i]["db_idx"]
-        query_idx_start = query_indices[query_idx]
-        query_idx_end = query_indices[query_idx + 1]
-        query_frag = query_frags[query_idx_start:query_idx_end]
-        query_int = query_ints[query_idx_start:query_idx_end]
-        db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
-        frag_type = frag_types[db_indices[db_idx]:db_indices[db_idx+1]]
+    n_hits = np.zeros(n_psms, dtype=np.int64)
+    count_hits(range(n_psms), psms_query_idx, psms_db_idx, query_indices, query_frags, db_indices, db_frags, mtol, ppm, LOSSES, n_hits)
 
-        if db_ints is None:
-            db_int = np.ones(len(db_frag))
-        else:
-            db_int = db_ints[i]
-
-        fragment_ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, LOSSES)
-
-        psms_['mass_db'][i] = db_masses[db_idx]
-
-        psms_['prec_offset'][i] = query_masses[query_idx] - db_masses[db_idx]
-        psms_['prec_offset_ppm'][i] = 2 * psms_['prec_offset'][i] / (query_masses[query_idx]  + db_masses[db_idx] ) * 1e6
-
-        psms_['prec_offset_raw'][i] = query_masses_raw[query_idx] - db_masses[db_idx]
-        psms_['prec_offset_raw_ppm'][i] = 2 * psms_['prec_offset_raw'][i] / (query_masses_raw[query_idx]  + db_masses[db_idx] ) * 1e6
-
-        psms_['delta_m'][i] = np.mean(fragment_ions[:,4]-fragment_ions[:,5])
-        psms_['delta_m_ppm'][i] = np.mean(2 * psms_['delta_m'][i] / (fragment_ions[:,4]  + fragment_ions[:,5] ) * 1e6)
-
-        psms_['fragments_int_sum'][i] = np.sum(query_int)
-        psms_['fragments_matched_int_sum'][i] = np.sum(fragment_ions[:,2])
-        psms_['fragments_matched_int_ratio'][i] = psms_['fragments_matched_int_sum'][i] / psms_['fragments_int_sum'][i]
-        psms_['fragments_int_ratio'][i] = np.mean(fragment_ions[:,2]/fragment_ions[:,3]) #3 is db_int, 2 is query_int
-
-        psms_['hits_b'][i] = np.sum(fragment_ions[fragment_ions[:,1]==0][:,0]>0)
-        psms_['hits_y'][i] = np.sum(fragment_ions[fragment_ions[:,1]==0][:,0]<0)
+    fragment_ion_idx = np.zeros(n_psms + 1, dtype=np.int64)
+    np.cumsum(n_hits, out=fragment_ion_idx[1:])
 
-        psms_['hits_b-H2O'][i] = np.sum(fragment_ions[fragment_ions[:,1]==1][:,0]>0)
-        psms_['hits_y-H2O'][i] = np.sum(fragment_ions[fragment_ions[:,1]==1][:,0]<0)
+    fragment_ions = np.zeros((fragment_ion_idx[-1], 9))
+    psm_values = np.zeros((n_psms, len(SCORE_FIELDS)))
 
-        psms_['hits_b-NH3'][i] = np.sum(fragment_ions[fragment_ions[:,1]==2][:,0]>0)
-        psms_['hits_y-NH3'][i] = np.sum(fragment_ions[fragment_ions[:,1]==2][:,0]<0)
+    use_db_ints = db_ints is not None
+    if not use_db_ints:
+        db_ints = np.zeros(0)
 
-        n_fragments_matched = len(fragment_ions)
+    score_hits(range(n_psms), psms_query_idx, psms_db_idx, query_masses, query_masses_raw, query_indices, query_frags, query_ints, db_masses, db_indices, db_frags, db_ints, use_db_ints, frag_types, mtol, ppm, LOSSES, fragment_ion_idx, fragment_ions, psm_values)
 
-        psms_['n_fragments_matched'][i] = n_fragments_matched
-        psms_['fragment_ion_idx'][i] = ion_count
+    psms_ = np.zeros(n_psms, dtype=psms_dtype)
+    for i, _ in enumerate(SCORE_FIELDS):
+        psms_[_] = psm_values[:, i]
 
-        ion_count += n_fragments_matched
+    psms_['n_fragments_matched'] = n_hits
+    psms_['fragment_ion_idx'] = fragment_ion_idx[:-1]
 
-        fragment_ions[:,8] = i #Save psms index
+    return psms_, fragment_ions
 
-        ions_.append(fragment_ions)
-
-    return psms_, ions_
 
 # Cell
 
@@ -659,14 +1865,11 @@ def get_score_columns(
         frag_tol_calibrated (float, optional): Fragment tolerance if calibration exists. Defaults to None.
 
     Returns:
-        np.recarray: Recordarray containing PSMs with additional columns.
+        PSMColumns: Column-wise PSMs with additional columns.
         np.ndarray: NumPy array containing ion information.
     """
     logging.info('Extracting columns for scoring.')
-    query_indices = query_data["indices_ms2"]
     query_charges = query_data['charge2']
-    query_frags = query_data['mass_list_ms2']
-    query_ints = query_data['int_list_ms2']
     query_scans = query_data['scan_list_ms2']
 
     if frag_tol_calibrated:
@@ -678,16 +1881,21 @@ def get_score_columns(
     else:
         bruker = False
 
+    db_offset = 0
+
     if isinstance(db_data, str):
-        db_masses = read_database(db_data, array_name = 'precursors')
-        db_frags = read_database(db_data, array_name = 'fragmasses')
-        db_indices = read_database(db_data, array_name = 'indices')
-        frag_types = read_database(db_data, array_name = 'fragtypes')
+        # Only read the database entries that are referenced by the PSMs
+        if len(psms) > 0:
+            db_offset = psms['db_idx'].min()
+            db_end = psms['db_idx'].max() + 1
+        else:
+            db_end = db_offset
+        db_slice = read_database_slice(db_data, db_offset, db_end, array_names = ['precursors', 'seqs', 'fragmasses', 'fragtypes'])
 
-        try:
-            db_ints = read_database(db_data, array_name = 'db_ints')
-        except KeyError:
-            db_ints = None
+        db_masses = db_slice['precursors']
+        db_frags = db_slice['fragmasses']
+        db_indices = db_slice['indices']
+        frag_types = db_slice['fragtypes']
 
     else:
         db_masses = db_data['precursors']
@@ -695,11 +1903,6 @@ def get_score_columns(
         db_indices = db_data['indices']
         frag_types = db_data['fragtypes']
 
-        if 'db_ints' in db_data.keys():
-            db_ints = db_data['db_ints']
-        else:
-            db_ints = None
-
     if features is not None:
         if prec_tol_calibrated:
             query_masses = features['corrected_mass'].values
@@ -716,39 +1919,27 @@ def get_score_columns(
         if bruker:
             query_prec_id = query_prec_id[features['query_idx'].values]
 
-        query_selection = features['query_idx'].values
-        indices = np.zeros(len(query_selection) + 1, np.int64)
-        indices[1:] = np.diff(query_indices)[query_selection]
-        indices = np.cumsum(indices)
-        query_frags = np.concatenate(
-            [
-                query_frags[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_ints = np.concatenate(
-            [
-                query_ints[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_indices = indices
+        query_indices, query_frags, query_ints = get_feature_fragments(query_data, features)
     else:
         #TODO: This code is outdated, callin with features = None will crash.
         query_masses = query_data['prec_mass_list2']
         query_masses_raw = query_data['prec_mass_list2']
         query_mz = query_data['mono_mzs2']
         query_rt = query_data['rt_list_ms2']
+        query_indices = query_data["indices_ms2"]
+        query_frags = query_data['mass_list_ms2']
+        query_ints = query_data['int_list_ms2']
 
     float_fields = ['mass_db','prec_offset', 'prec_offset_ppm', 'prec_offset_raw','prec_offset_raw_ppm','delta_m','delta_m_ppm','fragments_matched_int_ratio','fragments_int_ratio']
     int_fields = ['fragments_int_sum','fragments_matched_int_sum','n_fragments_matched','fragment_ion_idx'] + [f'hits_{a}{_}' for _ in LOSS_DICT for a in ['b','y']]
 
     psms_dtype = np.dtype([(_,np.float32) for _ in float_fields] + [(_,np.int64) for _ in int_fields])
 
-    psms_, fragment_ions,  = score(
-        psms,
+    psms_db = psms.copy()
+    psms_db['db_idx'] -= db_offset
+
+    psms_, ions_ = score(
+        psms_db,
         query_masses,
         query_masses_raw,
         query_frags,
@@ -762,50 +1953,52 @@ def get_score_columns(
         ppm,
         psms_dtype)
 
-    ions_ = np.vstack(fragment_ions)
+    psms = PSMColumns(psms)
 
     for _ in psms_.dtype.names:
-        psms = add_column(psms, psms_[_], _)
+        psms[_] = psms_[_]
 
     rts = np.array(query_rt)[psms["query_idx"]]
-    psms = add_column(psms, rts, 'rt')
+    psms['rt'] = rts
 
     if isinstance(db_data, str):
-        db_seqs = read_database(db_data, array_name = 'seqs').astype(str)
+        db_seqs = db_slice['seqs']
     else:
         db_seqs = db_data['seqs']
 
-    seqs = get_sequences(psms, db_seqs)
+    seqs = get_sequences(psms_db, db_seqs)
+
+    del psms_db
 
     del db_seqs
 
-    psms = add_column(psms, seqs, "sequence")
+    psms['sequence'] = seqs
 
     mass = np.array(query_masses)[psms["query_idx"]]
     mz = np.array(query_mz)[psms["query_idx"]]
     charge = np.array(query_charges)[psms["query_idx"]]
 
-    psms = add_column(psms, mass, "mass")
-    psms = add_column(psms, mz, "mz")
-    psms = add_column(psms, charge, "charge")
+    psms['mass'] = mass
+    psms['mz'] = mz
+    psms['charge'] = charge
 
-    psms = add_column(psms, np.char.add(np.char.add(psms['sequence'],"_"), psms['charge'].astype(int).astype(str)), 'precursor')
+    psms['precursor'] = np.char.add(np.char.add(psms['sequence'],"_"), psms['charge'].astype(int).astype(str))
 
     if features is not None:
-        psms = add_column(psms, features.loc[psms['query_idx']]['feature_idx'].values, 'feature_idx')
-        psms = add_column(psms, features.loc[psms['query_idx']]['query_idx'].values, 'raw_idx')
+        psms['feature_idx'] = features.loc[psms['query_idx']]['feature_idx'].values
+        psms['raw_idx'] = features.loc[psms['query_idx']]['query_idx'].values
 
         for key in ['ms1_int_sum','ms1_int_apex','rt_start','rt_apex','rt_end','fwhm','dist','mobility']:
             if key in features.keys():
-                psms = add_column(psms, features.loc[psms['query_idx']][key].values, key)
+                psms[key] = features.loc[psms['query_idx']][key].values
 
     scan_no = np.array(query_scans)[psms["query_idx"]]
     if bruker:
-        psms = add_column(psms, scan_no, "parent")
-        psms = add_column(psms, np.array(query_prec_id)[psms["query_idx"]], 'precursor_idx')
-        psms = add_column(psms, psms['feature_idx']+1, 'feature_id') #Bruker
+        psms['parent'] = scan_no
+        psms['precursor_idx'] = np.array(query_prec_id)[psms["query_idx"]]
+        psms['feature_id'] = psms['feature_idx']+1 #Bruker
     else:
-        psms = add_column(psms, scan_no, "scan_no")
+        psms['scan_no'] = scan_no
 
     logging.info(f'Extracted columns from {len(psms):,} spectra.')
 
@@ -861,14 +2054,130 @@ def plot_psms(index, ms_file):
     for i in range(len(masses)):
         plt.text(masses[i], (1+0.1*fragment_ion_type[i])*max(query_int), ion[i])
 
-    figure_title = f"{spectrum['precursor']} - b-hits {spectrum['hits_b']}, y-hits {spectrum['hits_y']}, matched int {spectrum['fragments_matched_int_ratio']*100:.2f} %"
+    figure_title = f"{spectrum['precursor']} - b-hits {spectrum['hits_b']}, y-hits {spectrum['hits_y']}, matched int {spectrum['fragments_matched_int_ratio']*100:.2f} %"
+
+    plt.xlabel("m/z")
+    plt.ylabel('Intensity')
+    plt.ylim([0, (1+0.1*max(fragment_ion_type)+0.1)*max(query_int)])
+    plt.legend()
+    plt.title(figure_title)
+    plt.show()
+
+# Cell
+import os
+import hashlib
+import json
+import alphapept.io
+import alphapept.utils
+
+class SearchResultCache(alphapept.utils.DiskCache):
+    """Persistent LRU cache on disk for the search results of ms_data files.
+
+    Args:
+        path (str): Directory of the cache.
+        max_size (float): Size budget of the cache in Mb. Defaults to 10240.
+    """
+    # Search settings that do not change the results of search_db
+    IGNORED_SETTINGS = ['parallel', 'calibrate', 'peptide_fdr', 'protein_fdr', 'query_cache_size', 'recalibration_min', 'database_memmap', 'cluster_spectra', 'cluster_min_similarity', 'result_cache_path', 'result_cache_size', 'search_memory_limit']
+    QUERY_FIELDS = ['indices_ms2', 'mass_list_ms2', 'int_list_ms2', 'prec_mass_list2', 'mono_mzs2', 'charge2']
+    # Number of queries whose fragments are hashed at once if they are read from the ms_data file
+    QUERY_BLOCK = 100000
+
+    def __init__(self, path:str, max_size:float=10240):
+        super().__init__(path, max_size)
+
+    def get_key(self, query_data:dict, features:pd.DataFrame, database_path:str, search_settings:dict, first_search:bool = True, ms_file_:alphapept.io.MS_Data_File = None, deisotoped:bool = False)->str:
+        """Key of a search from the content of the query data, features and database and from the search settings.
+
+        Args:
+            query_data (dict): Data structure containing the query data.
+            features (pd.DataFrame): Pandas dataframe containing feature data.
+            database_path (str): Path to the database.
+            search_settings (dict): The search settings.
+            first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+            ms_file_ (alphapept.io.MS_Data_File, optional): The ms_data file to read the calibrated fragments from if they are not in the query data. Defaults to None.
+            deisotoped (bool, optional): Flag to read the deisotoped fragments from the ms_data file. Defaults to False.
+
+        Returns:
+            str: The key of the search.
+        """
+        hash_ = hashlib.sha256()
+
+        fragment_hashes = {}
+        if (ms_file_ is not None) and ('mass_list_ms2' not in query_data):
+            fragment_hashes = {_: hashlib.sha256() for _ in ['mass_list_ms2', 'int_list_ms2']}
+            n_queries = len(query_data['indices_ms2']) - 1
+            for start in range(0, n_queries, self.QUERY_BLOCK):
+                _, frags, ints = ms_file_.read_DDA_query_fragments(np.arange(start, min(start + self.QUERY_BLOCK, n_queries)), calibrated_fragments=True, deisotoped=deisotoped)
+                fragment_hashes['mass_list_ms2'].update(frags.tobytes())
+                fragment_hashes['int_list_ms2'].update(ints.tobytes())
+
+        for field in self.QUERY_FIELDS:
+            if field in query_data:
+                hash_.update(field.encode())
+                hash_.update(np.ascontiguousarray(query_data[field]).tobytes())
+            elif field in fragment_hashes:
+                hash_.update(field.encode())
+                hash_.update(fragment_hashes[field].digest())
+
+        hash_.update(pd.util.hash_pandas_object(features).values.tobytes())
+        hash_.update(self.file_hash(database_path).encode())
+
+        settings = {_: search_settings[_] for _ in search_settings if _ not in self.IGNORED_SETTINGS}
+        settings['first_search'] = first_search
+        hash_.update(json.dumps(settings, sort_keys=True, default=str).encode())
+
+        return hash_.hexdigest()
+
+    def load(self, key:str, ms_file:str, fields:list)->bool:
+        """Copy the cached results of a search to an ms_data file.
+
+        Args:
+            key (str): The key of the search.
+            ms_file (str): Path to the ms_data file.
+            fields (list): Names of the datasets to copy.
+
+        Returns:
+            bool: True if the results were found in the cache.
+        """
+        try:
+            cache_file = alphapept.io.HDF_File(self.entry_path(key))
+            results = {_: cache_file.read(dataset_name=_) for _ in fields}
+            attrs = {_: cache_file.read(attr_name="", group_name=_) for _ in fields}
+        except (OSError, KeyError):
+            return False
+
+        ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
+        for field, df in results.items():
+            ms_file_.write(df, dataset_name=field)
+            for stat in SEARCH_STATS_FIELDS:
+                if stat in attrs[field]:
+                    ms_file_.write(attrs[field][stat], group_name=field, attr_name=stat)
+
+        self.touch(key)
+
+        return True
+
+    def save(self, key:str, ms_file:str, fields:list):
+        """Store the results of a search from an ms_data file in the cache.
+
+        Args:
+            key (str): The key of the search.
+            ms_file (str): Path to the ms_data file.
+            fields (list): Names of the datasets to store.
+        """
+        ms_file_ = alphapept.io.MS_Data_File(ms_file)
+
+        def write_entry(entry):
+            cache_file = alphapept.io.HDF_File(entry, is_new_file=True)
+            for field in fields:
+                cache_file.write(ms_file_.read(dataset_name=field), dataset_name=field)
+                attrs = ms_file_.read(attr_name="", group_name=field)
+                for stat in SEARCH_STATS_FIELDS:
+                    if stat in attrs:
+                        cache_file.write(attrs[stat], group_name=field, attr_name=stat)
 
-    plt.xlabel("m/z")
-    plt.ylabel('Intensity')
-    plt.ylim([0, (1+0.1*max(fragment_ion_type)+0.1)*max(query_int)])
-    plt.legend()
-    plt.title(figure_title)
-    plt.show()
+        self.add(key, write_entry)
 
 # Cell
 import os
@@ -878,12 +2187,14 @@ import alphapept.io
 import alphapept.fasta
 from typing import Callable
 
+ION_COLUMNS = ['ion_index','fragment_ion_type','fragment_ion_int','db_int','fragment_ion_mass','db_mass','query_idx','db_idx','psms_idx']
+
 #This function is a wrapper and ist tested by the quick_test
-def store_hdf(df: pd.DataFrame, path: str, key:str, replace:bool=False, swmr:bool = False):
+def store_hdf(df: Union[pd.DataFrame, PSMColumns], path: str, key:str, replace:bool=False, swmr:bool = False):
     """Wrapper function to store a DataFrame in an hdf.
 
     Args:
-        df (pd.DataFrame): DataFrame to be stored.
+        df (Union[pd.DataFrame, PSMColumns]): DataFrame or PSMColumns to be stored.
         path (str): Target path of the hdf file.
         key (str): Name of the field to be saved.
         replace (bool, optional): Flag whether the field should be replaced.. Defaults to False.
@@ -891,6 +2202,12 @@ def store_hdf(df: pd.DataFrame, path: str, key:str, replace:bool=False, swmr:boo
     """
     ms_file = alphapept.io.MS_Data_File(path.file_name, is_overwritable=True)
 
+    if isinstance(df, PSMColumns):
+        if replace:
+            df.to_hdf(ms_file, key)
+            return
+        df = df.to_df()
+
     if replace:
         ms_file.write(df, dataset_name=key, swmr = swmr)
     else:
@@ -905,6 +2222,139 @@ def store_hdf(df: pd.DataFrame, path: str, key:str, replace:bool=False, swmr:boo
             except KeyError: # File is created new
                 ms_file.write(df, dataset_name=key, swmr = swmr)
 
+def set_calibrated_tolerances(ms_file_:alphapept.io.MS_Data_File, settings:dict)->bool:
+    """Set the calibrated precursor and fragment tolerances of a file in the search settings.
+
+    Args:
+        ms_file_ (alphapept.io.MS_Data_File): The ms_data file.
+        settings (dict): The experiment settings, modified in place.
+
+    Returns:
+        bool: True if the second search of this file should be skipped.
+    """
+    skip = False
+
+    try:
+        calibration = float(ms_file_.read(group_name = 'features', dataset_name='corrected_mass', attr_name='estimated_max_precursor_ppm'))
+        if calibration == 0:
+            logging.info('Calibration is 0, skipping second database search.')
+            skip = True
+        else:
+            settings['search']['prec_tol_calibrated'] = calibration*settings['search']['calibration_std_prec']
+            calib = settings['search']['prec_tol_calibrated']
+            logging.info(f"Found calibrated prec_tol with value {calib:.2f}")
+    except KeyError as e:
+        logging.info(f'{e}')
+
+    try:
+        fragment_std = float(ms_file_.read(dataset_name="estimated_max_fragment_ppm")[0])
+        skip = False
+        settings['search']['frag_tol_calibrated'] = fragment_std*settings['search']['calibration_std_frag']
+        calib = settings['search']['frag_tol_calibrated']
+        logging.info(f"Found calibrated frag_tol with value {calib:.2f}")
+    except KeyError as e:
+        logging.info(f'{e}')
+
+    return skip
+
+def get_db_data(settings:dict)->Union[dict, str]:
+    """Get the database for the search, either as memory mapped arrays or as path.
+
+    Args:
+        settings (dict): The experiment settings.
+
+    Returns:
+        Union[dict, str]: The memory mapped database or the path to the database.
+    """
+    db_data_path = settings['experiment']['database_path']
+
+    if settings['search'].get('database_memmap', False):
+        try:
+            db_data = alphapept.fasta.read_database_memmap(db_data_path)
+        except FileNotFoundError:
+            logging.info('No memory mapped database found. Reading from database file.')
+            db_data = db_data_path
+    else:
+        db_data = db_data_path
+
+    return db_data
+
+def save_psms(psms:PSMColumns, fragment_ions:np.ndarray, ms_file_:alphapept.io.MS_Data_File, first_search:bool = True):
+    """Save the PSMs and fragment ions of a search to the ms_data file.
+
+    Args:
+        psms (PSMColumns): The PSMs with score columns.
+        fragment_ions (np.ndarray): The matched fragment ions.
+        ms_file_ (alphapept.io.MS_Data_File): The ms_data file.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+    """
+    if first_search:
+        logging.info('Saving first_search results to {}'.format(ms_file_.file_name))
+        save_field = 'first_search'
+    else:
+        logging.info('Saving second_search results to {}'.format(ms_file_.file_name))
+        save_field = 'second_search'
+
+    store_hdf(psms, ms_file_, save_field, replace=True)
+    store_hdf(pd.DataFrame(fragment_ions, columns = ION_COLUMNS), ms_file_, 'fragment_ions', replace=True)
+
+def save_cluster_candidates(candidates:pd.DataFrame, ms_file:str, first_search:bool = True, cache_key:str = ''):
+    """Save the candidates of the clustered search to the ms_data file, to be rescored by `search_db`.
+
+    Args:
+        candidates (pd.DataFrame): The candidates with query_idx and db_idx.
+        ms_file (str): Path to the ms_data file.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+        cache_key (str, optional): Key of the search in the result cache. Defaults to ''.
+    """
+    ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
+    ms_file_.write(candidates, dataset_name='cluster_candidates')
+    ms_file_.write(first_search, dataset_name='cluster_candidates', attr_name='first_search')
+    ms_file_.write(cache_key, dataset_name='cluster_candidates', attr_name='cache_key')
+
+def read_cluster_candidates(ms_file_:alphapept.io.MS_Data_File, first_search:bool = True)->(pd.DataFrame, str):
+    """Read the candidates of the clustered search from the ms_data file.
+
+    Args:
+        ms_file_ (alphapept.io.MS_Data_File): The ms_data file.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+
+    Returns:
+        pd.DataFrame: The candidates with query_idx and db_idx. None if there are no candidates for this search.
+        str: Key of the search in the result cache. None if not set.
+    """
+    # The candidates of a previous search are removed by leaving an empty group, see read_cluster_run
+    if ('cluster_candidates' not in ms_file_.read()) or (len(ms_file_.read(group_name='cluster_candidates')) == 0):
+        logging.info('No cluster candidates found. Performing a full search.')
+        return None, None
+
+    try:
+        if bool(ms_file_.read(dataset_name='cluster_candidates', attr_name='first_search')) != first_search:
+            raise KeyError('Cluster candidates are from another search.')
+        candidates = ms_file_.read(dataset_name='cluster_candidates')
+        cache_key = ms_file_.read(dataset_name='cluster_candidates', attr_name='cache_key')
+    except KeyError as e:
+        logging.info(f'No cluster candidates found. Performing a full search. {e}')
+        return None, None
+
+    return candidates, (cache_key or None)
+
+def save_search_stats(search_stats:dict, ms_file:str, first_search:bool = True):
+    """Save the statistics of a search as attributes of the first_search or second_search dataset.
+
+    Args:
+        search_stats (dict): Statistics of the search, see `get_search_stats`.
+        ms_file (str): Path to the ms_data file.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+    """
+    save_field = 'first_search' if first_search else 'second_search'
+    ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
+
+    for key, value in search_stats.items():
+        ms_file_.write(value, group_name=save_field, attr_name=key)
+
+    logging.info(f"Searched {search_stats['n_queries']:,} queries with {search_stats['n_candidates']:,} candidates in {search_stats['search_time']:.2f} s ({search_stats['compile_time']:.2f} s compilation), {search_stats['psms_per_second']:,.0f} psms/s.")
+
 #This function is a wrapper and ist tested by the quick_test
 def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, first_search:bool = True) -> Union[bool, str]:
     """Wrapper function to perform database search to be used by a parallel pool.
@@ -933,52 +2383,76 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
         )
 
         if not first_search:
-            try:
-                calibration = float(ms_file_.read(group_name = 'features', dataset_name='corrected_mass', attr_name='estimated_max_precursor_ppm'))
-                if calibration == 0:
-                    logging.info('Calibration is 0, skipping second database search.')
-                    skip = True
-                else:
-                    settings['search']['prec_tol_calibrated'] = calibration*settings['search']['calibration_std_prec']
-                    calib = settings['search']['prec_tol_calibrated']
-                    logging.info(f"Found calibrated prec_tol with value {calib:.2f}")
-            except KeyError as e:
-                logging.info(f'{e}')
-
-            try:
-                fragment_std = float(ms_file_.read(dataset_name="estimated_max_fragment_ppm")[0])
-                skip = False
-                settings['search']['frag_tol_calibrated'] = fragment_std*settings['search']['calibration_std_frag']
-                calib = settings['search']['frag_tol_calibrated']
-                logging.info(f"Found calibrated frag_tol with value {calib:.2f}")
-            except KeyError as e:
-                logging.info(f'{e}')
+            skip = set_calibrated_tolerances(ms_file_, settings)
 
         if not skip:
-            db_data_path = settings['experiment']['database_path']
+            memory_limit = settings['search'].get('search_memory_limit', 0)
+            deisotoped = settings.get('raw', {}).get('ms2_deisotope', False)
 
     #         TODO calibrated_fragments should be included in settings
+            # With a memory limit, the fragments are read per chunk by search_db_chunked
             query_data = ms_file_.read_DDA_query_data(
                 calibrated_fragments=True,
-                database_file_name=settings['experiment']['database_path']
+                database_file_name=settings['experiment']['database_path'],
+                deisotoped=deisotoped,
+                fragments=memory_limit <= 0
             )
 
             features = ms_file_.read(dataset_name="features")
 
-            psms, num_specs_compared = get_psms(query_data, db_data_path, features, **settings["search"])
-            if len(psms) > 0:
-                psms, fragment_ions = get_score_columns(psms, query_data, db_data_path, features, **settings["search"])
+            cluster_candidates, cache_key = None, None
+            if settings['search'].get('cluster_spectra', False):
+                cluster_candidates, cache_key = read_cluster_candidates(ms_file_, first_search)
+
+            result_cache = None
+            if settings['search'].get('result_cache_path'):
+                result_cache = SearchResultCache(settings['search']['result_cache_path'], settings['search'].get('result_cache_size', 10240))
+                # The key of a clustered search also depends on the other files of the cluster group
+                if cache_key is None:
+                    cache_key = result_cache.get_key(query_data, features, settings['experiment']['database_path'], settings['search'], first_search, ms_file_, deisotoped)
+                cache_fields = ['first_search' if first_search else 'second_search', 'fragment_ions']
+
+                if result_cache.load(cache_key, ms_file, cache_fields):
+                    logging.info(f'Found search results of file {file_name} in cache.')
+                    return True
+
+            # The database is only loaded if the results are not cached
+            db_data = get_db_data(settings)
+
+            first_psms = None
+            if (cluster_candidates is None) and (not first_search) and settings['search'].get('delta_second_search', False) and ('corrected_mass' in features):
+                try:
+                    first_psms = ms_file_.read(dataset_name='first_search')
+                except KeyError:
+                    logging.info('No first search found. Performing a full second search.')
+
+            candidates, candidate_search = None, None
+            if cluster_candidates is not None:
+                candidates, candidate_search = cluster_candidates, get_candidate_psms
+            elif first_psms is not None:
+                candidates, candidate_search = first_psms, get_delta_psms
+
+            if memory_limit > 0:
+                n_psms, search_stats = search_db_chunked(ms_file, query_data, db_data, features, memory_limit, first_search, candidates, candidate_search, deisotoped, **settings["search"])
+            else:
+                # Prepare the reindexed fragments once for get_psms and get_score_columns
+                get_feature_fragments(query_data, features, cache=True)
 
-                if first_search:
-                    logging.info('Saving first_search results to {}'.format(ms_file))
-                    save_field = 'first_search'
+                if candidates is not None:
+                    psms, search_stats = candidate_search(query_data, db_data, features, candidates, **settings["search"])
                 else:
-                    logging.info('Saving second_search results to {}'.format(ms_file))
-                    save_field = 'second_search'
+                    psms, search_stats = get_psms(query_data, db_data, features, **settings["search"])
+
+                n_psms = len(psms)
+                if n_psms > 0:
+                    psms, fragment_ions = get_score_columns(psms, query_data, db_data, features, **settings["search"])
+                    save_psms(psms, fragment_ions, ms_file_, first_search)
+
+            if n_psms > 0:
+                save_search_stats(search_stats, ms_file, first_search)
 
-                store_hdf(pd.DataFrame(psms), ms_file_, save_field, replace=True)
-                ion_columns = ['ion_index','fragment_ion_type','fragment_ion_int','db_int','fragment_ion_mass','db_mass','query_idx','db_idx','psms_idx']
-                store_hdf(pd.DataFrame(fragment_ions, columns = ion_columns), ms_file_, 'fragment_ions', replace=True)
+                if result_cache is not None:
+                    result_cache.save(cache_key, ms_file, cache_fields)
             else:
                 logging.info('No psms found.')
 
@@ -988,11 +2462,572 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
         logging.error(f'Search of file {file_name} failed. Exception {e}.')
         return f"{e}" #Can't return exception object, cast as string
 
+# Cell
+QUERY_FRAGMENT_BYTES = 64
+DB_FRAGMENT_BYTES = 16
+PSM_BYTES = 2048
+
+@njit
+def get_memory_chunks(query_bytes:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, db_entry_bytes:float, max_bytes:float)->np.ndarray:
+    """Split queries sorted by precursor mass into chunks with an estimated memory below a maximum.
+    The memory of a chunk is the memory of its queries and of the database entries within their precursor range.
+    Each chunk contains at least one query.
+
+    Args:
+        query_bytes (np.ndarray): Estimated memory per query in bytes.
+        idxs_lower (np.ndarray): Lower index of the database window of each query.
+        idxs_higher (np.ndarray): Higher index of the database window of each query.
+        db_entry_bytes (float): Estimated memory per database entry in bytes.
+        max_bytes (float): Maximum memory of a chunk in bytes.
+
+    Returns:
+        np.ndarray: Indices to the queries of each chunk (indptr).
+    """
+    n_queries = len(query_bytes)
+    chunk_bounds = np.zeros(n_queries + 1, np.int64)
+    n_chunks = 0
+
+    chunk_bytes = 0.0
+    lower = 0
+    higher = 0
+
+    for i in range(n_queries):
+        if i > chunk_bounds[n_chunks]:
+            lower_ = min(lower, idxs_lower[i])
+            higher_ = max(higher, idxs_higher[i])
+            if chunk_bytes + query_bytes[i] + (higher_ - lower_) * db_entry_bytes > max_bytes:
+                n_chunks += 1
+                chunk_bounds[n_chunks] = i
+            else:
+                chunk_bytes += query_bytes[i]
+                lower = lower_
+                higher = higher_
+                continue
+
+        chunk_bytes = query_bytes[i]
+        lower = idxs_lower[i]
+        higher = idxs_higher[i]
+
+    if n_queries > 0:
+        n_chunks += 1
+        chunk_bounds[n_chunks] = n_queries
+
+    return chunk_bounds[:n_chunks + 1]
+
+#This function is a wrapper and ist tested by the quick_test
+def search_db_chunked(ms_file:str, query_data:dict, db_data:Union[dict, str], features:pd.DataFrame, memory_limit:float, first_search:bool = True, candidates:pd.DataFrame = None, candidate_search:Callable = None, deisotoped:bool = False, **kwargs)->(int, dict):
+    """Search the queries of a file in chunks of similar precursor mass to stay within a memory limit.
+    The results of each chunk are appended to the first_search or second_search dataset and the fragment_ions of the ms_data file.
+    With candidates, the candidates of the queries of each chunk are searched with `candidate_search`, e.g. `get_candidate_psms` or `get_delta_psms`.
+    If the query data does not contain the fragments, the calibrated fragments of the queries of each chunk are read from the ms_data file.
+
+    Args:
+        ms_file (str): Path to the ms_data file.
+        query_data (dict): Data structure containing the query data, optionally without fragments, see `read_DDA_query_data`.
+        db_data (Union[dict, str]): Data structure containing the database data or path to database.
+        features (pd.DataFrame): Pandas dataframe containing feature data.
+        memory_limit (float): Memory budget of the search in GB.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+        candidates (pd.DataFrame, optional): Candidates of the queries, needs query_idx and db_idx. Defaults to None.
+        candidate_search (Callable, optional): Search function for the candidates with the arguments of `get_candidate_psms`. Defaults to None.
+        deisotoped (bool, optional): Flag to read the deisotoped fragments from the ms_data file. Defaults to False.
+        **kwargs: The search settings, passed to `get_psms` and `get_score_columns`.
+
+    Returns:
+        int: The number of PSMs.
+        dict: Statistics of the search, see `get_search_stats`.
+    """
+    save_field = 'first_search' if first_search else 'second_search'
+    ppm = kwargs['ppm']
+
+    # The precursor range of each query, adaptive tolerances are never wider than this
+    prec_tol = kwargs['prec_tol']
+    masses = features['mass_matched'].values
+    if kwargs.get('prec_tol_calibrated'):
+        prec_tol = kwargs['prec_tol_calibrated']
+        masses = features['corrected_mass'].values
+
+    if isinstance(db_data, str):
+        db_masses = read_database(db_data, array_name = 'precursors')
+        n_db_frags = alphapept.io.HDF_File(db_data).read(dataset_name='fragmasses', return_dataset_shape=True)[0]
+    else:
+        db_masses = db_data['precursors']
+        n_db_frags = len(db_data['fragmasses'])
+
+    idxs_lower, idxs_higher = get_idxs(db_masses, masses, prec_tol, ppm)
+    db_entry_bytes = n_db_frags / max(len(db_masses), 1) * DB_FRAGMENT_BYTES
+
+    query_lengths = np.diff(query_data['indices_ms2'])[features['query_idx'].values.astype(np.int64)]
+    query_bytes = query_lengths * QUERY_FRAGMENT_BYTES + TOP_N * PSM_BYTES
+
+    # The query data and features stay in memory during the search, fragments that are read per chunk are part of the chunks
+    base_bytes = sum(_.nbytes for _ in query_data.values() if isinstance(_, np.ndarray)) + features.memory_usage().sum()
+    max_bytes = memory_limit * 1024**3 - base_bytes
+    if max_bytes < 0.1 * memory_limit * 1024**3:
+        logging.warning(f'Query data of {base_bytes/1024**3:.2f} GB leaves little of the memory limit of {memory_limit:.2f} GB. Using chunks of {0.1 * memory_limit:.2f} GB.')
+        max_bytes = 0.1 * memory_limit * 1024**3
+
+    order = np.argsort(masses, kind='stable')
+    chunk_bounds = get_memory_chunks(query_bytes[order], idxs_lower[order], idxs_higher[order], db_entry_bytes, max_bytes)
+
+    logging.info(f'Searching {len(features):,} queries in {len(chunk_bounds) - 1:,} chunks with a memory limit of {memory_limit:.2f} GB.')
+
+    if candidates is not None:
+        # Group the candidates by the chunk of their query and refer to the position of the query in the chunk
+        query_chunks = np.zeros(len(features), np.int64)
+        query_chunks[order] = np.repeat(np.arange(len(chunk_bounds) - 1), np.diff(chunk_bounds))
+        query_pos = np.zeros(len(features), np.int64)
+        query_pos[order] = np.arange(len(order)) - chunk_bounds[query_chunks[order]]
+
+        cand_query_idx = candidates['query_idx'].values.astype(np.int64)
+        cand_order = np.argsort(query_chunks[cand_query_idx], kind='stable')
+        cand_bounds = np.searchsorted(query_chunks[cand_query_idx][cand_order], np.arange(len(chunk_bounds)))
+
+    ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
+    n_psms = 0
+    n_ions = 0
+    search_stats = []
+
+    for chunk_idx, (chunk_start, chunk_end) in enumerate(zip(chunk_bounds[:-1], chunk_bounds[1:])):
+        chunk = order[chunk_start:chunk_end]
+        chunk_features = features.iloc[chunk].reset_index(drop=True)
+        # The fragments of the chunk are stored in a shallow copy to be reused by get_score_columns
+        chunk_query_data = dict(query_data)
+        if 'mass_list_ms2' in query_data:
+            get_feature_fragments(chunk_query_data, chunk_features, cache=True)
+        else:
+            query_selection = chunk_features['query_idx'].values.astype(np.int64)
+            chunk_query_data['feature_fragments'] = (query_selection, ms_file_.read_DDA_query_fragments(query_selection, calibrated_fragments=True, deisotoped=deisotoped))
+
+        if candidates is not None:
+            chunk_cand = cand_order[cand_bounds[chunk_idx]:cand_bounds[chunk_idx + 1]]
+            chunk_candidates = candidates.iloc[chunk_cand].reset_index(drop=True)
+            chunk_candidates['query_idx'] = query_pos[cand_query_idx[chunk_cand]]
+            psms, search_stats_ = candidate_search(chunk_query_data, db_data, chunk_features, chunk_candidates, **kwargs)
+        else:
+            psms, search_stats_ = get_psms(chunk_query_data, db_data, chunk_features, **kwargs)
+        search_stats.append(search_stats_)
+
+        if len(psms) == 0:
+            continue
+
+        psms, fragment_ions = get_score_columns(psms, chunk_query_data, db_data, chunk_features, **kwargs)
+
+        # Refer to the features of the file and to the rows of the appended datasets
+        psms['query_idx'] = chunk[psms['query_idx']]
+        psms['fragment_ion_idx'] = psms['fragment_ion_idx'] + n_ions
+        fragment_ions[:, 8] += n_psms
+
+        if n_psms == 0:
+            # Truncate the results of a previous search
+            ms_file_.write(save_field, overwrite=True)
+            ms_file_.write('fragment_ions', overwrite=True)
+
+        ms_file_.append(psms.to_df(), dataset_name=save_field)
+        ms_file_.append(pd.DataFrame(fragment_ions, columns = ION_COLUMNS), dataset_name='fragment_ions')
+
+        n_psms += len(psms)
+        n_ions += len(fragment_ions)
+
+    logging.info('Saved {:,} psms of {:,} chunks to {}.'.format(n_psms, len(chunk_bounds) - 1, ms_file))
+
+    return n_psms, combine_search_stats(search_stats)
+
+
+# Cell
+import hashlib
+import json
+from .interface import parallel_execute, wrapped_partial
+
+def read_cluster_run(file_name:str, settings:dict, db_masses:np.ndarray, first_search:bool = True)->Union[dict, None]:
+    """Read the binned spectra and the precursor windows of a file for the clustered search.
+    The query data itself is not kept in memory.
+
+    Args:
+        file_name (str): Path to the raw file.
+        settings (dict): The experiment settings.
+        db_masses (np.ndarray): Precursor masses of the database.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+
+    Returns:
+        Union[dict, None]: The binned spectra, precursor data and windows of the file. None if the search of the file is skipped.
+    """
+    ms_file = os.path.splitext(file_name)[0] + ".ms_data.hdf"
+    ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
+
+    # Remove the candidates of a previous search, so that search_db does not rescore them
+    ms_file_.write('cluster_candidates', overwrite=True)
+
+    file_settings = copy.deepcopy(settings)
+    if (not first_search) and set_calibrated_tolerances(ms_file_, file_settings):
+        return None
+
+    search_settings = file_settings['search']
+    ppm = search_settings['ppm']
+    query_data = ms_file_.read_DDA_query_data(
+        calibrated_fragments=True,
+        database_file_name=settings['experiment']['database_path'],
+        deisotoped=settings.get('raw', {}).get('ms2_deisotope', False)
+    )
+    features = ms_file_.read(dataset_name="features")
+    query_indices, query_frags, query_ints = get_feature_fragments(query_data, features)
+
+    prec_tol = search_settings['prec_tol']
+    frag_tol = search_settings['frag_tol']
+    if search_settings.get('frag_tol_calibrated'):
+        frag_tol = search_settings['frag_tol_calibrated']
+    if search_settings.get('prec_tol_calibrated'):
+        prec_tol = search_settings['prec_tol_calibrated']
+        masses = features['corrected_mass'].values
+    else:
+        masses = features['mass_matched'].values
+    if search_settings.get('prec_tol_adaptive', False) and search_settings.get('prec_tol_calibrated'):
+        prec_tol = get_prec_tols(features, prec_tol, ppm, search_settings['prec_tol_adaptive_min'], search_settings['prec_tol_adaptive_max'], search_settings['prec_tol_adaptive_std'])
+
+    if ppm:
+        mass_tols = ppm_to_dalton(masses, prec_tol)
+    else:
+        mass_tols = np.zeros(len(masses)) + prec_tol
+    idxs_lower, idxs_higher = get_idxs(db_masses, masses, prec_tol, ppm)
+
+    cache_key = ''
+    if search_settings.get('result_cache_path'):
+        result_cache = SearchResultCache(search_settings['result_cache_path'], search_settings.get('result_cache_size', 10240))
+        cache_key = result_cache.get_key(query_data, features, settings['experiment']['database_path'], search_settings, first_search)
+
+    bin_indptr, bins, weights = bin_spectra(query_indices, query_frags, query_ints, CLUSTER_BIN_WIDTH)
+
+    run = {
+        'file_name': file_name, 'ms_file': ms_file, 'frag_tol': frag_tol, 'cache_key': cache_key,
+        'masses': masses, 'charges': features['charge_matched'].values.astype(np.int64), 'mass_tols': mass_tols,
+        'idxs_lower': idxs_lower, 'idxs_higher': idxs_higher,
+        'bin_indptr': bin_indptr, 'bins': bins, 'weights': weights,
+    }
+    run['nbytes'] = sum(_.nbytes for _ in run.values() if isinstance(_, np.ndarray))
+
+    return run
+
+def get_cluster_groups(settings:dict, db_masses:np.ndarray, first_search:bool = True, failed:list = None):
+    """Read the files for the clustered search and group them, so that the binned spectra of a group fit into the memory limit.
+
+    Args:
+        settings (dict): The experiment settings.
+        db_masses (np.ndarray): Precursor masses of the database.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+        failed (list, optional): List to which files are added that could not be read. Defaults to None.
+
+    Yields:
+        list: The runs of a group, see `read_cluster_run`.
+    """
+    memory_limit = settings['search'].get('search_memory_limit', 0)
+    group = []
+    group_bytes = 0
+
+    for file_idx, file_name in enumerate(settings['experiment']['file_paths']):
+        try:
+            run = read_cluster_run(file_name, settings, db_masses, first_search)
+        except Exception as e:
+            logging.error(f'Reading of file {file_name} for clustered search failed. Exception {e}.')
+            if failed is not None:
+                failed.append(file_name)
+            continue
+
+        if run is None:
+            continue
+        run['file_idx'] = file_idx
+
+        if group and (memory_limit > 0) and (group_bytes + run['nbytes'] > memory_limit * 1024**3):
+            yield group
+            group = []
+            group_bytes = 0
+
+        group.append(run)
+        group_bytes += run['nbytes']
+
+    if group:
+        yield group
+
+def search_cluster_group(runs:list, settings:dict, db_data:Union[dict, str], db_masses:np.ndarray, first_search:bool = True)->list:
+    """Cluster the spectra of a group of files, search the consensus spectrum of each cluster and save the candidates of the members.
+
+    Args:
+        runs (list): The runs of the group, see `read_cluster_run`.
+        settings (dict): The experiment settings.
+        db_data (Union[dict, str]): Data structure containing the database data or path to database.
+        db_masses (np.ndarray): Precursor masses of the database.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+
+    Returns:
+        list: The files with saved candidates. Files whose results were found in the result cache are not included.
+    """
+    ppm = settings['search']['ppm']
+    min_similarity = settings['search'].get('cluster_min_similarity', 0.7)
+    memory_limit = settings['search'].get('search_memory_limit', 0)
+
+    # The results of a file depend on all files of its group
+    if all(_['cache_key'] for _ in runs):
+        hash_ = hashlib.sha256()
+        for run in runs:
+            hash_.update(run['cache_key'].encode())
+        hash_.update(json.dumps([min_similarity, CLUSTER_BIN_WIDTH, CLUSTER_TOP_N, CLUSTER_INDEX_PEAKS, CLUSTER_CONSENSUS_FRACTION]).encode())
+        group_key = hash_.hexdigest()
+        for run in runs:
+            run['cache_key'] = hashlib.sha256((run['cache_key'] + group_key).encode()).hexdigest()
+
+        result_cache = SearchResultCache(settings['search']['result_cache_path'], settings['search'].get('result_cache_size', 10240))
+        cache_fields = ['first_search' if first_search else 'second_search', 'fragment_ions']
+        if all(result_cache.load(_['cache_key'], _['ms_file'], cache_fields) for _ in runs):
+            logging.info(f'Found search results of {len(runs):,} files in cache.')
+            return []
+
+    run_offsets = np.cumsum([0] + [len(_['masses']) for _ in runs])
+    bin_offsets = np.cumsum([0] + [len(_['bins']) for _ in runs])
+    n_spectra = run_offsets[-1]
+
+    masses = np.concatenate([_['masses'] for _ in runs])
+    charges = np.concatenate([_['charges'] for _ in runs])
+    mass_tols = np.concatenate([_['mass_tols'] for _ in runs])
+    idxs_lower = np.concatenate([_['idxs_lower'] for _ in runs])
+    idxs_higher = np.concatenate([_['idxs_higher'] for _ in runs])
+    bin_indptr = np.concatenate([np.zeros(1, np.int64)] + [_['bin_indptr'][1:] + offset for _, offset in zip(runs, bin_offsets)])
+    bins = np.concatenate([_['bins'] for _ in runs])
+    weights = np.concatenate([_['weights'] for _ in runs])
+
+    labels = cluster_spectra(np.lexsort((masses, charges)), masses, charges, mass_tols, bin_indptr, bins, weights, min_similarity)
+    reps, rep_of = np.unique(labels, return_inverse=True)
+    n_reps = len(reps)
+    del bin_indptr, bins, weights
+
+    logging.info(f'Clustered {n_spectra:,} spectra of {len(runs):,} files into {n_reps:,} clusters.')
+
+    # The consensus spectrum is searched with a precursor window that covers all members
+    rep_lower = np.zeros(n_reps, np.int64) + len(db_masses)
+    rep_higher = np.zeros(n_reps, np.int64)
+    np.minimum.at(rep_lower, rep_of, idxs_lower)
+    np.maximum.at(rep_higher, rep_of, idxs_higher)
+    rep_masses = masses[reps]
+
+    # Merge the fragments of the members, the files are read one at a time
+    peak_clusters, peak_frags, peak_ints = [], [], []
+    for run, start in zip(runs, run_offsets):
+        ms_file_ = alphapept.io.MS_Data_File(run['ms_file'])
+        query_data = ms_file_.read_DDA_query_data(
+            calibrated_fragments=True,
+            database_file_name=settings['experiment']['database_path'],
+            deisotoped=settings.get('raw', {}).get('ms2_deisotope', False)
+        )
+        features = ms_file_.read(dataset_name="features")
+        run_indices, run_frags, run_ints = get_feature_fragments(query_data, features)
+        peak_clusters.append(np.repeat(rep_of[start:start + len(features)], np.diff(run_indices)))
+        peak_frags.append(run_frags)
+        peak_ints.append(run_ints)
+        del query_data, features
+
+    peak_clusters = np.concatenate(peak_clusters)
+    peak_frags = np.concatenate(peak_frags)
+    peak_ints = np.concatenate(peak_ints)
+    order = np.lexsort((peak_frags, peak_clusters))
+    rep_frag_tol = max(_['frag_tol'] for _ in runs)
+    rep_indices, rep_frags, rep_ints = consensus_spectra(peak_clusters[order], peak_frags[order], peak_ints[order], np.bincount(rep_of, minlength=n_reps), rep_frag_tol, ppm, CLUSTER_CONSENSUS_FRACTION)
+    del peak_clusters, peak_frags, peak_ints
+
+    # Search the consensus spectra in chunks of similar precursor mass within the memory limit
+    if isinstance(db_data, str):
+        n_db_frags = alphapept.io.HDF_File(db_data).read(dataset_name='fragmasses', return_dataset_shape=True)[0]
+    else:
+        n_db_frags = len(db_data['fragmasses'])
+    db_entry_bytes = n_db_frags / max(len(db_masses), 1) * DB_FRAGMENT_BYTES
+    max_bytes = memory_limit * 1024**3 if memory_limit > 0 else np.inf
+
+    order = np.argsort(rep_masses, kind='stable')
+    chunk_bounds = get_memory_chunks(np.diff(rep_indices)[order] * QUERY_FRAGMENT_BYTES, rep_lower[order], rep_higher[order], db_entry_bytes, max_bytes)
+
+    logging.info(f'Performing search on {n_reps:,} consensus spectra in {len(chunk_bounds) - 1:,} chunks and {len(db_masses):,} db entries.')
+
+    best_hits = np.zeros((n_reps, CLUSTER_TOP_N), dtype=np.int_)-1
+
+    for chunk_start, chunk_end in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+        chunk = order[chunk_start:chunk_end]
+
+        if isinstance(db_data, str):
+            db_offset = rep_lower[chunk].min()
+            db_slice = read_database_slice(db_data, db_offset, max(rep_higher[chunk].max(), db_offset), array_names = ['fragmasses'])
+            db_frags = db_slice['fragmasses']
+            db_indices = db_slice['indices']
+        else:
+            db_offset = 0
+            db_frags = db_data['fragmasses']
+            db_indices = db_data['indices']
+
+        chunk_indices, chunk_frags, chunk_ints = gather_query_fragments(rep_indices, chunk, rep_frags, rep_ints)
+        chunk_lower = rep_lower[chunk] - db_offset
+        chunk_higher = rep_higher[chunk] - db_offset
+
+        chunk_hits = np.zeros((len(chunk), CLUSTER_TOP_N), dtype=np.int_)-1
+        score = np.zeros((len(chunk), CLUSTER_TOP_N), dtype=np.float_)
+        pruned = np.zeros(len(chunk), dtype=np.int64)
+
+        n_tiles = min(len(chunk), alphapept.performance.MAX_WORKER_COUNT * TILES_PER_WORKER)
+        tile_indptr, tile_queries = get_query_tiles(rep_masses[chunk], chunk_lower, chunk_higher, n_tiles)
+        compare_spectrum_tiles(range(len(tile_indptr) - 1), tile_indptr, tile_queries, chunk_lower, chunk_higher, chunk_indices, chunk_frags, chunk_ints, db_indices, db_frags, chunk_hits, score, rep_frag_tol, ppm, pruned)
+
+        best_hits[chunk] = np.where(chunk_hits >= 0, chunk_hits + db_offset, -1)
+
+    # Propagate the candidates of each cluster to its members within their own precursor window
+    cand_query_idx = np.repeat(np.arange(n_spectra), CLUSTER_TOP_N)
+    cand_db_idx = best_hits[rep_of].ravel()
+    valid = (cand_db_idx >= idxs_lower[cand_query_idx]) & (cand_db_idx < idxs_higher[cand_query_idx])
+    cand_query_idx = cand_query_idx[valid]
+    cand_db_idx = cand_db_idx[valid]
+
+    cand_bounds = np.searchsorted(cand_query_idx, run_offsets)
+    for i, run in enumerate(runs):
+        candidates = pd.DataFrame({
+            'query_idx': cand_query_idx[cand_bounds[i]:cand_bounds[i + 1]] - run_offsets[i],
+            'db_idx': cand_db_idx[cand_bounds[i]:cand_bounds[i + 1]],
+        })
+        save_cluster_candidates(candidates, run['ms_file'], first_search, run['cache_key'])
+
+    return [_['file_name'] for _ in runs]
+
+#This function is a wrapper and ist tested by the quick_test
+def search_db_clustered(settings:dict, first_search:bool = True, callback:Callable = None) -> dict:
+    """Database search of all files that searches clusters of similar spectra only once.
+    The files are read in groups whose binned spectra fit into the memory limit (`search_memory_limit`).
+    The spectra of a group are clustered by charge, precursor mass and fragment similarity and the consensus spectrum of each cluster is searched.
+    The candidates of a cluster are rescored for all members of the cluster with `search_db`.
+
+    Args:
+        settings (dict): The experiment settings.
+        first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+        callback (Callable, optional): Callback function to indicate progress. Defaults to None.
+
+    Returns:
+        dict: The settings with the failed files.
+    """
+    if 'failed' not in settings:
+        settings['failed'] = {}
+
+    n_files = len(settings['experiment']['file_paths'])
+    db_data = get_db_data(settings)
+
+    if isinstance(db_data, str):
+        db_masses = read_database(db_data, array_name = 'precursors')
+    else:
+        db_masses = db_data['precursors']
+
+    failed = []
+
+    for group in get_cluster_groups(settings, db_masses, first_search, failed):
+        group_files = [_['file_name'] for _ in group]
+        try:
+            rescore_files = search_cluster_group(group, settings, db_data, db_masses, first_search)
+        except Exception as e:
+            logging.error(f'Clustered search of files {group_files} failed. Exception {e}.')
+            failed.extend(group_files)
+            rescore_files = []
+
+        if len(rescore_files) > 0:
+            group_settings = copy.deepcopy(settings)
+            group_settings['experiment']['file_paths'] = rescore_files
+            group_settings['failed'] = {}
+            group_settings = parallel_execute(group_settings, wrapped_partial(search_db, first_search = first_search))
+            failed.extend(group_settings['failed']['search_db'])
+
+        if callback:
+            callback((group[-1]['file_idx'] + 1) / n_files)
+
+    # The first and the second search report their failed files separately, as in parallel_execute
+    settings['failed']['search_db_clustered' if first_search else 'search_db_clustered_2'] = failed
+
+    return settings
+
+# Cell
+from collections import OrderedDict
+
+class QueryDataCache():
+    """Process-local LRU cache for the query data and features of ms_data files.
+
+    Args:
+        max_size (float): Memory budget of the cache in Mb. Defaults to 2048.
+    """
+    def __init__(self, max_size:float=2048):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self)->int:
+        return len(self._cache)
+
+    @property
+    def size(self)->float:
+        """Size of all cached entries in Mb."""
+        return sum(self._sizes.values())
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self._cache.clear()
+        self._sizes.clear()
+
+    def get(self, ms_file:str, deisotoped:bool = False)->(dict, pd.DataFrame):
+        """Get the query data and features of an ms_data file.
+
+        Args:
+            ms_file (str): Path to the ms_data file.
+            deisotoped (bool, optional): Flag to use the deisotoped MS2 spectra. Defaults to False.
+
+        Returns:
+            dict: Data structure containing the query data.
+            pd.DataFrame: Pandas dataframe containing feature data. None if the file has no features.
+        """
+        path = os.path.abspath(ms_file)
+        key = (path, os.path.getmtime(path), deisotoped)
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        for old_key in [_ for _ in self._cache if _[0] == path]:
+            del self._cache[old_key]
+            del self._sizes[old_key]
+
+        ms_data = alphapept.io.MS_Data_File(path)
+        query_data = ms_data.read_DDA_query_data(swmr=True, deisotoped=deisotoped)
+
+        try:
+            features = ms_data.read(dataset_name="features", swmr=True)
+        except FileNotFoundError:
+            features = None
+        except KeyError:
+            features = None
+
+        if features is not None:
+            get_feature_fragments(query_data, features, cache=True)
+
+        size = sum(getattr(_, 'nbytes', 0) for _ in query_data.values())
+        if features is not None:
+            query_selection, feature_fragments = query_data['feature_fragments']
+            size += query_selection.nbytes + sum(_.nbytes for _ in feature_fragments)
+            size += features.memory_usage(deep=True).sum()
+
+        self._cache[key] = (query_data, features)
+        self._sizes[key] = size / 1024**2
+
+        while (self.size > self.max_size) and (len(self._cache) > 1):
+            old_key, _ = self._cache.popitem(last=False)
+            del self._sizes[old_key]
+
+        return query_data, features
+
+
+QUERY_DATA_CACHE = QueryDataCache()
+
+
 # Cell
 
-from .fasta import blocks, generate_peptides, add_to_pept_dict
+from .fasta import blocks, generate_peptides_block, add_to_pept_dict
 from .io import list_to_numpy_f32
-from .fasta import block_idx, generate_fasta_list, generate_spectra, check_peptide
+from .fasta import block_idx, read_fasta_blocks, read_fasta_file_entries, generate_spectra, check_peptide
 from alphapept import constants
 mass_dict = constants.mass_dict
 import os
@@ -1004,10 +3039,10 @@ def search_fasta_block(to_process:tuple) -> (list, int):
     For searches with big fasta files or unspecific searches.
 
     Args:
-        to_process (tuple): Tuple containing a fasta_index, fasta_block, a list of files and a list of experimental settings.
+        to_process (tuple): Tuple containing a fasta_index, fasta_block (FastaBlock), a list of files and a list of experimental settings.
 
     Returns:
-        list: A list of dataframes when searching the respective file.
+        list: A list of tuples (PSMs, peptide dictionary of the PSMs) when searching the respective file.
         int: Number of new peptides that were generated in this iteration.
     """
 
@@ -1016,24 +3051,21 @@ def search_fasta_block(to_process:tuple) -> (list, int):
 
         settings_ = settings[0]
         spectra_block = settings_['fasta']['spectra_block']
+        if 'query_cache_size' in settings_['search']:
+            QUERY_DATA_CACHE.max_size = settings_['search']['query_cache_size']
         to_add = List()
 
         psms_container = [list() for _ in ms_files]
 
-        f_index = 0
-
         pept_dict = {}
-        for element in fasta_block:
-            sequence = element["sequence"]
-            mod_peptides = generate_peptides(sequence, **settings_['fasta'])
+        all_peptides = generate_peptides_block(fasta_block.get_sequences(), **settings_['fasta'])
+        for f_index, mod_peptides in enumerate(all_peptides):
 
             pept_dict, added_peptides = add_to_pept_dict(pept_dict, mod_peptides, fasta_index+f_index)
 
             if len(added_peptides) > 0:
                 to_add.extend(added_peptides)
 
-            f_index += 1
-
 
         if len(to_add) > 0:
             for seq_block in blocks(to_add, spectra_block):
@@ -1075,18 +3107,7 @@ def search_fasta_block(to_process:tuple) -> (list, int):
                 db_data["indices"] = indices
 
                 for file_idx, ms_file in enumerate(ms_files):
-                    query_data = alphapept.io.MS_Data_File(
-                        f"{ms_file}"
-                    ).read_DDA_query_data(swmr=True)
-
-                    try:
-                        features = alphapept.io.MS_Data_File(
-                            ms_file
-                        ).read(dataset_name="features",swmr=True)
-                    except FileNotFoundError:
-                        features = None
-                    except KeyError:
-                        features = None
+                    query_data, features = QUERY_DATA_CACHE.get(ms_file, deisotoped=settings[file_idx].get('raw', {}).get('ms2_deisotope', False))
 
                     psms, num_specs_compared = get_psms(query_data, db_data, features, **settings[file_idx]["search"])
 
@@ -1094,12 +3115,9 @@ def search_fasta_block(to_process:tuple) -> (list, int):
                         #This could be speed up..
                         psms, fragment_ions = get_score_columns(psms, query_data, db_data, features, **settings[file_idx]["search"])
 
-                        fasta_indices = [set(x for x in pept_dict[_]) for _ in psms['sequence']]
-
-                        psms_df = pd.DataFrame(psms)
-                        psms_df['fasta_index'] = fasta_indices
+                        pept_dict_ = {_: pept_dict[_] for _ in set(psms['sequence'])}
 
-                        psms_container[file_idx].append(psms_df)
+                        psms_container[file_idx].append((psms, pept_dict_))
 
         success = True
 
@@ -1144,62 +3162,257 @@ def filter_top_n(temp:pd.DataFrame, top_n:int = 10)-> pd.DataFrame:
     return temp
 
 
+# Cell
+
+class PSMTopN():
+    """Accumulator that keeps the top n PSMs (based on hits) for each raw_idx of a file.
+    PSMs with the same raw_idx, sequence, hits and feature_idx are only stored once.
+    Proteins (fasta indices) are combined for sequences.
+
+    Args:
+        top_n (int, optional): Number of top-n entries to be kept. Defaults to 10.
+    """
+    def __init__(self, top_n:int = 10):
+        self.top_n = top_n
+        self.columns = {}
+        self.hits = np.zeros((0, top_n))
+        self.pept_ids = np.zeros((0, top_n), dtype=np.int64)
+        self.peptides = {}
+        self.proteins = []
+
+    def __len__(self)->int:
+        return int(np.sum(self.hits > -np.inf))
+
+    def _resize(self, n_raw:int):
+        """Grows all slot arrays so that they can hold n_raw spectra."""
+        n_old = len(self.hits)
+        if n_raw <= n_old:
+            return
+        n_raw = max(n_raw, 2 * n_old)
+
+        hits = np.full((n_raw, self.top_n), -np.inf)
+        hits[:n_old] = self.hits
+        self.hits = hits
+
+        pept_ids = np.zeros((n_raw, self.top_n), dtype=np.int64)
+        pept_ids[:n_old] = self.pept_ids
+        self.pept_ids = pept_ids
+
+        for key, column in self.columns.items():
+            column_ = np.zeros((n_raw, self.top_n), dtype=column.dtype)
+            column_[:n_old] = column
+            self.columns[key] = column_
+
+    def _get_pept_ids(self, sequences:np.ndarray, pept_dict:dict)->np.ndarray:
+        """Maps sequences to peptide ids and adds their proteins to the side table."""
+        pept_ids = np.zeros(len(sequences), dtype=np.int64)
+        for i, seq in enumerate(sequences):
+            if seq not in self.peptides:
+                self.peptides[seq] = len(self.proteins)
+                self.proteins.append(set())
+            pept_ids[i] = self.peptides[seq]
+
+        for seq in set(sequences):
+            self.proteins[self.peptides[seq]].update(pept_dict[seq])
+
+        return pept_ids
+
+    def add(self, psms:Union[np.ndarray, PSMColumns], pept_dict:dict):
+        """Merges new PSMs.
+
+        Args:
+            psms (Union[np.ndarray, PSMColumns]): Numpy recordarray or PSMColumns storing the PSMs. Needs raw_idx, sequence, hits and feature_idx.
+            pept_dict (dict): Peptide dictionary to look up the fasta indices of the sequences.
+        """
+        if len(psms) == 0:
+            return
+
+        for key in psms.dtype.names:
+            if key not in self.columns:
+                dtype = object if psms.dtype[key].kind in 'US' else psms.dtype[key]
+                self.columns[key] = np.zeros(self.hits.shape, dtype=dtype)
+
+        raw_idx = psms['raw_idx'].astype(np.int64)
+        self._resize(raw_idx.max() + 1)
+
+        pept_ids = self._get_pept_ids(psms['sequence'], pept_dict)
+
+        # Candidates are the stored PSMs of affected spectra followed by the new PSMs
+        affected = np.unique(raw_idx)
+        raw_, slot_ = np.nonzero(self.hits[affected] > -np.inf)
+        raw_ = affected[raw_]
+        n_stored = len(raw_)
+
+        c_raw = np.concatenate([raw_, raw_idx])
+        c_hits = np.concatenate([self.hits[raw_, slot_], psms['hits']])
+        c_pept_ids = np.concatenate([self.pept_ids[raw_, slot_], pept_ids])
+        c_feature_idx = np.concatenate([self.columns['feature_idx'][raw_, slot_], psms['feature_idx']])
+        c_order = np.arange(len(c_raw))
+
+        # Keep first occurence of duplicates
+        order = np.lexsort((c_order, c_feature_idx, c_hits, c_pept_ids, c_raw))
+        keys = np.stack([c_raw[order], c_pept_ids[order], c_hits[order], c_feature_idx[order]])
+        duplicate = np.zeros(len(order), dtype=np.bool_)
+        duplicate[1:] = np.all(keys[:, 1:] == keys[:, :-1], axis=0)
+        unique = np.sort(order[~duplicate])
+
+        # Rank by hits within each raw_idx
+        order = unique[np.lexsort((c_order[unique], -c_hits[unique], c_raw[unique]))]
+        raw_sorted = c_raw[order]
+        group_start = np.searchsorted(raw_sorted, raw_sorted, side='left')
+        rank = np.arange(len(order)) - group_start
+
+        keep = rank < self.top_n
+        selected = order[keep]
+        raw_new = raw_sorted[keep]
+        slot_new = rank[keep]
+
+        from_stored = selected < n_stored
+        from_psms = selected[~from_stored] - n_stored
+
+        for key, column in self.columns.items():
+            values = np.empty(len(selected), dtype=column.dtype)
+            values[from_stored] = column[raw_[selected[from_stored]], slot_[selected[from_stored]]]
+            if key in psms.dtype.names:
+                values[~from_stored] = psms[key][from_psms]
+            column[raw_new, slot_new] = values
+
+        self.hits[affected] = -np.inf
+        self.hits[raw_new, slot_new] = c_hits[selected]
+        self.pept_ids[raw_new, slot_new] = c_pept_ids[selected]
+
+    def to_df(self)->pd.DataFrame:
+        """Converts the stored PSMs to a DataFrame sorted by hits.
+
+        Returns:
+            pd.DataFrame: Pandas DataFrame containing PSMs and their fasta_index.
+        """
+        mask = self.hits > -np.inf
+        order = np.argsort(-self.hits[mask], kind='stable')
+
+        df = pd.DataFrame({key: column[mask][order] for key, column in self.columns.items()})
+        df['fasta_index'] = [self.proteins[_] for _ in self.pept_ids[mask][order]]
+
+        return df
+
+
 # Cell
 import psutil
+import numba
 import alphapept.constants as constants
 from .fasta import get_fragmass, parse
 
-def ion_extractor(df: pd.DataFrame, ms_file, frag_tol:float, ppm:bool)->(np.ndarray, np.ndarray):
+@njit
+def get_sequence_fragments(sequences:List, mass_dict:numba.typed.Dict)->(np.ndarray, np.ndarray, np.ndarray):
+    """Calculates the fragment masses and types of multiple sequences.
+
+    Args:
+        sequences (List): Typed list with the (modified) sequences.
+        mass_dict (numba.typed.Dict): Dictionary with the masses of the amino acids.
+
+    Returns:
+        np.ndarray: Array with indices to the fragments of each sequence.
+        np.ndarray: Array with fragment masses.
+        np.ndarray: Array with fragment types.
+    """
+    frag_list = List()
+    type_list = List()
+    indices = np.zeros(len(sequences) + 1, dtype=np.int64)
+
+    for i in range(len(sequences)):
+        frag_masses, frag_type = get_fragmass(parse(sequences[i]), mass_dict)
+        frag_list.append(frag_masses)
+        type_list.append(frag_type)
+        indices[i + 1] = indices[i] + len(frag_masses)
+
+    frags = np.zeros(indices[-1], dtype=np.float64)
+    types = np.zeros(indices[-1], dtype=np.int8)
+
+    for i in range(len(sequences)):
+        frags[indices[i]:indices[i + 1]] = frag_list[i]
+        types[indices[i]:indices[i + 1]] = type_list[i]
+
+    return indices, frags, types
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def extract_hits(psm_idx:int, psms_query_idx:np.ndarray, psms_seq_idx:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, seq_indices:np.ndarray, seq_frags:np.ndarray, seq_types:np.ndarray, mtol:float, ppm:bool, losses:np.ndarray, fragment_ion_idx:np.ndarray, fragment_ions:np.ndarray):
+    """Matches the fragment_ions of a PSM and writes them to the preallocated fragment_ions array starting at fragment_ion_idx.
+
+    Args:
+        psm_idx (int): Integer to the PSM that should be matched.
+        psms_query_idx (np.ndarray): Array with the query indices of the PSMs.
+        psms_seq_idx (np.ndarray): Array with the sequence indices of the PSMs.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        seq_indices (np.ndarray): Array with indices to the fragments of each sequence.
+        seq_frags (np.ndarray): Array with the fragment masses of the sequences.
+        seq_types (np.ndarray): Array with the fragment types of the sequences.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (np.ndarray): Array with losses.
+        fragment_ion_idx (np.ndarray): Array with the start of the fragment_ions of each PSM.
+        fragment_ions (np.ndarray): Reporting array that stores the ion information.
+    """
+    query_idx = psms_query_idx[psm_idx]
+    seq_idx = psms_seq_idx[psm_idx]
+    query_frag = query_frags[query_indices[query_idx]:query_indices[query_idx + 1]]
+    query_int = query_ints[query_indices[query_idx]:query_indices[query_idx + 1]]
+    db_frag = seq_frags[seq_indices[seq_idx]:seq_indices[seq_idx + 1]]
+    frag_type = seq_types[seq_indices[seq_idx]:seq_indices[seq_idx + 1]]
+    db_int = np.ones(len(db_frag))
+
+    ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, losses)
+
+    start = fragment_ion_idx[psm_idx]
+    for i in range(len(ions)):
+        for j in range(8):
+            fragment_ions[start + i, j] = ions[i, j]
+        fragment_ions[start + i, 8] = psm_idx
+
+
+def ion_extractor(df: pd.DataFrame, ms_file, frag_tol:float, ppm:bool, deisotoped:bool = False)->(PSMColumns, np.ndarray):
     """Extracts the matched hits (fragment_ions) from a dataframe.
+    Fragments are calculated once per unique sequence and all PSMs are matched in parallel.
 
     Args:
         df (pd.DataFrame): Pandas dataframe containing the results of the first search.
         ms_file : MsFile
         frag_tol (float): Fragment tolerance for search.
         ppm (bool): Flag to use ppm instead of Dalton.
+        deisotoped (bool, optional): Flag to use the deisotoped MS2 spectra. Defaults to False.
 
     Returns:
-        np.ndarray: Numpy recordarray storing the PSMs.
+        PSMColumns: Column-wise PSMs.
         np.ndarray: Numpy recordarray storing the fragment_ions.
     """
 
-    query_data = ms_file.read_DDA_query_data()
+    query_data = ms_file.read_DDA_query_data(deisotoped=deisotoped)
     query_indices = query_data["indices_ms2"]
     query_frags = query_data['mass_list_ms2']
     query_ints = query_data['int_list_ms2']
 
-    psms = df.to_records()
-
-    ion_count = 0
-
-    ions_ = List()
+    psms = PSMColumns(df.reset_index())
+    n_psms = len(psms)
 
-    for i in range(len(psms)):
-        query_idx = psms[i]["raw_idx"]
-        db_idx = psms[i]["db_idx"]
-        query_idx_start = query_indices[query_idx]
-        query_idx_end = query_indices[query_idx + 1]
-        query_frag = query_frags[query_idx_start:query_idx_end]
-        query_int = query_ints[query_idx_start:query_idx_end]
+    sequences, psms_seq_idx = np.unique(psms['sequence'].astype(str), return_inverse=True)
+    seq_indices, seq_frags, seq_types = get_sequence_fragments(List(sequences), constants.mass_dict)
 
-        seq = psms[i]['sequence']
+    psms_query_idx = psms['raw_idx'].astype(np.int64)
+    psms_seq_idx = psms_seq_idx.astype(np.int64)
 
-        db_frag, frag_type = get_fragmass(parse(seq), constants.mass_dict)
-        db_int = np.ones_like(db_frag)
+    n_hits = np.zeros(n_psms, dtype=np.int64)
+    count_hits(range(n_psms), psms_query_idx, psms_seq_idx, query_indices, query_frags, seq_indices, seq_frags, frag_tol, ppm, LOSSES, n_hits)
 
-        fragment_ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, frag_tol, ppm, LOSSES)
+    fragment_ion_idx = np.zeros(n_psms + 1, dtype=np.int64)
+    np.cumsum(n_hits, out=fragment_ion_idx[1:])
 
-        fragment_ions[:,-1] = i
+    ions_ = np.zeros((fragment_ion_idx[-1], 9))
+    extract_hits(range(n_psms), psms_query_idx, psms_seq_idx, query_indices, query_frags, query_ints, seq_indices, seq_frags, seq_types, frag_tol, ppm, LOSSES, fragment_ion_idx, ions_)
 
-        n_fragments_matched = len(fragment_ions)
-
-        psms['n_fragments_matched'][i] = n_fragments_matched
-        psms['fragment_ion_idx'][i] = ion_count
-
-        ion_count += n_fragments_matched
-        ions_.append(fragment_ions)
-
-    ions_ = np.vstack(ions_)
+    psms['n_fragments_matched'] = n_hits.astype(psms['n_fragments_matched'].dtype)
+    psms['fragment_ion_idx'] = fragment_ion_idx[:-1].astype(psms['fragment_ion_idx'].dtype)
 
     return psms, ions_
 
@@ -1216,12 +3429,16 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
         callback (Union[Callable, None], optional): Callback function. Defaults to None.
 
     Returns:
-        dict: FASTA dictionary.
+        FastaMap: FASTA dictionary, which is only read from the FASTA files when it is accessed.
     """
-    fasta_list, fasta_dict = generate_fasta_list(fasta_paths = settings['experiment']['fasta_paths'], **settings['fasta'])
-
     fasta_block = settings['fasta']['fasta_block']
 
+    fasta_paths = settings['experiment']['fasta_paths']
+    if type(fasta_paths) is str:
+        fasta_paths = [fasta_paths]
+
+    n_fasta = sum(read_fasta_file_entries(_) for _ in fasta_paths)
+
     ms_file_path = []
 
     for _ in settings['experiment']['file_paths']:
@@ -1242,8 +3459,13 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
             custom_settings[idx]["search"]["frag_tol_calibrated"] = _
 
 
-    logging.info(f"Number of FASTA entries: {len(fasta_list):,} - FASTA settings {settings['fasta']}")
-    to_process = [(idx_start, fasta_list[idx_start:idx_end], ms_file_path, custom_settings) for idx_start, idx_end in block_idx(len(fasta_list), fasta_block)]
+    logging.info(f"Number of FASTA entries: {n_fasta:,} - FASTA settings {settings['fasta']}")
+
+    def get_to_process(selected=None):
+        # The blocks are read while the workers search them
+        for i, block in enumerate(read_fasta_blocks(fasta_paths, fasta_block)):
+            if (selected is None) or (i in selected):
+                yield (block.index, block, ms_file_path, custom_settings)
 
     memory_available = psutil.virtual_memory().available/1024**3
 
@@ -1258,36 +3480,26 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
 
     n_seqs_ = 0
 
-    df_cache = {}
-    ion_cache = {}
+    top_n_cache = {_: PSMTopN() for _ in ms_file_path}
 
-    failed = []
-    to_process_ = []
+    failed = set()
 
     with alphapept.performance.AlphaPool(n_processes) as p:
-        max_ = len(to_process)
+        max_ = max(1, -(-n_fasta // fasta_block))
 
-        for i, (psm_container, n_seqs, success) in enumerate(p.imap_unordered(search_fasta_block, to_process)):
+        for i, (psm_container, n_seqs, success) in enumerate(alphapept.performance.bounded_imap(p, search_fasta_block, get_to_process(), 2 * n_processes)):
             n_seqs_ += n_seqs
 
             logging.info(f'Block {i+1} of {max_} complete - {((i+1)/max_*100):.2f} % - created peptides {n_seqs:,} - total peptides {n_seqs_:,} ')
-            for j in range(len(psm_container)): #Temporary hdf files for avoiding saving issues
-                output = [_ for _ in psm_container[j]]
-                if len(output) > 0:
-                    psms = pd.concat(output)
-                    if ms_file_path[j] in df_cache:
-                        temp = filter_top_n(pd.concat([df_cache[ms_file_path[j]], psms]))
-                        selector = temp['temp_idx'].values
-                        df_cache[ms_file_path[j]] = temp
-                    else:
-                        df_cache[ms_file_path[j]] = psms
+            for j in range(len(psm_container)):
+                for psms, pept_dict in psm_container[j]:
+                    top_n_cache[ms_file_path[j]].add(psms, pept_dict)
 
             if callback:
                 callback((i+1)/max_)
 
             if not success:
-                failed.append(i)
-                to_process_.append(to_process_[i])
+                failed.add(i)
 
     n_failed = len(failed)
     if n_failed > 0:
@@ -1297,26 +3509,19 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
 
         max_ = n_failed
 
-        with alphapept.performance.AlphaPool(n_processes) as p:
-            for i, (psm_container, n_seqs, success) in enumerate(p.imap_unordered(search_fasta_block, to_process_)):
+        with alphapept.performance.AlphaPool(n_processes_) as p:
+            for i, (psm_container, n_seqs, success) in enumerate(alphapept.performance.bounded_imap(p, search_fasta_block, get_to_process(failed), 2 * n_processes_)):
                 n_seqs_ += n_seqs
 
                 logging.info(f'Block {i+1} of {max_} complete - {((i+1)/max_*100):.2f} % - created peptides {n_seqs:,} - total peptides {n_seqs_:,} ')
-                for j in range(len(psm_container)): #Temporary hdf files for avoiding saving issues
-                    output = [_ for _ in psm_container[j]]
-                    if len(output) > 0:
-                        psms = pd.concat(output)
-                        if ms_file_path[j] in df_cache:
-                            temp = filter_top_n(pd.concat([df_cache[ms_file_path[j]], psms]))
-                            selector = temp['temp_idx'].values
-                            df_cache[ms_file_path[j]] = temp
-                        else:
-                            df_cache[ms_file_path[j]] = psms
+                for j in range(len(psm_container)):
+                    for psms, pept_dict in psm_container[j]:
+                        top_n_cache[ms_file_path[j]].add(psms, pept_dict)
 
 
     for idx, _ in enumerate(ms_file_path):
-        if _ in df_cache:
-            x = df_cache[_]
+        if len(top_n_cache[_]) > 0:
+            x = top_n_cache[_].to_df()
             ms_file = alphapept.io.MS_Data_File(_)
 
             x['fasta_index'] = x['fasta_index'].apply(lambda x: ','.join(str(_) for _ in x))
@@ -1336,13 +3541,13 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
 
             logging.info(f'Saving as {save_field}')
 
-            psms, fragment_ions = ion_extractor(x, ms_file, frag_tol, ppm)
+            deisotoped = custom_settings[idx].get('raw', {}).get('ms2_deisotope', False)
+            psms, fragment_ions = ion_extractor(x, ms_file, frag_tol, ppm, deisotoped)
 
-            store_hdf(pd.DataFrame(psms), ms_file, save_field, replace=True)
-            ion_columns = ['ion_index','fragment_ion_type','fragment_ion_int','db_int','fragment_ion_mass','db_mass','query_idx','db_idx','psms_idx']
-            store_hdf(pd.DataFrame(fragment_ions, columns = ion_columns), ms_file, 'fragment_ions', replace=True)
+            store_hdf(psms, ms_file, save_field, replace=True)
+            store_hdf(pd.DataFrame(fragment_ions, columns = ION_COLUMNS), ms_file, 'fragment_ions', replace=True)
 
     #Todo? Callback
     logging.info(f'Complete. Created peptides {n_seqs_:,}')
 
-    return fasta_dict
\ No newline at end of file
+    return alphapept.fasta.FastaMap(fasta_paths, fasta_block)
\ No newline at end of file
@@ -4,6 +4,7 @@ import pandas as pd
 import alphapept.io
 import os
 import psutil
+import hashlib
 import logging
 from alphapept.__version__ import VERSION_NO
 
@@ -335,6 +336,109 @@ def delete_file(filename):
         logging.info(f'Deleted {filename}')
 
 
+class DiskCache():
+    """Persistent LRU cache of hdf files on disk.
+    Entries are named by their key and their modification time marks their last use.
+    Parameters
+    ----------
+    path : str
+        Directory of the cache.
+    max_size : float
+        Size budget of the cache in Mb.
+    """
+
+    _file_hashes = {}
+
+    def __init__(self, path: str, max_size: float):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def _entries(self) -> list:
+        entries = [os.path.join(self.path, _) for _ in os.listdir(self.path) if _.endswith('.hdf')]
+        return sorted(entries, key=os.path.getmtime)
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    @property
+    def size(self) -> float:
+        """Size of all cached entries in Mb."""
+        return sum(os.path.getsize(_) for _ in self._entries())/1024**2
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for entry in self._entries():
+            os.remove(entry)
+
+    def entry_path(self, key: str) -> str:
+        """Path of the entry of a key."""
+        return os.path.join(self.path, key + '.hdf')
+
+    def touch(self, key: str):
+        """Mark the entry of a key as recently used."""
+        os.utime(self.entry_path(key))
+
+    @classmethod
+    def file_hash(cls, file_path: str) -> str:
+        """Hash of the content of a file.
+        The hash is kept per process as long as the file is not modified.
+        Parameters
+        ----------
+        file_path : str
+            Path to the file.
+
+        Returns
+        -------
+        : str
+            The hexdigest of the file.
+        """
+        path = os.path.abspath(file_path)
+        key = (path, os.path.getsize(path), os.path.getmtime(path))
+
+        if key not in cls._file_hashes:
+            hash_ = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(2**24), b''):
+                    hash_.update(chunk)
+            cls._file_hashes[key] = hash_.hexdigest()
+
+        return cls._file_hashes[key]
+
+    def add(self, key: str, write_entry):
+        """Store an entry in the cache.
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+        write_entry : callable
+            Function that writes the entry to the path it is called with.
+        """
+        entry = self.entry_path(key)
+        temp_entry = f'{entry}.{os.getpid()}.tmp'
+
+        write_entry(temp_entry)
+
+        # Other processes only see complete entries
+        os.replace(temp_entry, entry)
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within its size budget."""
+        entries = self._entries()
+        size = sum(os.path.getsize(_) for _ in entries)/1024**2
+
+        for entry in entries:
+            if size <= self.max_size:
+                break
+            size -= os.path.getsize(entry)/1024**2
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+
+
 def log_me(given_function):
     """
     Decorator to track function execution